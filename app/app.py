@@ -1,12 +1,13 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import time
+import functools
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
-from hashlib import md5
 
 
-import requests
+import pika
 from mediahaven import MediaHaven
 from mediahaven.resources.base_resource import MediaHavenPageObject
 from mediahaven.mediahaven import MediaHavenException
@@ -16,24 +17,61 @@ from requests.exceptions import HTTPError, RequestException
 from viaa.configuration import ConfigParser
 from viaa.observability import logging
 
-from app.helpers.events_parser import EventParser
+from app.helpers.events_parser import EVENT_TYPES, EventParser
 from app.helpers.xml_helper import (
     generate_make_subtitle_available_request_xml,
 )
-from app.services.rabbit import RabbitClient
+from app.services.circuit_breaker import (
+    CLOSED,
+    OPEN,
+    CircuitBreaker,
+    CircuitOpenError,
+)
+from app.services.coalescer import Coalescer
+from app.services.fragment_cache import FragmentCache
+from app.services.idempotency import IdempotencyStore
+from app.services import metrics
+from app.services.batcher import Batcher
+from app.services.media_id_store import MediaIdStore
+from app.services.publisher import ConfirmingPublisher, PublishError
+from app.services.rabbit import RabbitClient, ThreadSafeChannel
+from app.services.rate_limiter import AdaptiveRateLimiter
+from app.services.retry import (
+    ORIGINAL_ROUTING_KEY_HEADER,
+    RETRY_ATTEMPTS_HEADER,
+    RetryPolicy,
+    get_attempts,
+    get_routing_key,
+)
+from app.services.sharding import (
+    MEDIA_ID_HEADER,
+    ROLE_ROUTER,
+    ROLE_SHARD,
+    ShardingPolicy,
+)
+from app.services.token_manager import TokenManager
+from app.services.transformer import (
+    ParityTransformer,
+    TransformerClient,
+    XsltTransformer,
+)
+from app.services.versions import VersionStore
+from app.services.worker_pool import WorkerPool
 from app.models.exceptions import InvalidEventException
 
-SLEEP_TIME = 0.7
-
 
 class NackException(Exception):
     """Exception raised when there is a situation in which handling
     of the event should be stopped.
+
+    With `requeue`, the message is retried later. With `redeliver`, it is
+    given back to the broker as is, without using up a retry attempt.
     """
 
-    def __init__(self, message, requeue=False, **kwargs):
+    def __init__(self, message, requeue=False, redeliver=False, **kwargs):
         self.message = message
         self.requeue = requeue
+        self.redeliver = redeliver
         self.kwargs = kwargs
 
 
@@ -43,22 +81,72 @@ class EventListener:
         self.log = logging.get_logger(__name__, config=configParser)
         self.config = configParser.app_cfg
 
+        self.queue_name = self.config["rabbitmq"]["queue"]
+        self.retry_policy = RetryPolicy.from_config(self.config["rabbitmq"]["retry"])
+        worker_count = int(self.config["workers"]["count"])
+
+        self._init_pipeline(worker_count)
+        self._init_broker(worker_count)
+
+    def _init_pipeline(self, worker_count: int):
+        """Sets up everything needed to handle an event, apart from the broker."""
         mediahaven_config = self.config["mediahaven"]
         client_id = mediahaven_config["client_id"]
         client_secret = mediahaven_config["client_secret"]
-        user = mediahaven_config["username"]
-        password = mediahaven_config["password"]
         url = mediahaven_config["host"]
         grant = ROPCGrant(url, client_id, client_secret)
+        # Refreshes the token in the background, for all workers.
+        self.token_manager = TokenManager.from_config(grant, mediahaven_config)
         try:
-            grant.request_token(user, password)
+            self.token_manager.start()
         except RequestTokenError as e:
             self.log.error(e)
             raise e
 
         self.mediahaven_client = MediaHaven(url, grant)
-        self.event_parser = EventParser()
-        self.queue_name = self.config["rabbitmq"]["queue"]
+        # Shared by all calls to MediaHaven, also across workers.
+        self.rate_limiter = AdaptiveRateLimiter.from_config(
+            mediahaven_config["rate_limit"]
+        )
+        self.fragment_cache = FragmentCache.from_config(
+            mediahaven_config["fragment_cache"]
+        )
+        # Per downstream, when one is down consumption is paused.
+        self.breakers = {
+            name: CircuitBreaker.from_config(
+                name, self.config["circuit_breaker"], self._on_breaker_state_change
+            )
+            for name in ("mediahaven_search", "mediahaven_update", "transformer")
+        }
+        for name in self.breakers:
+            metrics.BREAKER_STATE.labels(breaker=name).state("closed")
+        self.idempotency_store = IdempotencyStore(
+            MediaIdStore.from_config(self.config["idempotency"], table="checksums")
+        )
+        self.version_store = VersionStore(
+            MediaIdStore.from_config(self.config["versions"], table="versions")
+        )
+        self.event_parser = EventParser(max_size=int(self.config["parser"]["max_size"]))
+
+        # One connection per concurrent event is enough to never wait for a
+        # connection. Batches apply up to fan_out events at the same time.
+        concurrency = worker_count
+        if int(self.config["batching"]["size"]) > 0:
+            concurrency = max(concurrency, int(self.config["batching"]["fan_out"]))
+        mtd_cfg = self.config["mtd-transformer"]
+        pool_size = max(int(mtd_cfg["pool_size"]), concurrency)
+        self.transformer_client = TransformerClient.from_config(
+            mtd_cfg, pool_size=pool_size
+        )
+        self.transformer = self._create_transformer(mtd_cfg)
+        # Transforms run here while the fragment is looked up.
+        self.transform_executor = ThreadPoolExecutor(
+            max_workers=pool_size, thread_name_prefix="transform"
+        )
+
+    def _init_broker(self, worker_count: int):
+        """Sets up the connections to RabbitMQ and the consumption mode."""
+        self.worker_pool = WorkerPool(worker_count) if worker_count > 1 else None
 
         try:
             self.rabbit_client = RabbitClient()
@@ -66,8 +154,85 @@ class EventListener:
             self.log.error("Connection to RabbitMQ failed.")
             raise error
 
+        self.rabbit_client.declare_retry_queues(self.queue_name, self.retry_policy)
+        self.publisher = ConfirmingPublisher()
+
+        self.sharding_policy = ShardingPolicy.from_config(self.config["sharding"])
+        self.retired_shard_queues = []
+        if self.sharding_policy.role:
+            self.retired_shard_queues = self.rabbit_client.declare_shards(
+                self.queue_name, self.sharding_policy
+            )
+        self.route_batcher = None
+        if self.sharding_policy.role == ROLE_ROUTER:
+            # Waits for the confirms of a window of messages at once.
+            self.route_batcher = Batcher(
+                int(self.config["rabbitmq"]["prefetch_count"]),
+                float(self.config["sharding"]["max_wait"]),
+                self.rabbit_client.call_later,
+                self._route_batch,
+            )
+
+        coalescing_window = float(self.config["coalescing"]["window"])
+        self.coalescer = None
+        if coalescing_window > 0:
+            self.coalescer = Coalescer(
+                coalescing_window,
+                self.rabbit_client.call_later,
+                self._dispatch,
+                self._ack_superseded,
+            )
+
+        batching_config = self.config["batching"]
+        batch_size = int(batching_config["size"])
+        self.batcher = None
+        if batch_size > 0:
+            # A batch is acked with multiple=True, which would also ack
+            # messages that are handled elsewhere.
+            if self.worker_pool or self.coalescer:
+                raise ValueError(
+                    "Batching can't be combined with multiple workers or coalescing."
+                )
+            self.batcher = Batcher(
+                batch_size,
+                float(batching_config["max_wait"]),
+                self.rabbit_client.call_later,
+                self._run_batch,
+                one_at_a_time=True,
+            )
+            # Batches are handled here, so the connection thread stays free
+            # for heartbeats while a batch takes long.
+            self.batch_runner = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="batch-runner"
+            )
+            self.batch_executor = ThreadPoolExecutor(
+                max_workers=int(batching_config["fan_out"]),
+                thread_name_prefix="batch",
+            )
+
+    def _create_transformer(self, mtd_cfg):
+        """Creates the transformer for the configured backend.
+
+        The remote mtd-transformer is the fallback of the local backend.
+        """
+        backend = mtd_cfg["backend"]
+        if backend == "remote":
+            return self.transformer_client
+        if backend == "local":
+            return XsltTransformer(mtd_cfg["xslt_path"], self.transformer_client)
+        if backend == "parity":
+            return ParityTransformer(
+                XsltTransformer(mtd_cfg["xslt_path"]), self.transformer_client
+            )
+        raise ValueError(f"Unknown mtd-transformer backend: {backend}")
+
+    @metrics.timed("parse_event")
     def _parse_event(self, method, properties, body):
-        event_type = method.routing_key.split(".")[-1]
+        event_type = get_routing_key(method, properties).split(".")[-1]
+        # Keep the label values bounded, whatever the routing key
+        metrics.RECEIVED.labels(
+            event_type=event_type if event_type in EVENT_TYPES else "other"
+        ).inc()
 
         try:
             event = self.event_parser.get_event(event_type, body)
@@ -81,12 +246,43 @@ class EventListener:
 
         return event
 
-    def _get_items_for_media_id(self, event):
+    def _call_mediahaven(self, fn, *args, **kwargs):
+        """Calls the MediaHaven client, again with a new token if the token
+        was rejected.
+        """
+        generation = self.token_manager.generation
         try:
-            result = self.mediahaven_client.records.search(
-                q=f"+(dc_identifier_localid:{event.metadata.media_id})",
+            return fn(*args, **kwargs)
+        except MediaHavenException as error:
+            if getattr(error, "status_code", None) != 401:
+                raise
+        self.log.info("MediaHaven rejected the token, requesting a new one.")
+        try:
+            self.token_manager.refresh(generation)
+        except RequestTokenError as error:
+            raise NackException(
+                "Failed to request a MediaHaven token, retrying....",
+                requeue=True,
+                error=error,
             )
-            time.sleep(SLEEP_TIME)
+        return fn(*args, **kwargs)
+
+    @metrics.timed("get_items_for_media_id")
+    def _get_items_for_media_id(self, event):
+        try:
+            # Only search for the fragment, not for its collaterals. The records
+            # can't be limited to the fields we need, the search in MediaHaven
+            # always returns full records.
+            search_cfg = self.config["mediahaven"]["search"]
+            with self._guard("mediahaven_search"), self.rate_limiter.limit():
+                result = self._call_mediahaven(
+                    self.mediahaven_client.records.search,
+                    q=f"+(dc_identifier_localid:{event.metadata.media_id}) "
+                    f"{search_cfg['fragment_filter']}",
+                    nrOfResults=int(search_cfg["page_size"]),
+                )
+        except CircuitOpenError as error:
+            raise self._circuit_open(error)
         except MediaHavenException as error:
             raise NackException(
                 "Failed to search records in MediaHaven.",
@@ -108,36 +304,114 @@ class EventListener:
 
         return result
 
+    @metrics.timed("get_fragment")
     def _get_fragment(self, items: MediaHavenPageObject, event):
+        """Returns the first fragment in the search results.
+
+        Further pages are only fetched while no fragment has been found.
+        """
+        results = 0
         try:
-            fragment = next(
-                item for item in items.as_generator() if item.Internal.IsFragment
+            for item in items.as_generator():
+                results += 1
+                if item.Internal.IsFragment:
+                    return item
+        finally:
+            page_size = int(self.config["mediahaven"]["search"]["page_size"])
+            self.log.debug(
+                "Looked up fragment in MediaHaven.",
+                results=results,
+                pages=max(1, -(-results // page_size)),
             )
 
-            return fragment
-        except StopIteration:
-            raise NackException(
-                "Fragment not found in MH for media id",
-                media_id=event.metadata.media_id,
+        raise NackException(
+            "Fragment not found in MH for media id",
+            media_id=event.metadata.media_id,
+        )
+
+    @metrics.timed("search_fragment_ids")
+    def _search_fragment_ids(self, media_ids: list) -> dict:
+        """Looks up the fragment ids of multiple media ids with one search.
+
+        Returns:
+            The fragment id per media id, for the media ids that were found.
+        """
+        search_cfg = self.config["mediahaven"]["search"]
+        with self._guard("mediahaven_search"), self.rate_limiter.limit():
+            result = self._call_mediahaven(
+                self.mediahaven_client.records.search,
+                q=f"+(dc_identifier_localid:({' OR '.join(media_ids)})) "
+                f"{search_cfg['fragment_filter']}",
+                nrOfResults=len(media_ids) * int(search_cfg["page_size"]),
             )
 
-    def _transform_metadata(self, event):
+        fragment_ids = {}
+        for item in result.as_generator():
+            media_id = item.Dynamic.dc_identifier_localid
+            if item.Internal.IsFragment and media_id in media_ids:
+                fragment_ids.setdefault(media_id, item.Internal.FragmentId)
+                if len(fragment_ids) == len(media_ids):
+                    break
+        return fragment_ids
+
+    def _prefetch_fragment_ids(self, events):
+        """Caches the fragment ids of the events with one search in MediaHaven.
+
+        Media ids that are not found, or all of them if the search fails, are
+        looked up one by one later on.
+        """
+        media_ids = list(
+            OrderedDict.fromkeys(
+                event.metadata.media_id
+                for event in events
+                if self.fragment_cache.get(event.metadata.media_id) is None
+            )
+        )
+        if not media_ids:
+            return
+
         try:
-            mtd_cfg = self.config["mtd-transformer"]
-            url = f"{mtd_cfg['host']}/transform/?transformation={mtd_cfg['transformation']}"
-            transformation_response = requests.post(
-                url,
-                data=event.metadata.raw,
-                headers={"Content-Type": "application/xml"},
+            fragment_ids = self._search_fragment_ids(media_ids)
+        except (MediaHavenException, RequestException, CircuitOpenError) as error:
+            self.log.warning(
+                "Batched search in MediaHaven failed, searching per event.",
+                error=error,
             )
-            transformation_response.raise_for_status()
+            return
+        for media_id, fragment_id in fragment_ids.items():
+            self.fragment_cache.put(media_id, fragment_id)
+
+    def _get_fragment_id(self, event) -> str:
+        """Returns the fragment id for the media id of the event.
+
+        MediaHaven is only searched if the fragment id isn't cached.
+        """
+        media_id = event.metadata.media_id
+        fragment_id = self.fragment_cache.get(media_id)
+        metrics.FRAGMENT_CACHE.labels(
+            result="miss" if fragment_id is None else "hit"
+        ).inc()
+        if fragment_id is None:
+            # We need all archived items for media id (fragment + collaterals)
+            items = self._get_items_for_media_id(event)
+            fragment_id = self._get_fragment(items, event).Internal.FragmentId
+            self.fragment_cache.put(media_id, fragment_id)
+        return fragment_id
+
+    @metrics.timed("transform_metadata")
+    def _transform_metadata(self, event):
+        try:
+            with self._guard("transformer"):
+                metadata = self.transformer.transform(event.metadata.raw)
 
             self.log.info(
                 "Succesfuly transformed metadata using mtd-transformation-service.",
                 media_id=event.metadata.media_id,
             )
 
-            return transformation_response.text
+            return metadata
+        except CircuitOpenError as error:
+            raise self._circuit_open(error)
         except HTTPError as error:
             raise NackException(
                 "Failed to transform metadata using mtd-transformation-service.",
@@ -151,20 +425,31 @@ class EventListener:
                 error=error,
             )
 
-    def _update_metadata(self, fragment, metadata):
+    @metrics.timed("update_metadata")
+    def _update_metadata(self, fragment_id, metadata, event):
         try:
-            fragment_id = fragment.Internal.FragmentId
-
             self.log.info(f"Updating metadata in MediaHaven for {fragment_id}")
 
-            self.mediahaven_client.records.update(
-                fragment_id,
-                metadata=metadata,
-                metadata_content_type="application/xml",
-                reason="[VRT-events-metadata] Metadata updated",
-            )
-            time.sleep(SLEEP_TIME)
+            with self._guard("mediahaven_update"), self.rate_limiter.limit():
+                self._call_mediahaven(
+                    self.mediahaven_client.records.update,
+                    fragment_id,
+                    metadata=metadata,
+                    metadata_content_type="application/xml",
+                    reason="[VRT-events-metadata] Metadata updated",
+                )
+        except CircuitOpenError as error:
+            raise self._circuit_open(error)
         except MediaHavenException as error:
+            # The cached fragment id might be the cause, look it up again next time
+            self.fragment_cache.invalidate(event.metadata.media_id)
+            if getattr(error, "status_code", None) == 404:
+                raise NackException(
+                    "Fragment not found in MediaHaven, retrying....",
+                    requeue=True,
+                    error=error,
+                    fragment_id=fragment_id,
+                )
             # Invalid metadata update
             raise NackException(
                 "Failed to update metadata in MediaHaven.",
@@ -179,61 +464,501 @@ class EventListener:
                 error=error,
             )
 
-    def _request_subtitles(self, event):
-        if event.media_type == "video" and event.metadata.openOT_available:
-            open_ot_request = generate_make_subtitle_available_request_xml(
-                "open", event.metadata.media_id, event.metadata.media_id
-            )
+    def _get_subtitle_requests(self, event) -> list:
+        """Returns the requests for the subtitles that are available."""
+        if event.media_type != "video":
+            return []
+
+        ot_types = []
+        if event.metadata.openOT_available:
+            ot_types.append("open")
+        if event.metadata.closedOT_available:
+            ot_types.append("closed")
+        if ot_types:
             self.log.info(
-                f"Requesting subtitles for media_id {event.metadata.media_id}"
+                f"Requesting subtitles for media_id {event.metadata.media_id}",
+                ot_types=ot_types,
             )
-            self.rabbit_client.send_message(
-                self.config["rabbitmq"]["get_subtitles_routing_key"],
-                open_ot_request,
+
+        return [
+            generate_make_subtitle_available_request_xml(
+                ot_type, event.metadata.media_id, event.metadata.media_id
+            )
+            for ot_type in ot_types
+        ]
+
+    @metrics.timed("request_subtitles")
+    def _request_subtitles(self, event):
+        """Requests the available subtitles, as one batch of messages."""
+        subtitle_requests = self._get_subtitle_requests(event)
+        try:
+            self.publisher.publish_batch(
                 self.config["rabbitmq"]["exchange"],
+                self.config["rabbitmq"]["get_subtitles_routing_key"],
+                subtitle_requests,
+            )
+        except PublishError as error:
+            raise NackException(
+                "Failed to request subtitles, retrying....",
+                requeue=True,
+                error=error,
+                media_id=event.metadata.media_id,
             )
 
-        if event.media_type == "video" and event.metadata.closedOT_available:
-            closed_ot_request = generate_make_subtitle_available_request_xml(
-                "closed", event.metadata.media_id, event.metadata.media_id
+    def _get_retry_destination(self, method, properties):
+        """Determines where to publish a message to retry it later.
+
+        The message goes to the retry queue for its attempt, with a TTL. It
+        gets dead-lettered back onto the queue when the TTL expires. After too
+        many attempts, the message goes to the parking queue instead.
+
+        Returns:
+            The queue, the headers and the TTL in milliseconds (or None).
+        """
+        attempt = get_attempts(properties) + 1
+        headers = dict(properties.headers or {})
+        headers[RETRY_ATTEMPTS_HEADER] = attempt
+        headers.setdefault(ORIGINAL_ROUTING_KEY_HEADER, method.routing_key)
+
+        if self.retry_policy.should_park(attempt):
+            metrics.PARKED.inc()
+            self.log.error(
+                f"Giving up after {attempt - 1} retries, parking the message.",
+                routing_key=headers[ORIGINAL_ROUTING_KEY_HEADER],
             )
-            self.log.info(
-                f"Requesting subtitles for media_id {event.metadata.media_id}"
+            return self.retry_policy.parking_queue(self.queue_name), headers, None
+
+        delay = self.retry_policy.delay(attempt)
+        self.log.info(f"Retrying the message in {delay:.1f}s (attempt {attempt}).")
+        queue = self.retry_policy.retry_queue(self.queue_name, attempt)
+        return queue, headers, int(delay * 1000)
+
+    def _retry_message(self, method, properties, body):
+        """Schedules the message to be retried later.
+
+        Raises:
+            PublishError: If the broker didn't confirm the retry.
+        """
+        queue, headers, expiration = self._get_retry_destination(method, properties)
+        retry_properties = pika.BasicProperties(
+            headers=headers,
+            content_type=properties.content_type,
+            delivery_mode=pika.spec.PERSISTENT_DELIVERY_MODE,
+        )
+        if expiration is not None:
+            retry_properties.expiration = str(expiration)
+
+        self.publisher.publish("", queue, body, retry_properties)
+
+    def _on_breaker_state_change(self, breaker, state: str):
+        metrics.BREAKER_STATE.labels(breaker=breaker.name).state(state)
+        if state == OPEN:
+            self.log.warning(
+                f"Circuit breaker for {breaker.name} opened, pausing consumption.",
+                reset_timeout=breaker.reset_timeout,
             )
-            self.rabbit_client.send_message(
-                self.config["rabbitmq"]["get_subtitles_routing_key"],
-                closed_ot_request,
-                self.config["rabbitmq"]["exchange"],
+            self._pause_consumption(breaker.reset_timeout)
+        else:
+            self.log.info(f"Circuit breaker for {breaker.name} is {state}.")
+            if state == CLOSED:
+                self._schedule_resume()
+
+    def _guard(self, name: str):
+        """Calls a downstream service through its circuit breaker.
+
+        A NackException raised inside says nothing about the service.
+        """
+        return self.breakers[name].guard(neutral=(NackException,))
+
+    def _circuit_open(self, error) -> NackException:
+        """Pauses consumption while the circuit breaker refuses calls.
+
+        Returns:
+            The NackException to give the message back to the broker. The
+            service wasn't called, so it doesn't use up a retry attempt.
+        """
+        self._pause_consumption(self.breakers[error.name].retry_after())
+        return NackException(
+            "Circuit breaker is open, requeueing....",
+            redeliver=True,
+            breaker=error.name,
+        )
+
+    def _pause_consumption(self, duration: float):
+        """Stops consuming for `duration` seconds, or longer while a circuit
+        breaker is open. Can be called from any thread.
+        """
+        if self.rabbit_client is None:
+            return
+        self.rabbit_client.pause()
+        self.rabbit_client.call_threadsafe(
+            functools.partial(
+                self.rabbit_client.call_later, duration, self._resume_consumption
             )
+        )
 
-    def _handle_nack_exception(self, nack_exception, channel, delivery_tag):
-        """Log an error and send a nack to rabbit"""
+    def _schedule_resume(self):
+        """Resumes consuming as soon as possible, from any thread."""
+        if self.rabbit_client is None:
+            return
+        self.rabbit_client.call_threadsafe(self._resume_consumption)
+
+    def _resume_consumption(self):
+        """Resumes consuming, so the next event probes the services, once no
+        circuit breaker refuses calls anymore.
+        """
+        delay = max(breaker.retry_after() for breaker in self.breakers.values())
+        if delay:
+            self.rabbit_client.call_later(delay, self._resume_consumption)
+        else:
+            self.rabbit_client.resume()
+
+    def _record_nack(self, nack_exception):
         self.log.error(nack_exception.message, **nack_exception.kwargs)
+        if nack_exception.requeue or nack_exception.redeliver:
+            metrics.REQUEUED.labels(reason=nack_exception.message).inc()
+        else:
+            metrics.NACKED.labels(reason=nack_exception.message).inc()
+
+    def _handle_nack_exception(self, nack_exception, channel, method, properties, body):
+        """Log an error and send a nack to rabbit.
+
+        If the message should be requeued, it is scheduled for a delayed retry
+        and acked once the broker confirmed the retry. If that fails, it is
+        given back to the broker instead.
+        """
+        self._record_nack(nack_exception)
+        if nack_exception.redeliver:
+            channel.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+            return
         if nack_exception.requeue:
-            time.sleep(10)
-        channel.basic_nack(delivery_tag=delivery_tag, requeue=nack_exception.requeue)
+            try:
+                self._retry_message(method, properties, body)
+            except PublishError as error:
+                self.log.warning(
+                    "Failed to schedule the retry, giving the message back.",
+                    error=error,
+                )
+                channel.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+                return
+            channel.basic_ack(delivery_tag=method.delivery_tag)
+            return
+        channel.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+
+    def route_message(self, channel, method, properties, body):
+        """Routes the incoming message to the shard queue of its media id.
+
+        Only the start of the event is parsed. Retried messages come back on
+        the queue and are routed again.
+        """
+        event_type = get_routing_key(method, properties).split(".")[-1]
+        try:
+            media_id = self.event_parser.get_media_id(event_type, body)
+        except InvalidEventException as error:
+            self._handle_nack_exception(
+                NackException(
+                    "Unable to parse the incoming event", error=error, body=body
+                ),
+                channel,
+                method,
+                properties,
+                body,
+            )
+            return
+
+        headers = dict(properties.headers or {})
+        headers[MEDIA_ID_HEADER] = media_id
+        headers.setdefault(ORIGINAL_ROUTING_KEY_HEADER, method.routing_key)
+        message = (channel, method, properties, body, headers)
+        if self.route_batcher:
+            self.route_batcher.add(message)
+        else:
+            self._route_batch([message])
+
+    def _route_batch(self, batch):
+        """Publishes the messages to the shard exchange and acks them once the
+        broker confirmed all of them.
+        """
+        try:
+            self.publisher.publish_batch(
+                self.sharding_policy.exchange,
+                "",
+                [message[3] for message in batch],
+                headers=[message[4] for message in batch],
+            )
+        except PublishError as error:
+            for channel, method, properties, body, headers in batch:
+                self._handle_nack_exception(
+                    NackException(
+                        "Failed to route the event to its shard, retrying....",
+                        requeue=True,
+                        error=error,
+                        media_id=headers[MEDIA_ID_HEADER],
+                    ),
+                    channel,
+                    method,
+                    properties,
+                    body,
+                )
+            return
+        for channel, method, *_ in batch:
+            metrics.ACKED.labels(outcome="routed").inc()
+            channel.basic_ack(delivery_tag=method.delivery_tag)
 
     def handle_message(self, channel, method, properties, body):
         """Main method that will handle the incoming messages."""
         try:
             event = self._parse_event(method, properties, body)
-
-            # We need all archived items for media id (fragment + collaterals)
-            items = self._get_items_for_media_id(event)
-
-            fragment = self._get_fragment(items, event)
-
-            metadata = self._transform_metadata(event)
-
-            self._update_metadata(fragment, metadata)
-
-            self._request_subtitles(event)
         except NackException as e:
-            self._handle_nack_exception(e, channel, method.delivery_tag)
+            self._handle_nack_exception(e, channel, method, properties, body)
             return
+
+        message = (channel, method, properties, body, event)
+        if self.batcher:
+            self.batcher.add(message)
+        elif self.coalescer:
+            self.coalescer.add(event.metadata.media_id, event, message)
+        else:
+            self._dispatch(message)
+
+    def _dispatch(self, message):
+        """Handles the message, or hands it off to the worker pool.
+
+        In the worker pool, the event is handled by the worker responsible for
+        its media id, so events for the same media id are still handled in
+        order. Acks and nacks are sent back via the connection thread.
+        """
+        channel, method, properties, body, event = message
+        if self.worker_pool:
+            self.worker_pool.submit(
+                event.metadata.media_id,
+                self._process_event,
+                ThreadSafeChannel(self.rabbit_client, channel),
+                method,
+                properties,
+                body,
+                event,
+            )
+        else:
+            self._process_event(channel, method, properties, body, event)
+
+    def _ack_superseded(self, message):
+        channel, method, _, _, event = message
+        self.log.info(
+            "Skipping event, superseded by a newer event.",
+            media_id=event.metadata.media_id,
+            timestamp=event.timestamp,
+        )
+        metrics.ACKED.labels(outcome="superseded").inc()
         channel.basic_ack(delivery_tag=method.delivery_tag)
 
+    def _get_fragment_id_and_transform(self, event):
+        """Looks up the fragment and transforms the metadata at the same time.
+
+        They don't depend on each other. If the lookup fails, its error is
+        raised and the result of the transformation is discarded.
+        """
+        transform = self.transform_executor.submit(self._transform_metadata, event)
+        fragment_id = None
+        try:
+            fragment_id = self._get_fragment_id(event)
+        finally:
+            if fragment_id is None:
+                transform.cancel()
+        return fragment_id, transform.result()
+
+    def _apply_event(self, event, force: bool = False) -> str:
+        """Brings the metadata in MediaHaven up to date and requests the
+        subtitles.
+
+        Args:
+            event: The parsed event.
+            force: Update the metadata, even if it didn't change or a newer
+                event was already applied.
+
+        Returns:
+            The outcome: "updated", "unchanged" if the update was skipped or
+            "stale" if the event was skipped altogether.
+        """
+        outcome, checksum = self._check_event(event, force)
+        if outcome == "stale":
+            return outcome
+        if outcome == "updated":
+            fragment_id, metadata = self._get_fragment_id_and_transform(event)
+            self._update_metadata(fragment_id, metadata, event)
+        self._record_event(event, outcome, checksum)
+        self._request_subtitles(event)
+        return outcome
+
+    def _check_event(self, event, force: bool = False):
+        """Decides what to do with an event, before anything is called.
+
+        Returns:
+            The outcome ("updated" if the metadata has to be updated,
+            "unchanged" or "stale") and the checksum of the metadata.
+        """
+        if not force and self._is_stale(event):
+            return "stale", None
+
+        checksum = self.idempotency_store.checksum(event.metadata.raw)
+        if not force and self.idempotency_store.is_unchanged(
+            event.metadata.media_id, checksum
+        ):
+            self.log.info(
+                "Metadata didn't change since the last update, skipping update.",
+                media_id=event.metadata.media_id,
+            )
+            metrics.UNCHANGED.inc()
+            return "unchanged", checksum
+        return "updated", checksum
+
+    def _record_event(self, event, outcome: str, checksum: str):
+        """Remembers that the metadata of the event is in MediaHaven."""
+        if outcome == "updated":
+            self.idempotency_store.record(event.metadata.media_id, checksum)
+        self.version_store.record(event)
+
+    def _is_stale(self, event) -> bool:
+        """Checks if a newer event for the media id was already applied."""
+        if not self.version_store.is_stale(event):
+            return False
+        self.log.info(
+            "Skipping event, a newer event was already applied.",
+            media_id=event.metadata.media_id,
+            timestamp=event.timestamp,
+        )
+        metrics.STALE.inc()
+        return True
+
+    def _apply_batch(self, events) -> list:
+        """Applies the events of a batch, with a single search in MediaHaven.
+
+        Events for different media ids are applied concurrently, events for
+        the same media id in order.
+
+        Returns:
+            The outcome or the NackException of each event.
+        """
+        self._prefetch_fragment_ids(events)
+
+        indexes_per_media_id = OrderedDict()
+        for index, event in enumerate(events):
+            indexes_per_media_id.setdefault(event.metadata.media_id, []).append(index)
+
+        results = [None] * len(events)
+
+        def apply_events(indexes):
+            for index in indexes:
+                try:
+                    results[index] = self._apply_event(events[index])
+                except NackException as e:
+                    results[index] = e
+                except Exception as error:
+                    results[index] = self._unexpected_error(error, events[index])
+
+        list(self.batch_executor.map(apply_events, indexes_per_media_id.values()))
+        return results
+
+    def _run_batch(self, batch):
+        """Hands the batch off to the batch runner.
+
+        Acks and nacks are sent back via the connection thread. The next batch
+        is only released once this one is settled.
+        """
+        batch = [
+            (ThreadSafeChannel(self.rabbit_client, channel), *rest)
+            for channel, *rest in batch
+        ]
+        future = self.batch_runner.submit(self._process_batch, batch)
+        future.add_done_callback(self._on_batch_done)
+
+    def _on_batch_done(self, future):
+        if not future.cancelled() and future.exception() is not None:
+            self.log.error("Unhandled exception in batch.", error=future.exception())
+        self.rabbit_client.call_threadsafe(self.batcher.done)
+
+    def _process_batch(self, batch):
+        """Handles a batch of parsed messages.
+
+        The messages up to the first failure are acked at once, the others one
+        by one. This relies on all earlier messages of the channel being
+        settled, so batches are handled one at a time.
+        """
+        with metrics.IN_FLIGHT.track_inprogress():
+            results = self._apply_batch([message[4] for message in batch])
+
+        failures = [
+            index
+            for index, result in enumerate(results)
+            if isinstance(result, NackException)
+        ]
+        prefix = failures[0] if failures else len(batch)
+        if prefix:
+            channel, method = batch[prefix - 1][:2]
+            channel.basic_ack(delivery_tag=method.delivery_tag, multiple=True)
+
+        for message, result in zip(batch[prefix:], results[prefix:]):
+            channel, method, properties, body, _ = message
+            if isinstance(result, NackException):
+                self._handle_nack_exception(result, channel, method, properties, body)
+            else:
+                channel.basic_ack(delivery_tag=method.delivery_tag)
+
+        for result in results:
+            if not isinstance(result, NackException):
+                metrics.ACKED.labels(outcome=result).inc()
+
+    def _unexpected_error(self, error, event) -> NackException:
+        """Returns the NackException to retry an event that failed unexpectedly."""
+        return NackException(
+            "Unexpected error while handling the event, retrying....",
+            requeue=True,
+            error=error,
+            media_id=event.metadata.media_id,
+        )
+
+    def _process_event(self, channel, method, properties, body, event):
+        """Handles a parsed event and acks or nacks the message."""
+        with metrics.IN_FLIGHT.track_inprogress():
+            try:
+                outcome = self._apply_event(event)
+            except NackException as e:
+                self._handle_nack_exception(e, channel, method, properties, body)
+                return
+            except Exception as error:
+                # Otherwise the message would never be settled in a worker.
+                self._handle_nack_exception(
+                    self._unexpected_error(error, event),
+                    channel,
+                    method,
+                    properties,
+                    body,
+                )
+                return
+            metrics.ACKED.labels(outcome=outcome).inc()
+            channel.basic_ack(delivery_tag=method.delivery_tag)
+
     def start(self):
+        metrics.start_server(self.config["metrics"])
         # Start listening for incoming messages
-        self.log.info(f"Waiting for messages on queue {self.queue_name}")
-        self.rabbit_client.listen(self.handle_message)
+        if self.sharding_policy.role == ROLE_ROUTER:
+            self.log.info(f"Routing messages on queue {self.queue_name} to shards")
+            self.rabbit_client.listen(self.route_message)
+        elif self.sharding_policy.role == ROLE_SHARD:
+            queues = [
+                self.sharding_policy.shard_queue(self.queue_name, shard)
+                for shard in self.sharding_policy.assigned_shards()
+            ] + self.retired_shard_queues
+            self.log.info(f"Waiting for messages on shard queues {queues}")
+            self.rabbit_client.listen(self.handle_message, queues)
+        else:
+            self.log.info(f"Waiting for messages on queue {self.queue_name}")
+            self.rabbit_client.listen(self.handle_message)
+        if self.worker_pool:
+            self.worker_pool.shutdown()
+        if self.batcher:
+            self.batch_runner.shutdown()
+            self.batch_executor.shutdown()
+        self.transform_executor.shutdown()
+        self.token_manager.stop()
+        self.publisher.close()
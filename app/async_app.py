@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import aio_pika
+import aiohttp
+
+from app.app import EventListener, NackException
+from app.services import metrics
+from app.services.circuit_breaker import CircuitOpenError
+
+
+def is_unavailable(error: Exception) -> bool:
+    """Checks if an aiohttp error means the mtd-transformer is down or overloaded."""
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status == 429 or error.status >= 500
+    return isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError))
+
+
+class AsyncEventListener(EventListener):
+    """Handles events concurrently on an asyncio event loop.
+
+    Up to `asyncio.concurrency` events are handled at the same time, without a
+    thread per event. RabbitMQ and the mtd-transformer are used asynchronously.
+    The MediaHaven client has no asynchronous API, so its calls run on a small
+    thread pool. Events for the same media id are still handled in order.
+    """
+
+    def _init_broker(self, worker_count: int):
+        async_config = self.config["asyncio"]
+        self.concurrency = int(async_config["concurrency"])
+        self.executor = ThreadPoolExecutor(
+            max_workers=int(async_config["mediahaven_threads"]),
+            thread_name_prefix="mediahaven",
+        )
+        # Media id -> [lock, number of events holding or waiting for it]
+        self.media_id_locks = {}
+
+        # Set up in run, on the event loop
+        self.loop = None
+        self.consuming = None
+        self.semaphore = None
+        self.channel = None
+        self.subtitle_exchange = None
+        self.http_session = None
+
+    async def _in_executor(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(fn, *args))
+
+    async def _declare_retry_queues(self):
+        for attempt in range(1, self.retry_policy.max_attempts + 1):
+            await self.channel.declare_queue(
+                self.retry_policy.retry_queue(self.queue_name, attempt),
+                durable=True,
+                arguments={
+                    "x-dead-letter-exchange": "",
+                    "x-dead-letter-routing-key": self.queue_name,
+                },
+            )
+        await self.channel.declare_queue(
+            self.retry_policy.parking_queue(self.queue_name), durable=True
+        )
+
+    async def _transform_metadata_async(self, event):
+        # The local backends don't do I/O to speak of.
+        if self.transformer is not self.transformer_client:
+            return await self._in_executor(self._transform_metadata, event)
+        return await self._post_transform_async(event)
+
+    @metrics.timed("transform_metadata")
+    async def _post_transform_async(self, event):
+        """Transforms the metadata with the mtd-transformer."""
+        try:
+            with self.breakers["transformer"].guard(
+                is_failure=is_unavailable, neutral=(NackException,)
+            ):
+                async with self.http_session.post(
+                    self.transformer_client.url,
+                    data=event.metadata.raw,
+                    headers={"Content-Type": "application/xml"},
+                ) as response:
+                    response.raise_for_status()
+                    metadata = await response.text()
+        except CircuitOpenError as error:
+            raise self._circuit_open(error)
+        except aiohttp.ClientResponseError as error:
+            raise NackException(
+                "Failed to transform metadata using mtd-transformation-service.",
+                error=error,
+                metadata=event.metadata.raw,
+            )
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            raise NackException(
+                "Error connecting to mtd-transformation-service, retrying....",
+                requeue=True,
+                error=error,
+            )
+
+        self.log.info(
+            "Succesfuly transformed metadata using mtd-transformation-service.",
+            media_id=event.metadata.media_id,
+        )
+        return metadata
+
+    @metrics.timed("request_subtitles")
+    async def _request_subtitles_async(self, event):
+        """Requests the available subtitles and waits for the confirms."""
+        routing_key = self.config["rabbitmq"]["get_subtitles_routing_key"]
+        try:
+            await asyncio.gather(
+                *(
+                    self.subtitle_exchange.publish(
+                        aio_pika.Message(
+                            subtitle_request,
+                            delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+                        ),
+                        routing_key=routing_key,
+                    )
+                    for subtitle_request in self._get_subtitle_requests(event)
+                )
+            )
+        except (aio_pika.exceptions.AMQPError, asyncio.TimeoutError) as error:
+            raise NackException(
+                "Failed to request subtitles, retrying....",
+                requeue=True,
+                error=error,
+                media_id=event.metadata.media_id,
+            )
+
+    async def _handle_nack_exception_async(self, nack_exception, message):
+        """Log an error and nack the message, or schedule it for a retry."""
+        self._record_nack(nack_exception)
+        if nack_exception.redeliver:
+            await message.nack(requeue=True)
+            return
+        if not nack_exception.requeue:
+            await message.nack(requeue=False)
+            return
+
+        # An aio-pika message holds both the delivery info and the properties.
+        queue, headers, expiration = self._get_retry_destination(message, message)
+        try:
+            await self.channel.default_exchange.publish(
+                aio_pika.Message(
+                    message.body,
+                    headers=headers,
+                    content_type=message.content_type,
+                    delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+                    expiration=expiration / 1000 if expiration is not None else None,
+                ),
+                routing_key=queue,
+            )
+        except (aio_pika.exceptions.AMQPError, asyncio.TimeoutError) as error:
+            self.log.warning(
+                "Failed to schedule the retry, giving the message back.", error=error
+            )
+            await message.nack(requeue=True)
+            return
+        await message.ack()
+
+    async def _get_fragment_id_and_transform_async(self, event):
+        """Looks up the fragment and transforms the metadata at the same time."""
+        transform = asyncio.ensure_future(self._transform_metadata_async(event))
+        fragment_id = None
+        try:
+            fragment_id = await self._in_executor(self._get_fragment_id, event)
+        finally:
+            if fragment_id is None and not transform.cancel():
+                # Already done, mark its error as retrieved
+                transform.exception()
+        return fragment_id, await transform
+
+    async def _apply_event_async(self, event) -> str:
+        """Like `_apply_event`, without blocking the event loop."""
+        outcome, checksum = self._check_event(event)
+        if outcome == "stale":
+            return outcome
+        if outcome == "updated":
+            fragment_id, metadata = await self._get_fragment_id_and_transform_async(
+                event
+            )
+            await self._in_executor(self._update_metadata, fragment_id, metadata, event)
+        self._record_event(event, outcome, checksum)
+        await self._request_subtitles_async(event)
+        return outcome
+
+    async def _process_event_async(self, message, event):
+        """Handles a parsed event and acks or nacks the message."""
+        with metrics.IN_FLIGHT.track_inprogress():
+            try:
+                outcome = await self._apply_event_async(event)
+            except NackException as e:
+                await self._handle_nack_exception_async(e, message)
+                return
+            except Exception as error:
+                # Otherwise the message would hold on to a prefetch slot.
+                await self._handle_nack_exception_async(
+                    self._unexpected_error(error, event), message
+                )
+                return
+            metrics.ACKED.labels(outcome=outcome).inc()
+            await message.ack()
+
+    async def handle_message_async(self, message):
+        """Handles an incoming message.
+
+        The per media id lock is taken before the semaphore, and asyncio locks
+        are fair, so events for the same media id are handled in the order in
+        which they were received.
+        """
+        try:
+            event = self._parse_event(message, message, message.body)
+        except NackException as e:
+            await self._handle_nack_exception_async(e, message)
+            return
+
+        media_id = event.metadata.media_id
+        entry = self.media_id_locks.setdefault(media_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                async with self.semaphore:
+                    await self._process_event_async(message, event)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self.media_id_locks[media_id]
+
+    def _pause_consumption(self, duration: float):
+        self.loop.call_soon_threadsafe(self._pause_on_loop, duration)
+
+    def _pause_on_loop(self, duration: float):
+        # The messages that were already prefetched wait as well.
+        self.consuming.clear()
+        self.loop.call_later(duration, self._resume_consumption)
+
+    def _schedule_resume(self):
+        self.loop.call_soon_threadsafe(self._resume_consumption)
+
+    def _resume_consumption(self):
+        delay = max(breaker.retry_after() for breaker in self.breakers.values())
+        if delay:
+            self.loop.call_later(delay, self._resume_consumption)
+        else:
+            self.consuming.set()
+
+    async def run(self):
+        metrics.start_server(self.config["metrics"])
+        rabbit_config = self.config["rabbitmq"]
+        mtd_cfg = self.config["mtd-transformer"]
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.loop = asyncio.get_running_loop()
+        self.consuming = asyncio.Event()
+        self.consuming.set()
+
+        connection = await aio_pika.connect_robust(
+            host=rabbit_config["host"],
+            port=int(rabbit_config["port"]),
+            login=rabbit_config["username"],
+            password=rabbit_config["password"],
+        )
+        http_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.concurrency),
+            timeout=aiohttp.ClientTimeout(
+                sock_connect=float(mtd_cfg["connect_timeout"]),
+                sock_read=float(mtd_cfg["read_timeout"]),
+            ),
+        )
+        async with connection, http_session:
+            self.http_session = http_session
+            self.channel = await connection.channel(publisher_confirms=True)
+            await self.channel.set_qos(
+                prefetch_count=int(rabbit_config["prefetch_count"])
+            )
+            await self._declare_retry_queues()
+            self.subtitle_exchange = await self.channel.get_exchange(
+                rabbit_config["exchange"]
+            )
+            queue = await self.channel.get_queue(self.queue_name)
+
+            self.log.info(f"Waiting for messages on queue {self.queue_name}")
+            tasks = set()
+            async with queue.iterator() as messages:
+                async for message in messages:
+                    await self.consuming.wait()
+                    task = asyncio.create_task(self.handle_message_async(message))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+
+    def start(self):
+        try:
+            asyncio.run(self.run())
+        finally:
+            self.executor.shutdown()
+            self.transform_executor.shutdown()
+            self.token_manager.stop()
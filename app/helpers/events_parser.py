@@ -15,34 +15,105 @@ NAMESPACES = {
 }
 
 
+def _tag(prefix: str, name: str) -> str:
+    return f"{{{NAMESPACES[prefix]}}}{name}"
+
+
+def _xpath(path: str) -> etree.XPath:
+    return etree.XPath(path, namespaces=NAMESPACES)
+
+
+# The event types that can be handled
+EVENT_TYPES = ("getMetadataResponse", "metadataUpdatedEvent")
+
+# Number of bytes fed at once to the parser while sniffing
+SNIFF_CHUNK_SIZE = 1024
+
+# Tags of the elements directly under the event root element
+VRT_STATUS = _tag("vrt", "status")
+VRT_MEDIA_ID = _tag("vrt", "mediaId")
+VRT_METADATA = _tag("vrt", "metadata")
+
+# Tags of the elements in the metadata that hold information we need
+EBU_FORMAT = _tag("ebu", "format")
+EBU_IDENTIFIER = _tag("ebu", "identifier")
+EBU_DESCRIPTION = _tag("ebu", "description")
+DC_IDENTIFIER_TAG = _tag("dc", "identifier")
+
+# Precompiled XPaths, relative to the event root element
+TIMESTAMP = _xpath("./vrt:timestamp")
+CORRELATION_ID = _xpath("./vrt:correlationId")
+STATUS = _xpath("./vrt:status")
+MEDIA_ID = _xpath("./vrt:mediaId")
+METADATA = _xpath("./vrt:metadata")
+
+# Precompiled XPaths, relative to an ebu:format element
+VIDEO_FORMAT = _xpath("./ebu:videoFormat")
+AUDIO_FORMAT = _xpath("./ebu:audioFormat")
+RESOLUTION_FORMAT = _xpath("./ebu:videoFormat[@videoFormatDefinition=$resolution]")
+FRAMERATE = _xpath("./ebu:videoFormat/ebu:frameRate")
+SOM = _xpath("./ebu:technicalAttributeString[@typeDefinition='SOM']")
+SOC = _xpath("./ebu:start/ebu:timecode")
+EOC = _xpath("./ebu:end/ebu:timecode")
+EOM = _xpath("./ebu:technicalAttributeString[@typeDefinition='EOM']")
+CAPTIONING_FORMAT = _xpath("./ebu:dataFormat/ebu:captioningFormat/@formatDefinition")
+
+# Precompiled XPaths, relative to an ebu:identifier or ebu:description element
+DC_IDENTIFIER = _xpath("./dc:identifier")
+DC_DESCRIPTION = _xpath("./dc:description")
+
+
+class EventHeader:
+    """What is known about an event from the elements before its metadata.
+
+    The status and media id are None if they don't occur before the metadata.
+    """
+
+    __slots__ = ("event_type", "status", "media_id")
+
+    def __init__(self, event_type: str, status=None, media_id=None):
+        self.event_type = event_type
+        self.status = status
+        self.media_id = media_id
+
+
 class EventParser(object):
+    """Parses VRT events to Event objects.
+
+    The parser doesn't keep any state, so one instance can be shared by
+    multiple threads. The DOM of an event is released as soon as the Event
+    object is built.
+
+    Args:
+        max_size: Events larger than this (in bytes) are rejected. None to
+            accept events of any size.
+    """
+
+    def __init__(self, max_size: int = None):
+        self.max_size = max_size
+
     def get_event(self, event_type: str, xml: bytes):
-        self.event = self._parse_event(event_type, xml)
+        # Reject what we can't handle before building the DOM.
+        self.sniff(event_type, xml)
+        root = self._parse_event(event_type, xml)
 
         if event_type == "getMetadataResponse":
-            status = self._get_status()
-            if status != "SUCCESS":
-                # TODO: report back to VRT
-                raise InvalidEventException(
-                    f"getMetadataResponse status wasn't 'SUCCES': {status}"
-                )
+            # `sniff` already rejected unsuccessful responses.
+            status = self._get_status(root)
+            correlation_id = self._get_correlation_id(root)
 
-            correlation_id = self._get_correlation_id()
-
-            media_type = self._get_media_type()
-            metadata = self._parse_metadata(media_type)
-            timestamp = self._get_timestamp()
+            metadata, media_type = self._parse_metadata(root)
+            timestamp = self._get_timestamp(root)
 
             return GetMetadataResponseEvent(
                 event_type, metadata, timestamp, correlation_id, status, media_type
             )
 
         if event_type == "metadataUpdatedEvent":
-            media_id = self._get_media_id()
+            media_id = self._get_media_id(root)
 
-            media_type = self._get_media_type()
-            metadata = self._parse_metadata(media_type)
-            timestamp = self._get_timestamp()
+            metadata, media_type = self._parse_metadata(root)
+            timestamp = self._get_timestamp(root)
 
             return MetadataUpdatedEvent(
                 event_type, metadata, timestamp, media_id, media_type
@@ -50,6 +121,93 @@ class EventParser(object):
 
         raise InvalidEventException(f"Can't handle '{event_type}' events")
 
+    def sniff(self, event_type: str, xml: bytes) -> EventHeader:
+        """Checks the event by streaming only the elements before its metadata.
+
+        Returns:
+            The header of the event.
+
+        Raises:
+            InvalidEventException: If the event is too large, doesn't start as
+                valid XML, has the wrong root element, is of a type that can't
+                be handled or is a getMetadataResponse that wasn't successful.
+        """
+        if self.max_size is not None and len(xml) > self.max_size:
+            raise InvalidEventException(
+                f"Event is larger than {self.max_size} bytes.", size=len(xml)
+            )
+
+        header = EventHeader(event_type)
+        depth = 0
+        try:
+            for action, element in self._iter_events(xml.strip()):
+                if action == "end":
+                    depth -= 1
+                    if depth == 1 and element.tag == VRT_STATUS:
+                        header.status = element.text
+                    elif depth == 1 and element.tag == VRT_MEDIA_ID:
+                        header.media_id = element.text
+                    continue
+
+                depth += 1
+                if depth == 1:
+                    if element.tag != _tag("vrt", event_type):
+                        raise InvalidEventException(f"Event is not a '{event_type}'.")
+                    if event_type not in EVENT_TYPES:
+                        raise InvalidEventException(
+                            f"Can't handle '{event_type}' events"
+                        )
+                elif depth == 2 and element.tag == VRT_METADATA:
+                    break
+        except etree.XMLSyntaxError:
+            raise InvalidEventException("Event is not valid XML.")
+
+        if event_type == "getMetadataResponse" and header.status != "SUCCESS":
+            # TODO: report back to VRT
+            raise InvalidEventException(
+                f"getMetadataResponse status wasn't 'SUCCES': {header.status}"
+            )
+        return header
+
+    def get_media_id(self, event_type: str, xml: bytes) -> str:
+        """Returns the media id of the event, without parsing all of it.
+
+        The XML is only streamed up to the MEDIA_ID identifier.
+
+        Raises:
+            InvalidEventException: If the event is rejected by `sniff` or has
+                no MEDIA_ID identifier.
+        """
+        self.sniff(event_type, xml)
+        try:
+            for action, element in self._iter_events(xml.strip()):
+                if action != "end" or element.tag != DC_IDENTIFIER_TAG:
+                    continue
+                parent = element.getparent()
+                if (
+                    parent.tag == EBU_IDENTIFIER
+                    and parent.get("typeDefinition") == "MEDIA_ID"
+                    and element.text
+                ):
+                    return element.text
+        except etree.XMLSyntaxError:
+            raise InvalidEventException("Event is not valid XML.")
+        raise InvalidEventException(
+            "'MEDIA_ID identifier' is not present in the event."
+        )
+
+    @staticmethod
+    def _iter_events(xml: bytes):
+        """Yields the start and end events of the XML, parsing it in chunks
+        as they are consumed.
+        """
+        parser = etree.XMLPullParser(events=("start", "end"))
+        for offset in range(0, len(xml), SNIFF_CHUNK_SIZE):
+            parser.feed(xml[offset : offset + SNIFF_CHUNK_SIZE])
+            yield from parser.read_events()
+        parser.close()
+        yield from parser.read_events()
+
     def _parse_event(self, event_type: str, xml: bytes):
         """Parse the input XML to a DOM"""
         try:
@@ -57,151 +215,161 @@ class EventParser(object):
         except etree.XMLSyntaxError:
             raise InvalidEventException("Event is not valid XML.")
 
-        try:
-            return tree.xpath(f"/vrt:{event_type}", namespaces=NAMESPACES)[0]
-        except IndexError:
-            raise InvalidEventException(f"Event is not a '{event_type}'.")
+        # The root element was already checked while sniffing.
+        return tree.getroot()
 
-    def _get_timestamp(self) -> str:
-        return self._get_xpath_from_event("./vrt:timestamp")
+    def _get_timestamp(self, root) -> str:
+        return self._get_text(TIMESTAMP, [root])
 
-    def _get_correlation_id(self) -> str:
-        return self._get_xpath_from_event("./vrt:correlationId")
+    def _get_correlation_id(self, root) -> str:
+        return self._get_text(CORRELATION_ID, [root])
 
-    def _get_status(self) -> str:
-        return self._get_xpath_from_event("./vrt:status")
+    def _get_status(self, root) -> str:
+        return self._get_text(STATUS, [root])
 
-    def _get_media_id(self) -> str:
-        return self._get_xpath_from_event("./vrt:mediaId")
+    def _get_media_id(self, root) -> str:
+        return self._get_text(MEDIA_ID, [root])
 
-    def _get_media_type(self) -> str:
-        is_video = bool(
-            self._get_xpath_from_event(
-                f"//ebu:format[@formatDefinition='current']/ebu:videoFormat",
-                xml=True,
-                optional=True,
-            )
-        )
-        is_audio = bool(
-            self._get_xpath_from_event(
-                f"//ebu:format[@formatDefinition='current']/ebu:audioFormat",
-                xml=True,
-                optional=True,
-            )
-        )
+    def _collect_elements(self, metadata) -> dict:
+        """Collects the elements that hold the information we need.
+
+        The metadata subtree is walked only once. The elements are kept in
+        document order.
+        """
+        elements = {EBU_FORMAT: [], EBU_IDENTIFIER: [], EBU_DESCRIPTION: []}
+        if metadata is None:
+            return elements
+        for element in metadata.iter(EBU_FORMAT, EBU_IDENTIFIER, EBU_DESCRIPTION):
+            elements[element.tag].append(element)
+        return elements
 
-        if is_video:
+    @staticmethod
+    def _get_current_formats(formats) -> list:
+        return [
+            ebu_format
+            for ebu_format in formats
+            if ebu_format.get("formatDefinition") == "current"
+        ]
+
+    def _get_media_type(self, current_formats) -> str:
+        if any(VIDEO_FORMAT(ebu_format) for ebu_format in current_formats):
             return "video"
-        if is_audio:
+        if any(AUDIO_FORMAT(ebu_format) for ebu_format in current_formats):
             return "audio"
 
         raise InvalidEventException("Unknown media type.")
 
-    def _calculate_resolution_xpath(self) -> str:
-        """ Calculates the XPATH for the resolution information.
+    def _get_resolution_formats(self, current_formats) -> list:
+        """Returns the formats that hold the resolution information.
 
         It will use hires information if it is available. Otherwise, use lores information.
 
         Returns:
-            The XPATH for the resolution information.
+            The current ebu:format elements for the resolution, in document order.
 
         Raises:
             InvalidEventException: If no hires and no lores are available.
         """
-        resolutions = ("hires", "lores")
-        xpath_resolutions = [
-            f"//ebu:format[@formatDefinition='current'][./ebu:videoFormat[@videoFormatDefinition='{res}']]"
-            for res
-            in resolutions
-        ]
-        for xpath_resolution in xpath_resolutions:
-            if self.event.xpath(xpath_resolution, namespaces=NAMESPACES):
-                return xpath_resolution
+        for resolution in ("hires", "lores"):
+            resolution_formats = [
+                ebu_format
+                for ebu_format in current_formats
+                if RESOLUTION_FORMAT(ebu_format, resolution=resolution)
+            ]
+            if resolution_formats:
+                return resolution_formats
         raise InvalidEventException("No hires/lores information available.")
 
-    def _parse_metadata(self, media_type):
-        raw = self._get_xpath_from_event("./vrt:metadata", xml=True)
-        media_id = self._get_xpath_from_event(
-            "//ebu:identifier[@typeDefinition='MEDIA_ID']/dc:identifier"
+    def _parse_metadata(self, root):
+        metadata = self._get_element(METADATA, [root], optional=True)
+        elements = self._collect_elements(metadata)
+        formats = elements[EBU_FORMAT]
+        current_formats = self._get_current_formats(formats)
+        identifiers = elements[EBU_IDENTIFIER]
+
+        media_type = self._get_media_type(current_formats)
+        # Kept as bytes, that's what is sent to the mtd-transformer.
+        raw = etree.tostring(metadata)
+        media_id = self._get_text(
+            DC_IDENTIFIER,
+            self._with_type(identifiers, "MEDIA_ID"),
+            name="MEDIA_ID identifier",
         )
 
         if media_type == "video":
-            base_xpath = self._calculate_resolution_xpath()
+            resolution_formats = self._get_resolution_formats(current_formats)
 
-            framerate = int(
-                self._get_xpath_from_event(
-                    f"{base_xpath}/ebu:videoFormat/ebu:frameRate"
-                )
-            )
-            duration = self._get_xpath_from_event(
-                "//ebu:description[@typeDefinition='duration']/dc:description"
-            )
-            som = self._get_xpath_from_event(
-                f"{base_xpath}/ebu:technicalAttributeString[@typeDefinition='SOM']"
-            )
-            soc = self._get_xpath_from_event(
-                f"{base_xpath}/ebu:start/ebu:timecode", optional=True,
-            )
-            eoc = self._get_xpath_from_event(
-                f"{base_xpath}/ebu:end/ebu:timecode", optional=True,
-            )
-            eom = self._get_xpath_from_event(
-                f"{base_xpath}/ebu:technicalAttributeString[@typeDefinition='EOM']",
-                optional=True,
-            )
-            openOT_available = bool(
-                self._get_xpath_from_event(
-                    f"//ebu:identifier[@typeDefinition='otIdOpen']",
-                    optional=True,
-                    xml=True,
-                )
-            ) or bool(
-                self._get_xpath_from_event(
-                    f"//ebu:format/ebu:dataFormat/ebu:captioningFormat[@formatDefinition='open']",
-                    optional=True,
-                    xml=True,
-                )
+            framerate = int(self._get_text(FRAMERATE, resolution_formats))
+            duration = self._get_text(
+                DC_DESCRIPTION,
+                self._with_type(elements[EBU_DESCRIPTION], "duration"),
+                name="duration description",
             )
+            som = self._get_text(SOM, resolution_formats)
+            soc = self._get_text(SOC, resolution_formats, optional=True)
+            eoc = self._get_text(EOC, resolution_formats, optional=True)
+            eom = self._get_text(EOM, resolution_formats, optional=True)
 
-            closedOT_available = bool(
-                self._get_xpath_from_event(
-                    f"//ebu:identifier[@typeDefinition='otIdClosed']",
-                    optional=True,
-                    xml=True,
-                )
-            ) or bool(
-                self._get_xpath_from_event(
-                    f"//ebu:format/ebu:dataFormat/ebu:captioningFormat[@formatDefinition='closed']",
-                    optional=True,
-                    xml=True,
-                )
+            captioning_formats = {
+                definition
+                for ebu_format in formats
+                for definition in CAPTIONING_FORMAT(ebu_format)
+            }
+            openOT_available = (
+                bool(self._with_type(identifiers, "otIdOpen"))
+                or "open" in captioning_formats
+            )
+            closedOT_available = (
+                bool(self._with_type(identifiers, "otIdClosed"))
+                or "closed" in captioning_formats
             )
 
-            return VideoMetadata(
-                raw,
-                framerate,
-                duration,
-                som,
-                soc,
-                eoc,
-                eom,
-                media_id,
-                openOT_available,
-                closedOT_available,
+            return (
+                VideoMetadata(
+                    raw,
+                    framerate,
+                    duration,
+                    som,
+                    soc,
+                    eoc,
+                    eom,
+                    media_id,
+                    openOT_available,
+                    closedOT_available,
+                ),
+                media_type,
             )
         if media_type == "audio":
-            return AudioMetadata(raw, media_id)
+            return AudioMetadata(raw, media_id), media_type
 
-    def _get_xpath_from_event(self, xpath, xml=False, optional: bool = False) -> str:
-        try:
-            if xml:
-                return etree.tostring(
-                    self.event.xpath(xpath, namespaces=NAMESPACES)[0]
-                ).decode("utf-8")
-            else:
-                return self.event.xpath(xpath, namespaces=NAMESPACES)[0].text
-        except IndexError:
-            if optional:
-                return ""
-            else:
-                raise InvalidEventException(f"'{xpath}' is not present in the event.")
+    @staticmethod
+    def _with_type(elements, type_definition: str) -> list:
+        return [
+            element
+            for element in elements
+            if element.get("typeDefinition") == type_definition
+        ]
+
+    def _get_element(
+        self, xpath: etree.XPath, context_nodes, optional: bool = False, name=None
+    ):
+        """Returns the first node that matches the XPath for any of the context
+        nodes, in order.
+        """
+        for context_node in context_nodes:
+            result = xpath(context_node)
+            if result:
+                return result[0]
+        if optional:
+            return None
+        raise InvalidEventException(
+            f"'{name or xpath.path}' is not present in the event."
+        )
+
+    def _get_text(
+        self, xpath: etree.XPath, context_nodes, optional: bool = False, name=None
+    ):
+        element = self._get_element(xpath, context_nodes, optional, name)
+        if element is None:
+            return ""
+        return element.text
@@ -1,24 +1,43 @@
 from lxml import etree
-from pathlib import Path
+from xml.sax.saxutils import escape
+
+# Precompiled template of the request, the values are escaped before filling in.
+MAKE_SUBTITLE_AVAILABLE_REQUEST_TEMPLATE = (
+    b"<?xml version='1.0' encoding='UTF-8'?>\n"
+    b'<makeSubtitleAvailableRequest xmlns="http://www.vrt.be/mig/viaa">\n'
+    b"  <requestor>meemoo</requestor>\n"
+    b"  <correlationId>%(correlation_id)s</correlationId>\n"
+    b"  <id>%(media_id)s</id>\n"
+    b"  <destinationPath>mam-collaterals/%(ot_type)sOT/%(media_id)s/</destinationPath>\n"
+    b"  <otType>%(ot_type_upper)s</otType>\n"
+    b"</makeSubtitleAvailableRequest>\n"
+)
+
+
+def _escape(value: str) -> bytes:
+    return escape(value).encode("utf-8")
 
 
 def generate_make_subtitle_available_request_xml(
     ot_type: str, correlation_id: str, media_id: str
 ) -> bytes:
-    NAMESPACES = {
-        None: "http://www.vrt.be/mig/viaa",
-    }
-    xml_data_dict = {
-        "requestor": "meemoo",
-        "correlationId": correlation_id,
-        "id": media_id,
-        "destinationPath": f"mam-collaterals/{ot_type}OT/{media_id}/",
-        "otType": ot_type.upper(),
+    return MAKE_SUBTITLE_AVAILABLE_REQUEST_TEMPLATE % {
+        b"correlation_id": _escape(correlation_id),
+        b"media_id": _escape(media_id),
+        b"ot_type": _escape(ot_type),
+        b"ot_type_upper": _escape(ot_type.upper()),
     }
 
-    root = etree.Element("makeSubtitleAvailableRequest", nsmap=NAMESPACES)
-    for sub, val in xml_data_dict.items():
-        etree.SubElement(root, sub).text = val
-    return etree.tostring(
-        root, pretty_print=True, encoding="UTF-8", xml_declaration=True
-    )
+
+def canonicalize(xml) -> str:
+    """Returns the canonical form (C14N 2.0) of the XML.
+
+    Whitespace around text is stripped, so documents that only differ in
+    formatting have the same canonical form.
+    """
+    if isinstance(xml, bytes):
+        xml = xml.decode("utf-8")
+    # C14N doesn't accept an XML declaration in a string
+    if xml.lstrip().startswith("<?xml"):
+        xml = xml[xml.index("?>") + 2 :]
+    return etree.canonicalize(xml, strip_text=True)
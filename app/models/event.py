@@ -1,4 +1,5 @@
 from abc import ABC
+from datetime import datetime
 
 NAMESPACES = {
     "vrt": "http://www.vrt.be/mig/viaa/api",
@@ -10,14 +11,39 @@ NAMESPACES = {
 class Event(ABC):
     """The base Event object."""
 
+    __slots__ = ("event_type", "timestamp", "metadata", "media_type")
+
     def __init__(self, event_type: str, metadata, timestamp: str, media_type: str):
         self.event_type = event_type
         self.timestamp = timestamp
         self.metadata = metadata
         self.media_type = media_type
 
+    @property
+    def parsed_timestamp(self):
+        """The timestamp as a datetime, or None if it can't be parsed."""
+        try:
+            return datetime.fromisoformat(self.timestamp.replace("Z", "+00:00"))
+        except (AttributeError, ValueError):
+            return None
+
+    def is_newer_than(self, other) -> bool:
+        """Checks if this event is at least as new as the other event.
+
+        If the timestamps can't be compared, this event is considered newer
+        as it was received later.
+        """
+        timestamp = self.parsed_timestamp
+        other_timestamp = other.parsed_timestamp
+        try:
+            return timestamp >= other_timestamp
+        except TypeError:
+            return True
+
 
 class GetMetadataResponseEvent(Event):
+    __slots__ = ("correlation_id", "status")
+
     def __init__(
         self,
         event_type: str,
@@ -33,6 +59,8 @@ class GetMetadataResponseEvent(Event):
 
 
 class MetadataUpdatedEvent(Event):
+    __slots__ = ("media_id",)
+
     def __init__(
         self,
         event_type: str,
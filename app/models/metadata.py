@@ -9,7 +9,15 @@ NAMESPACES = {
 
 
 class Metadata(ABC):
-    def __init__(self, raw, media_id):
+    """The metadata of an event.
+
+    The raw metadata is kept as the bytes of the serialised XML, so it can be
+    sent to the mtd-transformer as is.
+    """
+
+    __slots__ = ("raw", "media_id")
+
+    def __init__(self, raw: bytes, media_id):
         self.raw = raw
         self.media_id = media_id
 
@@ -21,6 +29,17 @@ class Metadata(ABC):
 
 
 class VideoMetadata(Metadata):
+    __slots__ = (
+        "framerate",
+        "duration",
+        "som",
+        "soc",
+        "eoc",
+        "eom",
+        "openOT_available",
+        "closedOT_available",
+    )
+
     def __init__(
         self,
         raw,
@@ -89,7 +108,9 @@ class VideoMetadata(Metadata):
 
 
 class AudioMetadata(Metadata):
-    def __init__(self, raw, media_id):
+    __slots__ = ()
+
+    def __init__(self, raw: bytes, media_id):
         super().__init__(raw, media_id)
 
     def _validate_metadata(self):
@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  app/replay.py
+#
+#  Replays VRT events from a dump, without RabbitMQ, e.g. to push metadata
+#  again after the transformation changed.
+#
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import tarfile
+import time
+from collections import Counter
+from concurrent.futures import (
+    ALL_COMPLETED,
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    wait,
+)
+from io import BytesIO
+
+from lxml import etree
+from viaa.configuration import ConfigParser
+
+from app.app import EventListener, NackException
+from app.models.exceptions import InvalidEventException
+from app.services.rate_limiter import SharedRateLimiter
+
+# The pipeline of the current worker process, set by _init_worker
+_pipeline = None
+
+
+class ReplayPipeline(EventListener):
+    """The pipeline of the EventListener without a broker.
+
+    The metadata is always updated, even if it didn't change. Subtitles are
+    not requested, as that needs a broker.
+    """
+
+    def __init__(self, rate_limiter: SharedRateLimiter):
+        self.shared_rate_limiter = rate_limiter
+        super().__init__()
+
+    def _init_pipeline(self, worker_count: int):
+        super()._init_pipeline(worker_count)
+        self.rate_limiter = self.shared_rate_limiter
+
+    def _init_broker(self, worker_count: int):
+        self.worker_pool = None
+        self.rabbit_client = None
+        self.publisher = None
+        self.coalescer = None
+
+    def _request_subtitles(self, event):
+        pass
+
+    def replay(self, event_type: str, body: bytes):
+        """Replays one event.
+
+        Returns:
+            The status ("updated" or "failed") and the reason of a failure.
+        """
+        try:
+            event = self.event_parser.get_event(event_type, body)
+            self._apply_event(event, force=True)
+        except InvalidEventException as error:
+            return "failed", f"Unable to parse the event: {error}"
+        except NackException as error:
+            return "failed", error.message
+        return "updated", None
+
+
+def sniff_event_type(body: bytes) -> str:
+    """Returns the local name of the root element of the event."""
+    for _, element in etree.iterparse(BytesIO(body.strip()), events=("start",)):
+        return etree.QName(element).localname
+
+
+def read_directory(path: str):
+    """Yields the id, event type and body of every XML file in the directory."""
+    for root, _, filenames in os.walk(path):
+        for filename in sorted(filenames):
+            if not filename.endswith(".xml"):
+                continue
+            file_path = os.path.join(root, filename)
+            with open(file_path, "rb") as f:
+                body = f.read()
+            yield os.path.relpath(file_path, path), None, body
+
+
+def read_tarball(path: str):
+    """Yields the id, event type and body of every XML file in the tarball."""
+    with tarfile.open(path) as tar:
+        for member in tar:
+            if member.isfile() and member.name.endswith(".xml"):
+                yield member.name, None, tar.extractfile(member).read()
+
+
+def read_jsonl(path: str):
+    """Yields the id, event type and body of every line of a JSONL dump.
+
+    Every line has a "body" and optionally an "id" and an "event_type" or the
+    "routing_key" the event was received with.
+    """
+    with open(path) as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            event_type = record.get("event_type")
+            if event_type is None and record.get("routing_key"):
+                event_type = record["routing_key"].split(".")[-1]
+            yield (
+                str(record.get("id", line_number)),
+                event_type,
+                record["body"].encode("utf-8"),
+            )
+
+
+def read_source(path: str):
+    if os.path.isdir(path):
+        return read_directory(path)
+    if path.endswith(".jsonl"):
+        return read_jsonl(path)
+    if tarfile.is_tarfile(path):
+        return read_tarball(path)
+    raise ValueError(f"Can't read events from {path}.")
+
+
+def load_checkpoint(path: str, source: str) -> set:
+    """Returns the ids of the events of the source that were already updated.
+
+    The first line of a checkpoint holds the source it was written for, as
+    the ids are only unique within a source.
+
+    Raises:
+        ValueError: If the checkpoint was written for another source.
+    """
+    if not path or not os.path.exists(path) or not os.path.getsize(path):
+        return set()
+    with open(path) as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+    checkpoint_source = entries[0].get("source") if entries else None
+    if checkpoint_source != source:
+        raise ValueError(
+            f"Checkpoint {path} is of {checkpoint_source}, not of {source}."
+        )
+    return {entry["id"] for entry in entries[1:] if entry["status"] == "updated"}
+
+
+def skip_done(records, done: set, statuses: Counter):
+    """Yields the records that weren't updated yet, and counts the others."""
+    for record in records:
+        if record[0] in done:
+            statuses["skipped"] += 1
+        else:
+            yield record
+
+
+def _init_worker(rate_limiter: SharedRateLimiter):
+    global _pipeline
+    _pipeline = ReplayPipeline(rate_limiter)
+
+
+def _replay(record):
+    record_id, event_type, body = record
+    try:
+        event_type = event_type or sniff_event_type(body)
+    except etree.XMLSyntaxError:
+        return record_id, "failed", "Event is not valid XML."
+    try:
+        status, reason = _pipeline.replay(event_type, body)
+    except Exception as error:
+        # Don't abort the whole run for one event
+        return record_id, "failed", f"Unexpected error: {error}"
+    return record_id, status, reason
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Replays VRT events from a directory, tarball or JSONL dump."
+    )
+    parser.add_argument("source", help="A directory, tarball or .jsonl file.")
+    parser.add_argument(
+        "--processes", type=int, default=os.cpu_count(), help="Number of processes."
+    )
+    parser.add_argument(
+        "--checkpoint",
+        help="Events of the source that were updated are skipped when "
+        "replaying again with the same checkpoint.",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        help="Initial calls per second to MediaHaven, for all processes together.",
+    )
+    parser.add_argument("--report", help="Also write the summary to this file.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    config = ConfigParser().app_cfg
+    rate_limit_config = dict(config["mediahaven"]["rate_limit"])
+    if args.rate:
+        rate_limit_config["rate"] = args.rate
+
+    context = multiprocessing.get_context("spawn")
+    rate_limiter = SharedRateLimiter.from_config(rate_limit_config, context=context)
+    source = os.path.abspath(args.source)
+    done = load_checkpoint(args.checkpoint, source)
+
+    statuses = Counter()
+    reasons = Counter()
+    records = skip_done(read_source(args.source), done, statuses)
+    start = time.monotonic()
+    with open(args.checkpoint or os.devnull, "a") as checkpoint, ProcessPoolExecutor(
+        args.processes,
+        mp_context=context,
+        initializer=_init_worker,
+        initargs=(rate_limiter,),
+    ) as executor:
+        if not checkpoint.tell():
+            checkpoint.write(json.dumps({"source": source}) + "\n")
+        # Only read ahead a few events per process, dumps can be large.
+        pending = set()
+        for record in itertools.chain(records, [None]):
+            if record is not None:
+                pending.add(executor.submit(_replay, record))
+                if len(pending) < args.processes * 4:
+                    continue
+            finished, pending = wait(
+                pending, return_when=FIRST_COMPLETED if record else ALL_COMPLETED
+            )
+            for future in finished:
+                record_id, status, reason = future.result()
+                statuses[status] += 1
+                if reason:
+                    reasons[reason] += 1
+                checkpoint.write(
+                    json.dumps({"id": record_id, "status": status, "reason": reason})
+                    + "\n"
+                )
+            checkpoint.flush()
+    elapsed = time.monotonic() - start
+
+    replayed = statuses["updated"] + statuses["failed"]
+    summary = {
+        "updated": statuses["updated"],
+        "failed": statuses["failed"],
+        "skipped": statuses["skipped"],
+        "reasons": dict(reasons.most_common()),
+        "seconds": round(elapsed, 1),
+        "events_per_second": round(replayed / elapsed, 2) if elapsed else None,
+    }
+    print(json.dumps(summary, indent=2))
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(summary, f, indent=2)
+    return summary
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  app/services/batcher.py
+#
+
+import functools
+
+
+class Batcher:
+    """Collects items into batches.
+
+    A batch is released when it holds `size` items, or `max_wait` seconds
+    after its first item arrived, whichever comes first.
+
+    With `one_at_a_time`, the next batch is held back until `done` is called
+    for the released one. Items keep being collected in the meantime.
+
+    This class is not thread-safe, it should only be used from the connection
+    thread.
+
+    Args:
+        size: The maximum number of items in a batch.
+        max_wait: The maximum time to wait for a batch to fill up, in seconds.
+        call_later: Callable to schedule a callback after a delay.
+        on_release: Called with the list of items of a batch.
+        one_at_a_time: Wait for `done` before releasing the next batch.
+    """
+
+    def __init__(
+        self,
+        size: int,
+        max_wait: float,
+        call_later,
+        on_release,
+        one_at_a_time: bool = False,
+    ):
+        self.size = size
+        self.max_wait = max_wait
+        self.call_later = call_later
+        self.on_release = on_release
+        self.one_at_a_time = one_at_a_time
+        self.items = []
+        # Identifies the current batch, so a timer of a batch that was
+        # already released doesn't release the next one.
+        self.batch_number = 0
+        # With one_at_a_time: a batch is being handled, and the next one is
+        # due as soon as it's done.
+        self.busy = False
+        self.due = False
+
+    def add(self, item):
+        self.items.append(item)
+        if len(self.items) == 1:
+            self.call_later(
+                self.max_wait, functools.partial(self._on_timeout, self.batch_number)
+            )
+        if len(self.items) >= self.size:
+            self._release()
+
+    def done(self):
+        """Marks the released batch as handled, with `one_at_a_time`."""
+        self.busy = False
+        if self.due:
+            self.due = False
+            self._release()
+
+    def _on_timeout(self, batch_number: int):
+        if batch_number == self.batch_number and self.items:
+            self._release()
+
+    def _release(self):
+        if self.busy:
+            self.due = True
+            return
+        items, self.items = self.items[: self.size], self.items[self.size :]
+        self.batch_number += 1
+        if self.items:
+            # Collected while the previous batch was being handled
+            if len(self.items) >= self.size:
+                self.due = True
+            else:
+                self.call_later(
+                    self.max_wait,
+                    functools.partial(self._on_timeout, self.batch_number),
+                )
+        self.busy = self.one_at_a_time
+        self.on_release(items)
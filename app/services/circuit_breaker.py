@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  app/services/circuit_breaker.py
+#
+
+import threading
+import time
+from contextlib import contextmanager
+
+from app.services.rate_limiter import is_overload_error
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Exception raised when a call is refused because the circuit is open."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.message = f"Circuit breaker for {name} is open."
+
+
+class CircuitBreaker:
+    """Stops calling a backend that keeps failing.
+
+    The circuit opens after `failure_threshold` consecutive failures, and
+    calls are refused. After `reset_timeout` seconds it is half-open: one
+    call is let through as a probe. If that call succeeds the circuit closes,
+    otherwise it opens again.
+
+    Args:
+        name: The name of the backend.
+        failure_threshold: The number of consecutive failures to open.
+        reset_timeout: The time in seconds before a probe is let through.
+        on_state_change: Called with the breaker and its new state, from
+            the thread that caused the change.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int,
+        reset_timeout: float,
+        on_state_change=None,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.on_state_change = on_state_change
+
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, name: str, config: dict, on_state_change=None):
+        return cls(
+            name,
+            failure_threshold=int(config["failure_threshold"]),
+            reset_timeout=float(config["reset_timeout"]),
+            on_state_change=on_state_change,
+        )
+
+    def retry_after(self) -> float:
+        """Returns the time in seconds until a call will be let through."""
+        with self.lock:
+            if self.state == OPEN:
+                return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+            if self.state == HALF_OPEN and self.probing:
+                return self.reset_timeout
+            return 0.0
+
+    def before_call(self):
+        """Checks if a call is allowed.
+
+        Raises:
+            CircuitOpenError: If the circuit is open, or half-open and the
+                probe is still running.
+        """
+        changed = False
+        with self.lock:
+            if self.state == OPEN:
+                if time.monotonic() < self.opened_at + self.reset_timeout:
+                    raise CircuitOpenError(self.name)
+                self.state = HALF_OPEN
+                changed = True
+            if self.state == HALF_OPEN:
+                if self.probing:
+                    raise CircuitOpenError(self.name)
+                self.probing = True
+        if changed:
+            self._notify(HALF_OPEN)
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.probing = False
+            changed = self.state != CLOSED
+            self.state = CLOSED
+        if changed:
+            self._notify(CLOSED)
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.state == OPEN or (
+                self.state == CLOSED and self.failures < self.failure_threshold
+            ):
+                return
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+        self._notify(OPEN)
+
+    @contextmanager
+    def guard(self, is_failure=is_overload_error, neutral=()):
+        """Context manager to call the backend through the breaker.
+
+        Only errors for which `is_failure` is true count as failures, other
+        errors mean the backend is up. Errors of the `neutral` types say
+        nothing about the backend and count as neither.
+
+        Raises:
+            CircuitOpenError: If the call is not allowed.
+        """
+        self.before_call()
+        try:
+            yield
+        except neutral:
+            self._release_probe()
+            raise
+        except Exception as error:
+            if is_failure(error):
+                self.record_failure()
+            else:
+                self.record_success()
+            raise
+        except BaseException:
+            # Cancelled
+            self._release_probe()
+            raise
+        self.record_success()
+
+    def _release_probe(self):
+        # Let another call probe
+        with self.lock:
+            self.probing = False
+
+    def _notify(self, state: str):
+        if self.on_state_change is not None:
+            self.on_state_change(self, state)
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  app/services/coalescer.py
+#
+
+import functools
+
+from app.services import metrics
+
+
+class Coalescer:
+    """Coalesces bursts of events for the same media id.
+
+    The first event for a media id opens a window. Events for that media id
+    that arrive during the window replace the held event if they are at least
+    as new (based on the VRT timestamp). When the window closes, only the
+    newest event is released. Superseded events are handed to `on_superseded`.
+
+    This class is not thread-safe, it should only be used from the connection
+    thread.
+
+    Args:
+        window: The time to hold events, in seconds.
+        call_later: Callable to schedule a callback after a delay.
+        on_release: Called with the item of the newest event of a window.
+        on_superseded: Called with the item of an event that was superseded.
+    """
+
+    def __init__(self, window: float, call_later, on_release, on_superseded):
+        self.window = window
+        self.call_later = call_later
+        self.on_release = on_release
+        self.on_superseded = on_superseded
+        self.pending = {}
+
+    def add(self, media_id: str, event, item):
+        held = self.pending.get(media_id)
+        if held is None:
+            self.pending[media_id] = (event, item)
+            self.call_later(self.window, functools.partial(self._release, media_id))
+            return
+
+        held_event, held_item = held
+        if event.is_newer_than(held_event):
+            self.pending[media_id] = (event, item)
+            self._supersede(held_item)
+        else:
+            self._supersede(item)
+
+    def _supersede(self, item):
+        metrics.COALESCED.inc()
+        self.on_superseded(item)
+
+    def _release(self, media_id: str):
+        _, item = self.pending.pop(media_id)
+        self.on_release(item)
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  app/services/fragment_cache.py
+#
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class FragmentCache:
+    """Thread-safe LRU cache mapping media ids to MediaHaven fragment ids.
+
+    Entries expire after `ttl` seconds. When the cache is full, the least
+    recently used entry is evicted.
+
+    Args:
+        max_size: The maximum number of entries.
+        ttl: The time to live of an entry, in seconds.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: dict):
+        return cls(max_size=int(config["max_size"]), ttl=float(config["ttl"]))
+
+    def get(self, media_id: str):
+        """Returns the cached fragment id for the media id, or None."""
+        with self.lock:
+            entry = self.entries.get(media_id)
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None:
+                    del self.entries[media_id]
+                return None
+
+            self.entries.move_to_end(media_id)
+            return entry[0]
+
+    def put(self, media_id: str, fragment_id: str):
+        with self.lock:
+            self.entries[media_id] = (fragment_id, time.monotonic() + self.ttl)
+            self.entries.move_to_end(media_id)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, media_id: str):
+        with self.lock:
+            self.entries.pop(media_id, None)
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  app/services/idempotency.py
+#
+
+from hashlib import md5
+
+from app.helpers.xml_helper import canonicalize
+from app.services.media_id_store import MediaIdStore
+
+
+class IdempotencyStore:
+    """Remembers a checksum of the metadata last applied per media id.
+
+    This is used to skip events of which the metadata didn't change since
+    the last update, e.g. redeliveries or re-sends by VRT.
+    """
+
+    def __init__(self, store: MediaIdStore):
+        self.store = store
+
+    @staticmethod
+    def checksum(raw) -> str:
+        """Returns the checksum of the canonical form of the metadata."""
+        return md5(canonicalize(raw).encode("utf-8")).hexdigest()
+
+    def is_unchanged(self, media_id: str, checksum: str) -> bool:
+        """Checks if the metadata was already applied."""
+        return self.store.get(media_id) == checksum
+
+    def record(self, media_id: str, checksum: str):
+        self.store.put(media_id, checksum)
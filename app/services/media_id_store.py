@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  app/services/media_id_store.py
+#
+
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Prune the SQLite table every this many writes
+PRUNE_INTERVAL = 100
+
+
+class MediaIdStore:
+    """Thread-safe store of a value per media id.
+
+    The values are kept in memory in an LRU cache of at most `max_size`
+    entries. If a path is given, the values are also written to a SQLite
+    database, so they survive a restart. That table is pruned to the
+    `max_size` most recently written entries.
+
+    Args:
+        max_size: The maximum number of media ids to keep.
+        path: The path of the SQLite database, or None to only keep the
+            values in memory.
+        table: The name of the table in the SQLite database.
+    """
+
+    def __init__(self, max_size: int, path: str = None, table: str = "media_ids"):
+        self.max_size = max_size
+        self.table = table
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.writes = 0
+
+        self.connection = None
+        if path:
+            self.connection = sqlite3.connect(path, check_same_thread=False)
+            with self.connection:
+                self.connection.execute(
+                    f"CREATE TABLE IF NOT EXISTS {table} "
+                    "(media_id TEXT PRIMARY KEY, value TEXT, updated_at REAL)"
+                )
+
+    @classmethod
+    def from_config(cls, config: dict, table: str):
+        return cls(
+            max_size=int(config["max_size"]), path=config["path"] or None, table=table
+        )
+
+    def get(self, media_id: str):
+        """Returns the value for the media id, or None."""
+        with self.lock:
+            if media_id in self.entries:
+                self.entries.move_to_end(media_id)
+                return self.entries[media_id]
+
+            if self.connection is None:
+                return None
+            row = self.connection.execute(
+                f"SELECT value FROM {self.table} WHERE media_id = ?", (media_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._put_in_memory(media_id, row[0])
+            return row[0]
+
+    def put(self, media_id: str, value: str):
+        with self.lock:
+            self._put_in_memory(media_id, value)
+
+            if self.connection is None:
+                return
+            with self.connection:
+                self.connection.execute(
+                    f"INSERT OR REPLACE INTO {self.table} VALUES (?, ?, ?)",
+                    (media_id, value, time.time()),
+                )
+                self.writes += 1
+                if self.writes % PRUNE_INTERVAL == 0:
+                    self._prune()
+
+    def _put_in_memory(self, media_id: str, value: str):
+        self.entries[media_id] = value
+        self.entries.move_to_end(media_id)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def _prune(self):
+        self.connection.execute(
+            f"DELETE FROM {self.table} WHERE media_id NOT IN "
+            f"(SELECT media_id FROM {self.table} ORDER BY updated_at DESC LIMIT ?)",
+            (self.max_size,),
+        )
+
+    def __len__(self):
+        return len(self.entries)
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  app/services/metrics.py
+#
+
+import asyncio
+import functools
+import time
+
+from prometheus_client import Counter, Enum, Gauge, Histogram, start_http_server
+
+STAGE_LATENCY = Histogram(
+    "vrt_events_metadata_stage_seconds",
+    "Time spent in a stage of the pipeline.",
+    ["stage"],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+RECEIVED = Counter(
+    "vrt_events_metadata_received_total",
+    "Messages received, by event type.",
+    ["event_type"],
+)
+ACKED = Counter(
+    "vrt_events_metadata_acked_total",
+    "Messages that were handled and acked.",
+    ["outcome"],
+)
+NACKED = Counter(
+    "vrt_events_metadata_nacked_total",
+    "Messages that were nacked without requeueing, by reason.",
+    ["reason"],
+)
+REQUEUED = Counter(
+    "vrt_events_metadata_requeued_total",
+    "Messages that were scheduled for a retry, by reason.",
+    ["reason"],
+)
+PARKED = Counter(
+    "vrt_events_metadata_parked_total",
+    "Messages that were moved to the parking queue after too many retries.",
+)
+COALESCED = Counter(
+    "vrt_events_metadata_coalesced_total",
+    "Events that were superseded by a newer event for the same media id.",
+)
+STALE = Counter(
+    "vrt_events_metadata_stale_total",
+    "Events that were skipped because a newer event was already applied.",
+)
+UNCHANGED = Counter(
+    "vrt_events_metadata_unchanged_total",
+    "Events that weren't updated because the metadata didn't change.",
+)
+FRAGMENT_CACHE = Counter(
+    "vrt_events_metadata_fragment_cache_total",
+    "Lookups of a fragment id in the cache, by result.",
+    ["result"],
+)
+TRANSFORM_PARITY = Counter(
+    "vrt_events_metadata_transform_parity_total",
+    "Comparisons of the local with the remote transformation, by result.",
+    ["result"],
+)
+TOKEN_REFRESH_FAILURES = Counter(
+    "vrt_events_metadata_token_refresh_failures_total",
+    "Failed requests for a new MediaHaven token.",
+)
+BREAKER_STATE = Enum(
+    "vrt_events_metadata_circuit_breaker_state",
+    "State of the circuit breaker of a downstream service.",
+    ["breaker"],
+    states=["closed", "half_open", "open"],
+)
+IN_FLIGHT = Gauge(
+    "vrt_events_metadata_in_flight",
+    "Events that are being handled.",
+)
+
+
+def timed(stage: str):
+    """Decorator that records the duration of every call in the stage histogram.
+
+    Works for both functions and coroutine functions. Calls that raise are
+    recorded as well.
+    """
+    histogram = STAGE_LATENCY.labels(stage=stage)
+
+    def decorator(fn):
+        if asyncio.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - start)
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+def start_server(config: dict):
+    """Serves the metrics over HTTP in a background thread.
+
+    Nothing is served if the port is 0.
+    """
+    port = int(config["port"])
+    if port:
+        start_http_server(port)
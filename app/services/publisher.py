@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  app/services/publisher.py
+#
+
+import functools
+import itertools
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+
+import pika
+from viaa.configuration import ConfigParser
+from viaa.observability import logging
+
+
+class PublishError(Exception):
+    """Exception raised when a message could not be published or was not
+    confirmed by the broker.
+    """
+
+    def __init__(self, message, **kwargs):
+        self.message = message
+        self.kwargs = kwargs
+
+
+class ConfirmingPublisher:
+    """Publishes messages on a dedicated connection with publisher confirms.
+
+    The connection runs its own IO loop on a background thread, so publishing
+    doesn't touch the consumer's connection and is safe from any thread.
+    Confirms are tracked asynchronously by delivery tag, which lets the broker
+    confirm a batch of messages at once.
+    """
+
+    def __init__(self):
+        configParser = ConfigParser()
+        self.log = logging.get_logger(__name__, config=configParser)
+        rabbit_config = configParser.app_cfg["rabbitmq"]
+
+        self.parameters = pika.ConnectionParameters(
+            host=rabbit_config["host"],
+            port=rabbit_config["port"],
+            credentials=pika.PlainCredentials(
+                rabbit_config["username"], rabbit_config["password"]
+            ),
+        )
+        self.confirm_timeout = float(rabbit_config["publisher"]["confirm_timeout"])
+        self.reconnect_delay = float(rabbit_config["publisher"]["reconnect_delay"])
+
+        # Only used on the IO loop thread
+        self.connection = None
+        self.channel = None
+        self.delivery_tag = 0
+        self.pending = {}
+
+        self.ready = threading.Event()
+        self.closing = False
+        self.thread = threading.Thread(target=self._run, name="publisher", daemon=True)
+        self.thread.start()
+
+    def publish_batch(
+        self, exchange: str, routing_key: str, bodies: list, headers: list = None
+    ):
+        """Publishes the messages and waits until the broker confirmed all of them.
+
+        Args:
+            headers: The headers of each message, or None.
+
+        Raises:
+            PublishError: If a message was not confirmed in time or nacked.
+        """
+        if not bodies:
+            return
+        properties = [
+            pika.BasicProperties(
+                delivery_mode=pika.spec.PERSISTENT_DELIVERY_MODE,
+                headers=message_headers,
+            )
+            for message_headers in headers or itertools.repeat(None, len(bodies))
+        ]
+        self._publish_and_wait(exchange, routing_key, bodies, properties)
+
+    def publish(
+        self, exchange: str, routing_key: str, body, properties: pika.BasicProperties
+    ):
+        """Publishes the message and waits until the broker confirmed it.
+
+        Raises:
+            PublishError: If the message was not confirmed in time or nacked.
+        """
+        self._publish_and_wait(exchange, routing_key, [body], [properties])
+
+    def _publish_and_wait(
+        self, exchange: str, routing_key: str, bodies: list, properties: list
+    ):
+        if not self.ready.wait(self.confirm_timeout):
+            raise PublishError("Publisher is not connected to RabbitMQ.")
+
+        futures = [Future() for _ in bodies]
+        self.connection.ioloop.add_callback_threadsafe(
+            functools.partial(
+                self._publish, exchange, routing_key, bodies, properties, futures
+            )
+        )
+
+        deadline = time.monotonic() + self.confirm_timeout
+        for future in futures:
+            try:
+                future.result(timeout=max(0, deadline - time.monotonic()))
+            except TimeoutError:
+                raise PublishError(
+                    "Publish was not confirmed in time.", routing_key=routing_key
+                )
+
+    def close(self):
+        self.closing = True
+        if self.connection is not None:
+            self.connection.ioloop.add_callback_threadsafe(self._close)
+        self.thread.join(timeout=self.confirm_timeout)
+
+    # Everything below runs on the IO loop thread
+    def _run(self):
+        while not self.closing:
+            self.connection = pika.SelectConnection(
+                self.parameters,
+                on_open_callback=self._on_connection_open,
+                on_open_error_callback=self._on_connection_open_error,
+                on_close_callback=self._on_connection_closed,
+            )
+            self.connection.ioloop.start()
+            if not self.closing:
+                time.sleep(self.reconnect_delay)
+
+    def _on_connection_open(self, connection):
+        connection.channel(on_open_callback=self._on_channel_open)
+
+    def _on_connection_open_error(self, connection, error):
+        self.log.warning("Publisher could not connect to RabbitMQ.", error=error)
+        connection.ioloop.stop()
+
+    def _on_connection_closed(self, connection, reason):
+        self.ready.clear()
+        self.channel = None
+        self._fail_pending(reason)
+        if not self.closing:
+            self.log.warning("Publisher lost connection, reconnecting...")
+        connection.ioloop.stop()
+
+    def _on_channel_open(self, channel):
+        channel.add_on_close_callback(self._on_channel_closed)
+        channel.confirm_delivery(self._on_confirm)
+        self.channel = channel
+        self.delivery_tag = 0
+        self.ready.set()
+
+    def _on_channel_closed(self, channel, reason):
+        self.ready.clear()
+        self.channel = None
+        self._fail_pending(reason)
+        # Reconnect to get a new channel
+        if self.connection.is_open:
+            self.connection.close()
+
+    def _publish(self, exchange, routing_key, bodies, properties, futures):
+        for body, message_properties, future in zip(bodies, properties, futures):
+            if self.channel is None or not self.channel.is_open:
+                future.set_exception(PublishError("Publisher channel is closed."))
+                continue
+            self.channel.basic_publish(
+                exchange=exchange,
+                routing_key=routing_key,
+                body=body,
+                properties=message_properties,
+            )
+            self.delivery_tag += 1
+            self.pending[self.delivery_tag] = future
+
+    def _on_confirm(self, frame):
+        method = frame.method
+        if method.multiple:
+            delivery_tags = [tag for tag in self.pending if tag <= method.delivery_tag]
+        else:
+            delivery_tags = [method.delivery_tag]
+
+        acked = isinstance(method, pika.spec.Basic.Ack)
+        for delivery_tag in delivery_tags:
+            future = self.pending.pop(delivery_tag, None)
+            if future is None:
+                continue
+            if acked:
+                future.set_result(None)
+            else:
+                future.set_exception(PublishError("Publish was nacked by RabbitMQ."))
+
+    def _fail_pending(self, reason):
+        for future in self.pending.values():
+            future.set_exception(
+                PublishError("Publisher connection was closed.", reason=reason)
+            )
+        self.pending = {}
+
+    def _close(self):
+        if self.connection.is_open:
+            self.connection.close()
@@ -6,6 +6,8 @@
 #  app/services/rabbit.py
 #
 
+import functools
+import threading
 import time
 
 from viaa.configuration import ConfigParser
@@ -13,6 +15,47 @@ from viaa.observability import logging
 
 import pika
 
+from app.services.sharding import MEDIA_ID_HEADER
+
+
+class ThreadSafeChannel:
+    """Wraps a channel so messages can be acked and nacked from worker threads.
+
+    The actual acks and nacks are scheduled on the connection thread.
+    """
+
+    def __init__(self, rabbit_client, channel):
+        self.rabbit_client = rabbit_client
+        self.channel = channel
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self.rabbit_client.call_threadsafe(
+            functools.partial(
+                self._when_open,
+                self.channel.basic_ack,
+                delivery_tag=delivery_tag,
+                multiple=multiple,
+            )
+        )
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        self.rabbit_client.call_threadsafe(
+            functools.partial(
+                self._when_open,
+                self.channel.basic_nack,
+                delivery_tag=delivery_tag,
+                multiple=multiple,
+                requeue=requeue,
+            )
+        )
+
+    def _when_open(self, method, **kwargs):
+        # The delivery tags are only valid on the channel the message was
+        # received on. If that channel is gone, the broker redelivers the
+        # message anyway.
+        if self.channel.is_open:
+            method(**kwargs)
+
 
 class RabbitClient:
     def __init__(self):
@@ -34,23 +77,160 @@ class RabbitClient:
 
         self.channel = self.connection.channel()
         self.prefetch_count = int(self.rabbitConfig["prefetch_count"])
+        # Pika's BlockingConnection may only be used from the thread that
+        # created it.
+        self.connection_thread = threading.get_ident()
+
+        # Only used on the connection thread
+        self.consumer_channel = None
+        self.consumer_tags = []
+        self.queues = []
+        self.on_message_callback = None
+        self.paused = False
+
+    def call_threadsafe(self, callback):
+        """Runs the callback on the connection thread.
+
+        When called from the connection thread itself, the callback is run
+        immediately.
+        """
+        if threading.get_ident() == self.connection_thread:
+            callback()
+        else:
+            self.connection.add_callback_threadsafe(callback)
 
-    def send_message(self, routing_key, body, exchange=""):
+    def call_later(self, delay, callback):
+        """Runs the callback on the connection thread after a delay (in seconds).
+
+        Must be called from the connection thread.
+        """
+        self.connection.call_later(delay, callback)
+
+    def send_message(self, routing_key, body, exchange="", properties=None):
+        self.call_threadsafe(
+            functools.partial(self._publish, routing_key, body, exchange, properties)
+        )
+
+    def _publish(self, routing_key, body, exchange, properties):
         try:
             self.channel.basic_publish(
                 exchange=exchange,
                 routing_key=routing_key,
                 body=body,
+                properties=properties,
             )
         except pika.exceptions.AMQPConnectionError as error:
             raise error
 
-    def listen(self, on_message_callback, queue=None):
+    def declare_retry_queues(self, queue, retry_policy):
+        """Declares the retry queues and the parking queue for the given queue.
 
-        consumer_tag = 'Not yet created'
+        Expired messages on a retry queue are dead-lettered back to the queue.
+        """
+        for attempt in range(1, retry_policy.max_attempts + 1):
+            self.channel.queue_declare(
+                queue=retry_policy.retry_queue(queue, attempt),
+                durable=True,
+                arguments={
+                    "x-dead-letter-exchange": "",
+                    "x-dead-letter-routing-key": queue,
+                },
+            )
+        self.channel.queue_declare(
+            queue=retry_policy.parking_queue(queue), durable=True
+        )
+
+    def declare_shards(self, queue, sharding_policy) -> list:
+        """Declares the consistent-hash exchange and the queue of every shard.
+
+        The exchange hashes the media id header. When the number of shards
+        went down, the queues of the shards that no longer exist are unbound,
+        so they only need to be drained.
+
+        Returns:
+            The queues of the shards that no longer exist.
+        """
+        self.channel.exchange_declare(
+            exchange=sharding_policy.exchange,
+            exchange_type="x-consistent-hash",
+            durable=True,
+            arguments={"hash-header": MEDIA_ID_HEADER},
+        )
+        for shard in range(sharding_policy.count):
+            shard_queue = sharding_policy.shard_queue(queue, shard)
+            self.channel.queue_declare(
+                queue=shard_queue,
+                durable=True,
+                arguments={"x-single-active-consumer": True},
+            )
+            # For a consistent-hash exchange, the routing key is the weight.
+            self.channel.queue_bind(
+                shard_queue, sharding_policy.exchange, routing_key="1"
+            )
+
+        retired_queues = []
+        shard = sharding_policy.count
+        while True:
+            shard_queue = sharding_policy.shard_queue(queue, shard)
+            # A passive declare of a missing queue closes the channel.
+            probe = self.connection.channel()
+            try:
+                probe.queue_declare(queue=shard_queue, passive=True)
+            except pika.exceptions.ChannelClosedByBroker:
+                break
+            probe.queue_unbind(shard_queue, sharding_policy.exchange, routing_key="1")
+            probe.close()
+            self.log.warning(
+                f"Shard queue {shard_queue} is retired, it can be deleted once empty."
+            )
+            retired_queues.append(shard_queue)
+            shard += 1
+        return retired_queues
+
+    def pause(self):
+        """Stops consuming until `resume` is called, from any thread.
+
+        Messages that were already delivered are still handled.
+        """
+        self.call_threadsafe(self._pause)
+
+    def resume(self):
+        """Starts consuming again after `pause`, from any thread."""
+        self.call_threadsafe(self._resume)
+
+    def _pause(self):
+        if self.paused:
+            return
+        self.paused = True
+        self.log.warning("Pausing consumption.")
+        if self.consumer_channel is not None and self.consumer_channel.is_open:
+            for consumer_tag in self.consumer_tags:
+                self.consumer_channel.basic_cancel(consumer_tag)
+        self.consumer_tags = []
+
+    def _resume(self):
+        if not self.paused:
+            return
+        self.paused = False
+        self.log.info("Resuming consumption.")
+        if self.consumer_channel is not None and self.consumer_channel.is_open:
+            self._consume()
+
+    def _consume(self):
+        for queue in self.queues:
+            consumer_tag = self.consumer_channel.basic_consume(
+                queue=queue, on_message_callback=self.on_message_callback
+            )
+            self.consumer_tags.append(consumer_tag)
+            self.log.info(f"Consumer tag is: {consumer_tag}", queue=queue)
+
+    def listen(self, on_message_callback, queue=None):
+        """Consumes the queue, or a list of queues, until interrupted."""
 
         if queue is None:
             queue = self.rabbitConfig["queue"]
+        self.queues = [queue] if isinstance(queue, str) else queue
+        self.on_message_callback = on_message_callback
 
         try:
             while True:
@@ -60,12 +240,19 @@ class RabbitClient:
                     channel.basic_qos(
                         prefetch_count=self.prefetch_count, global_qos=False
                     )
-                    consumer_tag = channel.basic_consume(
-                        queue=queue, on_message_callback=on_message_callback
-                    )
-                    self.log.info(f"Consumer tag is: {consumer_tag}")
+                    self.consumer_channel = channel
+                    self.consumer_tags = []
+                    if not self.paused:
+                        self._consume()
 
-                    channel.start_consuming()
+                    while True:
+                        # Returns when all consumers are cancelled. When that
+                        # is a pause, keep handling timers and callbacks until
+                        # resumed.
+                        channel.start_consuming()
+                        if not self.paused:
+                            break
+                        self.connection.process_data_events(time_limit=1)
                 except pika.exceptions.StreamLostError:
                     self.log.warning("RMQBridge lost connection, reconnecting...")
                     time.sleep(3)
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  app/services/rate_limiter.py
+#
+
+import multiprocessing
+import threading
+import time
+from contextlib import contextmanager
+
+from requests.exceptions import RequestException
+
+
+def is_overload_error(error: Exception) -> bool:
+    """Checks if an error indicates that the backend needs relief.
+
+    That is a 429/5xx response or a failure to connect at all.
+    """
+    response = getattr(error, "response", None)
+    status_code = getattr(error, "status_code", None)
+    if status_code is None and response is not None:
+        status_code = response.status_code
+
+    if status_code is not None:
+        return status_code == 429 or status_code >= 500
+    return isinstance(error, RequestException)
+
+
+class AdaptiveRateLimiter:
+    """Token bucket of which the rate adapts to the health of the backend (AIMD).
+
+    Every call takes a token. The rate is increased additively after each
+    healthy call, and decreased multiplicatively when the backend is
+    overloaded or the latency of a call exceeds the threshold.
+
+    Args:
+        rate: The initial number of calls per second.
+        min_rate: The rate won't drop below this.
+        max_rate: The rate won't go above this.
+        latency_threshold: Calls slower than this (in seconds) are
+            considered a sign of an overloaded backend.
+        increase: The rate is increased by this after a healthy call.
+        decrease_factor: The rate is multiplied by this on overload.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        min_rate: float,
+        max_rate: float,
+        latency_threshold: float,
+        increase: float = 0.1,
+        decrease_factor: float = 0.5,
+    ):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.latency_threshold = latency_threshold
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+
+        # Allow a burst of one second worth of calls.
+        self.tokens = 1.0
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: dict):
+        return cls(
+            rate=float(config["rate"]),
+            min_rate=float(config["min_rate"]),
+            max_rate=float(config["max_rate"]),
+            latency_threshold=float(config["latency_threshold"]),
+        )
+
+    def acquire(self):
+        """Blocks until a call is allowed."""
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def on_success(self, latency: float):
+        with self.lock:
+            if latency > self.latency_threshold:
+                self._decrease()
+            else:
+                self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_overload(self):
+        with self.lock:
+            self._decrease()
+
+    @contextmanager
+    def limit(self):
+        """Waits for a token, then times the wrapped call to adapt the rate."""
+        self.acquire()
+        start = time.monotonic()
+        try:
+            yield
+        except Exception as error:
+            if is_overload_error(error):
+                self.on_overload()
+            raise
+        self.on_success(time.monotonic() - start)
+
+    def _decrease(self):
+        self._refill()
+        self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+
+    def _refill(self):
+        now = time.monotonic()
+        capacity = max(1.0, self.rate)
+        self.tokens = min(capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+
+class SharedRateLimiter(AdaptiveRateLimiter):
+    """AdaptiveRateLimiter of which the state is shared by multiple processes.
+
+    Create it before starting the processes and hand it to them, e.g. as an
+    argument of the initializer of a process pool.
+    """
+
+    def __init__(self, *args, context=multiprocessing, **kwargs):
+        self._rate = context.Value("d", 0.0, lock=False)
+        self._tokens = context.Value("d", 0.0, lock=False)
+        self._last_refill = context.Value("d", 0.0, lock=False)
+        super().__init__(*args, **kwargs)
+        self.lock = context.Lock()
+
+    @classmethod
+    def from_config(cls, config: dict, context=multiprocessing):
+        return cls(
+            rate=float(config["rate"]),
+            min_rate=float(config["min_rate"]),
+            max_rate=float(config["max_rate"]),
+            latency_threshold=float(config["latency_threshold"]),
+            context=context,
+        )
+
+    @property
+    def rate(self):
+        return self._rate.value
+
+    @rate.setter
+    def rate(self, value):
+        self._rate.value = value
+
+    @property
+    def tokens(self):
+        return self._tokens.value
+
+    @tokens.setter
+    def tokens(self, value):
+        self._tokens.value = value
+
+    @property
+    def last_refill(self):
+        return self._last_refill.value
+
+    @last_refill.setter
+    def last_refill(self, value):
+        self._last_refill.value = value
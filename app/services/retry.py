@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  app/services/retry.py
+#
+
+import random
+
+# Header with the number of times a message has been retried.
+RETRY_ATTEMPTS_HEADER = "x-retry-attempts"
+# Header with the routing key the message was originally published with, as
+# the routing key is lost when the message is dead-lettered back to the queue.
+ORIGINAL_ROUTING_KEY_HEADER = "x-original-routing-key"
+
+
+def get_routing_key(method, properties) -> str:
+    """Returns the original routing key of a (possibly retried) message."""
+    headers = (properties.headers if properties else None) or {}
+    return headers.get(ORIGINAL_ROUTING_KEY_HEADER, method.routing_key)
+
+
+def get_attempts(properties) -> int:
+    """Returns the number of times a message has been retried."""
+    headers = (properties.headers if properties else None) or {}
+    return int(headers.get(RETRY_ATTEMPTS_HEADER, 0))
+
+
+class RetryPolicy:
+    """Exponential backoff with jitter for retrying messages.
+
+    A message is retried by publishing it on a retry queue for its attempt,
+    with a per-message TTL. When it expires, the message is dead-lettered back
+    onto the work queue. Every attempt has its own retry queue so a message
+    never waits behind one with a longer delay. After `max_attempts` the
+    message is moved to the parking queue.
+
+    Args:
+        max_attempts: The number of retries before a message is parked.
+        base_delay: The delay (in seconds) before the first retry.
+        max_delay: The maximum delay (in seconds) between retries.
+        jitter: The fraction of the delay that is randomised.
+    """
+
+    def __init__(
+        self, max_attempts: int, base_delay: float, max_delay: float, jitter: float
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+    @classmethod
+    def from_config(cls, config: dict):
+        return cls(
+            max_attempts=int(config["max_attempts"]),
+            base_delay=float(config["base_delay"]),
+            max_delay=float(config["max_delay"]),
+            jitter=float(config["jitter"]),
+        )
+
+    def delay(self, attempt: int) -> float:
+        """Returns the delay in seconds before the given attempt."""
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return delay * random.uniform(1 - self.jitter, 1)
+
+    def should_park(self, attempt: int) -> bool:
+        return attempt > self.max_attempts
+
+    @staticmethod
+    def retry_queue(queue: str, attempt: int) -> str:
+        return f"{queue}.retry.{attempt}"
+
+    @staticmethod
+    def parking_queue(queue: str) -> str:
+        return f"{queue}.parking"
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  app/services/sharding.py
+#
+
+# Header with the media id of the event, on which the shard is chosen
+MEDIA_ID_HEADER = "x-media-id"
+
+ROLE_ROUTER = "router"
+ROLE_SHARD = "shard"
+
+
+class ShardingPolicy:
+    """Describes how the events are divided over shards.
+
+    A router consumes the queue and publishes every event to a
+    consistent-hash exchange, with its media id in a header. The exchange
+    feeds one queue per shard, so all events for a media id end up on the
+    same shard, in order. Each shard queue has a single active consumer.
+
+    Args:
+        role: "" to consume the queue without sharding, "router" or "shard".
+        exchange: The name of the consistent-hash exchange.
+        count: The number of shards.
+        shards: The shards to consume as a shard consumer, None for all.
+    """
+
+    def __init__(self, role: str, exchange: str, count: int, shards=None):
+        if role not in ("", ROLE_ROUTER, ROLE_SHARD):
+            raise ValueError(f"Unknown sharding role: {role}")
+        self.role = role
+        self.exchange = exchange
+        self.count = count
+        self.shards = shards
+
+    @classmethod
+    def from_config(cls, config: dict):
+        shards = str(config["shards"]).strip()
+        return cls(
+            role=config["role"] or "",
+            exchange=config["exchange"],
+            count=int(config["count"]),
+            shards=[int(shard) for shard in shards.split(",")] if shards else None,
+        )
+
+    def shard_queue(self, queue: str, shard: int) -> str:
+        return f"{queue}.shard.{shard}"
+
+    def assigned_shards(self) -> list:
+        """Returns the shards to consume, within the current shard count."""
+        if self.shards is None:
+            return list(range(self.count))
+        return [shard for shard in self.shards if 0 <= shard < self.count]
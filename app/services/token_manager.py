@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  app/services/token_manager.py
+#
+
+import threading
+import time
+
+from viaa.configuration import ConfigParser
+from viaa.observability import logging
+
+from app.services import metrics
+
+
+class TokenManager:
+    """Keeps the MediaHaven token of a grant valid for all workers.
+
+    The token is requested again on a background thread, `refresh_margin`
+    seconds before it expires, so no event has to wait for it. When a call
+    is rejected anyway, `refresh` requests a new token once for all callers
+    that saw the same token.
+
+    Args:
+        grant: The ROPC grant used by the MediaHaven client.
+        username: The user to request the token for.
+        password: The password of the user.
+        lifetime: The time in seconds a token is valid, if the token itself
+            doesn't say.
+        refresh_margin: The time in seconds before expiry to refresh.
+        retry_delay: The time in seconds to wait after a failed refresh.
+    """
+
+    def __init__(
+        self,
+        grant,
+        username: str,
+        password: str,
+        lifetime: float,
+        refresh_margin: float,
+        retry_delay: float,
+    ):
+        configParser = ConfigParser()
+        self.log = logging.get_logger(__name__, config=configParser)
+
+        self.grant = grant
+        self.username = username
+        self.password = password
+        self.lifetime = lifetime
+        self.refresh_margin = refresh_margin
+        self.retry_delay = retry_delay
+
+        # Incremented with every new token
+        self.generation = 0
+        self.expires_at = None
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    @classmethod
+    def from_config(cls, grant, config: dict):
+        token_config = config["token"]
+        return cls(
+            grant,
+            username=config["username"],
+            password=config["password"],
+            lifetime=float(token_config["lifetime"]),
+            refresh_margin=float(token_config["refresh_margin"]),
+            retry_delay=float(token_config["retry_delay"]),
+        )
+
+    def start(self):
+        """Requests the first token and starts refreshing it in the background.
+
+        Raises:
+            RequestTokenError: If the first token can't be requested.
+        """
+        with self.lock:
+            self._request_token()
+        self.thread = threading.Thread(
+            target=self._run, name="token-manager", daemon=True
+        )
+        self.thread.start()
+
+    def refresh(self, generation: int):
+        """Requests a new token, unless it changed since `generation`.
+
+        Callers pass the generation they read before the call that was
+        rejected, so a burst of rejections only requests one new token.
+        """
+        with self.lock:
+            if generation == self.generation:
+                self._request_token()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join(timeout=self.retry_delay)
+
+    @metrics.timed("refresh_token")
+    def _request_token(self):
+        try:
+            token = self.grant.request_token(self.username, self.password)
+        except Exception:
+            metrics.TOKEN_REFRESH_FAILURES.inc()
+            raise
+        if not isinstance(token, dict):
+            # The grant keeps the token in its OAuth2 session
+            token = getattr(getattr(self.grant, "session", None), "token", None)
+        self.generation += 1
+        self.expires_at = time.monotonic() + self._lifetime_of(token)
+
+    def _lifetime_of(self, token) -> float:
+        """Returns the time in seconds until the token expires.
+
+        The configured lifetime is used if the token has no expiry.
+        """
+        if isinstance(token, dict):
+            if token.get("expires_at") is not None:
+                return float(token["expires_at"]) - time.time()
+            if token.get("expires_in") is not None:
+                return float(token["expires_in"])
+        return self.lifetime
+
+    def _run(self):
+        delay = self._time_to_refresh()
+        while not self.stopped.wait(delay):
+            generation = self.generation
+            try:
+                self.refresh(generation)
+            except Exception as error:
+                # The current token might still be valid for a while
+                self.log.warning("Failed to refresh the MediaHaven token.", error=error)
+                delay = self.retry_delay
+                continue
+            delay = self._time_to_refresh()
+
+    def _time_to_refresh(self) -> float:
+        return max(0.0, self.expires_at - self.refresh_margin - time.monotonic())
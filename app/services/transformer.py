@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  app/services/transformer.py
+#
+
+import requests
+from lxml import etree
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from viaa.configuration import ConfigParser
+from viaa.observability import logging
+
+from app.helpers.xml_helper import canonicalize
+from app.services import metrics
+
+
+class TransformerClient:
+    """Client for the mtd-transformer.
+
+    Connections are kept alive and pooled in a session, so they can be reused
+    by all workers. Requests are retried when no connection can be set up.
+    Read errors and timeouts aren't retried, a slow mtd-transformer is left to
+    the circuit breaker.
+
+    Args:
+        host: The URL of the mtd-transformer.
+        transformation: The name of the transformation to apply.
+        pool_size: The maximum number of connections to keep alive.
+        connect_timeout: Timeout for setting up a connection, in seconds.
+        read_timeout: Timeout for waiting on the response, in seconds.
+        retries: The number of retries on connection errors.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        transformation: str,
+        pool_size: int,
+        connect_timeout: float,
+        read_timeout: float,
+        retries: int,
+    ):
+        self.url = f"{host}/transform/?transformation={transformation}"
+        self.timeout = (connect_timeout, read_timeout)
+
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=0,
+            status=0,
+            allowed_methods=frozenset({"POST"}),
+            backoff_factor=0.1,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size, max_retries=retry
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    @classmethod
+    def from_config(cls, config: dict, pool_size: int):
+        return cls(
+            host=config["host"],
+            transformation=config["transformation"],
+            pool_size=pool_size,
+            connect_timeout=float(config["connect_timeout"]),
+            read_timeout=float(config["read_timeout"]),
+            retries=int(config["retries"]),
+        )
+
+    def transform(self, metadata) -> str:
+        """Transforms the metadata.
+
+        Returns:
+            The transformed metadata.
+
+        Raises:
+            HTTPError: If the mtd-transformer returned an error.
+            RequestException: If the mtd-transformer couldn't be reached.
+        """
+        response = self.session.post(
+            self.url,
+            data=metadata,
+            headers={"Content-Type": "application/xml"},
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        return response.text
+
+    def close(self):
+        self.session.close()
+
+
+class XsltTransformer:
+    """Applies the transformation in-process, with an XSLT compiled once.
+
+    If the transformation fails, the fallback transformer is used.
+
+    Args:
+        xslt_path: The path to the XSLT of the transformation.
+        fallback: The transformer to use when the XSLT fails.
+    """
+
+    def __init__(self, xslt_path: str, fallback=None):
+        configParser = ConfigParser()
+        self.log = logging.get_logger(__name__, config=configParser)
+        self.xslt = etree.XSLT(etree.parse(xslt_path))
+        self.fallback = fallback
+
+    def transform(self, metadata) -> str:
+        try:
+            return self.apply(metadata)
+        except (etree.XSLTError, etree.XMLSyntaxError) as error:
+            if self.fallback is None:
+                raise
+            self.log.warning(
+                "Local transformation failed, using the fallback.", error=error
+            )
+            return self.fallback.transform(metadata)
+
+    def apply(self, metadata) -> str:
+        if isinstance(metadata, str):
+            metadata = metadata.encode("utf-8")
+        return str(self.xslt(etree.fromstring(metadata)))
+
+
+class ParityTransformer:
+    """Transforms with the remote transformer, and checks that the local
+    transformer gives the same result.
+
+    Matches and mismatches are counted, mismatches are logged. The result of
+    the remote transformer is always used.
+    """
+
+    def __init__(self, local: XsltTransformer, remote: TransformerClient):
+        configParser = ConfigParser()
+        self.log = logging.get_logger(__name__, config=configParser)
+        self.local = local
+        self.remote = remote
+
+    def transform(self, metadata) -> str:
+        remote_result = self.remote.transform(metadata)
+
+        try:
+            local_result = self.local.apply(metadata)
+            match = canonicalize(local_result) == canonicalize(remote_result)
+        except (etree.XSLTError, etree.XMLSyntaxError) as error:
+            self.log.warning("Local transformation failed.", error=error)
+            match = False
+
+        metrics.TRANSFORM_PARITY.labels(result="match" if match else "mismatch").inc()
+        if not match:
+            self.log.warning("Local and remote transformation differ.")
+
+        return remote_result
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  app/services/versions.py
+#
+
+import threading
+from datetime import datetime
+
+from app.services.media_id_store import MediaIdStore
+
+
+class VersionStore:
+    """Remembers the timestamp of the newest event applied per media id.
+
+    This is used to skip events that are older than the metadata that was
+    already applied, e.g. a retried event that was overtaken by a newer one.
+    Events without a (parsable) timestamp are never considered stale.
+    """
+
+    def __init__(self, store: MediaIdStore):
+        self.store = store
+        self.lock = threading.Lock()
+
+    def _is_older(self, media_id: str, timestamp: datetime) -> bool:
+        applied = self.store.get(media_id)
+        if timestamp is None or applied is None:
+            return False
+        try:
+            return timestamp < datetime.fromisoformat(applied)
+        except TypeError:
+            # One of them has no timezone
+            return False
+
+    def is_stale(self, event) -> bool:
+        """Checks if a newer event was already applied."""
+        return self._is_older(event.metadata.media_id, event.parsed_timestamp)
+
+    def record(self, event):
+        """Records the event as applied, unless a newer one already was."""
+        timestamp = event.parsed_timestamp
+        if timestamp is None:
+            return
+        with self.lock:
+            if not self._is_older(event.metadata.media_id, timestamp):
+                self.store.put(event.metadata.media_id, timestamp.isoformat())
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  app/services/worker_pool.py
+#
+
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from viaa.configuration import ConfigParser
+from viaa.observability import logging
+
+
+class WorkerPool:
+    """Runs message handlers concurrently on a fixed number of worker threads.
+
+    Every worker has its own FIFO queue. Work is assigned to a worker based on
+    a key (the media id), so all work for the same key is handled by the same
+    worker, in the order it was submitted.
+    """
+
+    def __init__(self, worker_count: int):
+        configParser = ConfigParser()
+        self.log = logging.get_logger(__name__, config=configParser)
+
+        if worker_count < 1:
+            raise ValueError("A worker pool needs at least one worker.")
+
+        self.worker_count = worker_count
+        self.workers = [
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"worker-{index}")
+            for index in range(worker_count)
+        ]
+
+    def worker_for(self, key: str) -> int:
+        """Returns the index of the worker responsible for the given key.
+
+        A stable hash is used so the assignment doesn't change between runs.
+        """
+        return zlib.crc32(key.encode("utf-8")) % self.worker_count
+
+    def submit(self, key: str, fn, *args, **kwargs):
+        """Schedules `fn(*args, **kwargs)` on the worker responsible for `key`."""
+        future = self.workers[self.worker_for(key)].submit(fn, *args, **kwargs)
+        future.add_done_callback(self._log_unhandled_exception)
+        return future
+
+    def shutdown(self, wait: bool = True):
+        for worker in self.workers:
+            worker.shutdown(wait=wait)
+
+    def _log_unhandled_exception(self, future):
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            self.log.error("Unhandled exception in worker.", error=error)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  benchmarks/bench_parser.py
+#
+#  Measures the time and memory use of parsing, extracting and validating
+#  each event of the synthetic corpus.
+#
+#  Run from the root of the repository:
+#
+#      python -m benchmarks.bench_parser --repeat 20
+#
+
+import argparse
+import gc
+import json
+import statistics
+import time
+import tracemalloc
+from collections import defaultdict
+
+from app.helpers.events_parser import EventParser
+from benchmarks.corpus import generate_corpus
+
+DIMENSIONS = ["event_type", "padding", "extra_formats", "resolutions", "ot_types"]
+
+
+def _time(fn, repeat: int) -> float:
+    """Returns the median duration of a call, in seconds."""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations)
+
+
+def _memory(fn):
+    """Returns the peak and the retained memory of a call, in bytes.
+
+    The peak includes the garbage the call creates along the way. The retained
+    memory is what is still allocated after the call returned, e.g. caches.
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        gc.collect()
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak, retained
+
+
+def measure(parser: EventParser, params: dict, xml: bytes, repeat: int) -> dict:
+    event_type = params["event_type"]
+    event = parser.get_event(event_type, xml)
+
+    parse = _time(lambda: parser._parse_event(event_type, xml), repeat)
+    total = _time(lambda: parser.get_event(event_type, xml), repeat)
+    validate = _time(event.metadata._validate_metadata, repeat)
+    peak, retained = _memory(lambda: parser.get_event(event_type, xml))
+
+    return dict(
+        params,
+        size=len(xml),
+        parse_us=parse * 1e6,
+        # Extracting includes building the Event
+        extract_us=max(0.0, total - parse - validate) * 1e6,
+        validate_us=validate * 1e6,
+        total_us=total * 1e6,
+        peak_kb=peak / 1024,
+        retained_kb=retained / 1024,
+    )
+
+
+def summarize(results: list):
+    """Prints the mean per value of each dimension."""
+    columns = [
+        "parse_us",
+        "extract_us",
+        "validate_us",
+        "total_us",
+        "peak_kb",
+        "retained_kb",
+    ]
+    print(f"{'dimension':<14} {'value':<20}" + "".join(f"{c:>12}" for c in columns))
+    for dimension in DIMENSIONS:
+        groups = defaultdict(list)
+        for result in results:
+            groups[str(result[dimension])].append(result)
+        for value, group in groups.items():
+            means = [statistics.fmean(r[c] for r in group) for c in columns]
+            print(
+                f"{dimension:<14} {value:<20}" + "".join(f"{m:>12.1f}" for m in means)
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the event parser on a synthetic corpus."
+    )
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--json", help="Also write the results per event to this file.")
+    args = parser.parse_args()
+
+    event_parser = EventParser()
+    results = [
+        measure(event_parser, params, xml, args.repeat)
+        for params, xml in generate_corpus()
+    ]
+    summarize(results)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  benchmarks/bench_throughput.py
+#
+#  Runs the EventListener pipeline against local stand-ins and reports the
+#  throughput, latency and memory use for a range of settings.
+#
+#  Run from the root of the repository:
+#
+#      python -m benchmarks.bench_throughput --workers 1,4,16 --prefetch 1,16,64
+#
+
+import argparse
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import socket
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.fakes import Behaviour, FakePublisher, InMemoryBroker, serve_stubs
+
+RESOURCES = os.path.join(os.path.dirname(__file__), "..", "tests", "resources")
+# Environment variables used in config.yml
+ENVIRONMENT = [
+    "MEDIAHAVEN_USERNAME",
+    "MEDIAHAVEN_PASSWORD",
+    "MEDIAHAVEN_CLIENT_ID",
+    "MEDIAHAVEN_CLIENT_SECRET",
+    "RABBITMQ_HOST",
+    "RABBITMQ_USERNAME",
+    "RABBITMQ_PASSWORD",
+    "RABBITMQ_QUEUE",
+    "RABBITMQ_EXCHANGE",
+    "RABBITMQ_GET_SUBTITLES_ROUTING_KEY",
+    "FTP_HOST",
+    "FTP_USER",
+    "FTP_PASSWORD",
+]
+
+
+def make_messages(events: int, media_ids: int) -> list:
+    """Returns the messages to deliver, cycling through `media_ids` media ids."""
+    with open(os.path.join(RESOURCES, "getMetadataResponse.xml"), "rb") as f:
+        template = f.read()
+    return [
+        (
+            "vrt.getMetadataResponse",
+            template.replace(b">TEST_ID<", f">BENCH_{i % media_ids}<".encode()),
+        )
+        for i in range(events)
+    ]
+
+
+def percentile(values: list, fraction: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def run_once(settings: dict) -> dict:
+    """Runs the pipeline once, in a fresh process, and returns the results."""
+    stub_url = f"http://127.0.0.1:{settings['port']}"
+    for name in ENVIRONMENT:
+        os.environ.setdefault(name, "benchmark")
+    os.environ.update(
+        {
+            "MEDIAHAVEN_HOST": stub_url,
+            "MTD_TRANSFORMER": stub_url,
+            "RABBITMQ_PREFETCH_COUNT": str(settings["prefetch"]),
+            "SHARDING_ROLE": "",
+            "SHARDING_SHARDS": "",
+        }
+    )
+    logging.disable(getattr(logging, settings["log_level"]) - 1)
+
+    from app.app import EventListener
+    from app.services.sharding import ShardingPolicy
+    from app.services.worker_pool import WorkerPool
+
+    class BenchmarkEventListener(EventListener):
+        """The EventListener, with the broker replaced by the stand-ins."""
+
+        def _init_pipeline(self, worker_count: int):
+            # The limit of production would hide the throughput of the pipeline.
+            self.config["mediahaven"]["rate_limit"]["rate"] = settings["mh_rate"]
+            self.config["mediahaven"]["rate_limit"]["max_rate"] = settings["mh_rate"]
+            self.config["metrics"]["port"] = 0
+            super()._init_pipeline(settings["workers"])
+
+        def _init_broker(self, worker_count: int):
+            workers = settings["workers"]
+            self.worker_pool = WorkerPool(workers) if workers > 1 else None
+            self.rabbit_client = broker
+            self.publisher = FakePublisher()
+            self.coalescer = None
+            self.batcher = None
+            self.sharding_policy = ShardingPolicy("", "", 0)
+            self.retired_shard_queues = []
+
+    broker = InMemoryBroker(
+        make_messages(settings["events"], settings["media_ids"]), settings["prefetch"]
+    )
+    event_listener = BenchmarkEventListener()
+
+    start = time.perf_counter()
+    event_listener.start()
+    elapsed = time.perf_counter() - start
+
+    return {
+        "workers": settings["workers"],
+        "prefetch": settings["prefetch"],
+        "events": settings["events"],
+        "acked": broker.acked,
+        "nacked": broker.nacked,
+        "retried": event_listener.publisher.retried,
+        "events_per_second": settings["events"] / elapsed,
+        "p50_ms": percentile(broker.latencies, 0.5) * 1000,
+        "p99_ms": percentile(broker.latencies, 0.99) * 1000,
+        "mean_ms": statistics.fmean(broker.latencies or [0]) * 1000,
+        # In kilobytes on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the pipeline against local stand-ins."
+    )
+    parser.add_argument("--events", type=int, default=1000)
+    parser.add_argument(
+        "--media-ids",
+        type=int,
+        default=None,
+        help="Number of distinct media ids, defaults to one per event.",
+    )
+    parser.add_argument("--workers", default="1,4,16")
+    parser.add_argument("--prefetch", default="1,16,64")
+    parser.add_argument("--mh-latency", type=float, default=0.02)
+    parser.add_argument("--mh-error-rate", type=float, default=0.0)
+    parser.add_argument("--mh-rate", type=float, default=10000)
+    parser.add_argument("--transformer-latency", type=float, default=0.01)
+    parser.add_argument("--transformer-error-rate", type=float, default=0.0)
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--json", help="Also write the results to this file.")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    port = free_port()
+    context = multiprocessing.get_context("spawn")
+
+    ready = context.Event()
+    stubs = context.Process(
+        target=serve_stubs,
+        args=(
+            port,
+            Behaviour(args.mh_latency, error_rate=args.mh_error_rate),
+            Behaviour(args.transformer_latency, error_rate=args.transformer_error_rate),
+            ready,
+        ),
+        daemon=True,
+    )
+    stubs.start()
+    ready.wait()
+
+    results = []
+    print(
+        f"{'workers':>7} {'prefetch':>8} {'events/s':>9} {'p50 ms':>8} "
+        f"{'p99 ms':>8} {'rss MB':>7} {'nacked':>6} {'retried':>7}"
+    )
+    try:
+        for workers, prefetch in itertools.product(
+            [int(n) for n in args.workers.split(",")],
+            [int(n) for n in args.prefetch.split(",")],
+        ):
+            settings = {
+                "port": port,
+                "workers": workers,
+                "prefetch": prefetch,
+                "events": args.events,
+                "media_ids": args.media_ids or args.events,
+                "mh_rate": args.mh_rate,
+                "log_level": args.log_level,
+            }
+            # A fresh process per run, so the peak RSS is of that run only.
+            with ProcessPoolExecutor(1, mp_context=context) as executor:
+                result = executor.submit(run_once, settings).result()
+            results.append(result)
+            print(
+                f"{workers:>7} {prefetch:>8} {result['events_per_second']:>9.1f} "
+                f"{result['p50_ms']:>8.1f} {result['p99_ms']:>8.1f} "
+                f"{result['peak_rss_mb']:>7.1f} {result['nacked']:>6} "
+                f"{result['retried']:>7}"
+            )
+    finally:
+        stubs.terminate()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"arguments": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  benchmarks/corpus.py
+#
+#  Generates a synthetic corpus of VRT events from the test fixtures.
+#
+#  To write the corpus to a folder:
+#
+#      python -m benchmarks.corpus --out corpus/
+#
+
+import argparse
+import copy
+import itertools
+import json
+import os
+
+from lxml import etree
+
+from app.helpers.events_parser import NAMESPACES
+
+RESOURCES = os.path.join(os.path.dirname(__file__), "..", "tests", "resources")
+FIXTURES = {
+    "getMetadataResponse": "getMetadataResponse.xml",
+    "metadataUpdatedEvent": "metadataUpdatedEvent.xml",
+}
+PADDING_TEXT = "Lorem ipsum dolor sit amet, consectetur adipiscing elit. "
+
+# The dimensions of the default corpus
+EVENT_TYPES = list(FIXTURES)
+PADDINGS = [0, 16 * 1024, 256 * 1024]
+EXTRA_FORMATS = [0, 8, 64]
+RESOLUTIONS = [("hires", "lores"), ("hires",), ("lores",)]
+OT_TYPES = [(), ("open",), ("open", "closed")]
+
+
+def _load_fixture(event_type: str):
+    return etree.parse(os.path.join(RESOURCES, FIXTURES[event_type])).getroot()
+
+
+def _find(element, path: str):
+    return element.find(path, namespaces=NAMESPACES)
+
+
+def generate_event(
+    event_type: str,
+    media_id: str,
+    padding: int = 0,
+    extra_formats: int = 0,
+    resolutions=("hires", "lores"),
+    ot_types=(),
+) -> bytes:
+    """Generates a valid VRT event.
+
+    Args:
+        event_type: "getMetadataResponse" or "metadataUpdatedEvent".
+        media_id: The media id of the event.
+        padding: The number of bytes of text to add to the long description.
+        extra_formats: The number of non-current ebu:format blocks to add.
+        resolutions: The resolutions of the current video formats.
+        ot_types: The OT identifiers to add, "open" and/or "closed".
+
+    Returns:
+        The event as XML.
+    """
+    root = _load_fixture(event_type)
+    metadata = _find(root, "vrt:metadata")
+
+    media_id_element = _find(
+        metadata, "ebu:identifier[@typeDefinition='MEDIA_ID']/dc:identifier"
+    )
+    media_id_element.text = media_id
+    if event_type == "metadataUpdatedEvent":
+        _find(root, "vrt:mediaId").text = media_id
+
+    if padding:
+        description = _find(
+            metadata, "ebu:description[@typeDefinition='long']/dc:description"
+        )
+        repeats = padding // len(PADDING_TEXT) + 1
+        description.text = (description.text or "") + (PADDING_TEXT * repeats)[:padding]
+
+    formats = metadata.findall("ebu:format[@formatDefinition='current']", NAMESPACES)
+    for ebu_format in formats:
+        video_format = _find(ebu_format, "ebu:videoFormat")
+        if video_format.get("videoFormatDefinition") not in resolutions:
+            metadata.remove(ebu_format)
+    kept_format = next(f for f in formats if f.getparent() is not None)
+
+    for _ in range(extra_formats):
+        extra_format = copy.deepcopy(kept_format)
+        extra_format.set("formatDefinition", "previous")
+        kept_format.addprevious(extra_format)
+
+    for ot_type in ot_types:
+        identifier = etree.SubElement(
+            metadata,
+            f"{{{NAMESPACES['ebu']}}}identifier",
+            typeDefinition=f"otId{ot_type.capitalize()}",
+        )
+        etree.SubElement(identifier, f"{{{NAMESPACES['dc']}}}identifier").text = (
+            f"OT_{ot_type}_{media_id}"
+        )
+
+    return etree.tostring(root, xml_declaration=True, encoding="UTF-8")
+
+
+def generate_corpus():
+    """Generates an event for every combination of the dimensions.
+
+    Yields:
+        The parameters and the XML of each event.
+    """
+    combinations = itertools.product(
+        EVENT_TYPES, PADDINGS, EXTRA_FORMATS, RESOLUTIONS, OT_TYPES
+    )
+    for index, combination in enumerate(combinations):
+        event_type, padding, extra_formats, resolutions, ot_types = combination
+        params = {
+            "event_type": event_type,
+            "media_id": f"CORPUS_{index}",
+            "padding": padding,
+            "extra_formats": extra_formats,
+            "resolutions": resolutions,
+            "ot_types": ot_types,
+        }
+        yield params, generate_event(**params)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generates a corpus of VRT events.")
+    parser.add_argument("--out", required=True, help="The folder to write to.")
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    index = []
+    for params, xml in generate_corpus():
+        filename = f"{params['media_id']}.xml"
+        with open(os.path.join(args.out, filename), "wb") as f:
+            f.write(xml)
+        index.append(dict(params, filename=filename, size=len(xml)))
+    with open(os.path.join(args.out, "index.json"), "w") as f:
+        json.dump(index, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  benchmarks/fakes.py
+#
+#  Local stand-ins for RabbitMQ, MediaHaven and the mtd-transformer.
+#
+
+import heapq
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from queue import Empty, SimpleQueue
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import pika
+
+TRANSFORMED_METADATA = b'<?xml version="1.0" encoding="UTF-8"?><mhs:Sidecar xmlns:mhs="https://zeticon.mediahaven.com/metadata/20.1/mhs/" version="20.1"/>'
+
+
+class Behaviour:
+    """Latency and error rate of a stubbed service.
+
+    Args:
+        latency: The mean response time, in seconds.
+        jitter: The fraction of the latency that is randomised.
+        error_rate: The fraction of the requests that get a 503.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.2, error_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+
+    def apply(self) -> bool:
+        """Waits for the latency.
+
+        Returns:
+            Whether the request should fail.
+        """
+        if self.latency:
+            time.sleep(self.latency * random.uniform(1 - self.jitter, 1 + self.jitter))
+        return random.random() < self.error_rate
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Serves the MediaHaven records API and the mtd-transformer.
+
+    - GET .../records: a search result with one fragment.
+    - POST .../records/<id>: a metadata update.
+    - POST /transform/: a transformation.
+    - Any other POST: a token of the OAuth2 grant.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.server.mediahaven.apply():
+            self._respond(503)
+            return
+        self._respond(200, self.server.search_result, "application/json")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        path = urlparse(self.path).path
+
+        if path.startswith("/transform"):
+            if self.server.transformer.apply():
+                self._respond(503)
+                return
+            self._respond(200, TRANSFORMED_METADATA, "application/xml")
+        elif "/records/" in path:
+            if self.server.mediahaven.apply():
+                self._respond(503)
+                return
+            self._respond(204)
+        else:
+            token = {
+                "access_token": "benchmark",
+                "refresh_token": "benchmark",
+                "token_type": "Bearer",
+                "expires_in": 3600,
+            }
+            self._respond(200, json.dumps(token).encode(), "application/json")
+
+    # PUT is used for updates by some versions of the MediaHaven client.
+    do_PUT = do_POST
+
+    def _respond(self, status: int, body: bytes = b"", content_type=None):
+        self.send_response(status)
+        if content_type:
+            self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_stubs(port: int, mediahaven: Behaviour, transformer: Behaviour, ready):
+    """Runs the MediaHaven and mtd-transformer stubs until the process ends.
+
+    Meant to run in its own process, so the stubs don't compete with the
+    service for the GIL.
+    """
+    resources = os.path.join(
+        os.path.dirname(__file__),
+        "..",
+        "tests",
+        "resources",
+        "mediahaven_response.json",
+    )
+    with open(resources) as f:
+        fragment = json.load(f)[0]
+    search_result = {
+        "TotalNrOfResults": 1,
+        "StartIndex": 0,
+        "NrOfResults": 1,
+        "Results": [fragment],
+    }
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    server.daemon_threads = True
+    server.mediahaven = mediahaven
+    server.transformer = transformer
+    server.search_result = json.dumps(search_result).encode()
+    ready.set()
+    server.serve_forever()
+
+
+class InMemoryBroker:
+    """In-memory stand-in for the RabbitClient and its channel.
+
+    Delivers the messages one by one, with at most `prefetch_count` unacked
+    messages, like a RabbitMQ consumer. Callbacks from other threads are run on
+    the thread that listens, like pika's `add_callback_threadsafe`.
+
+    Args:
+        messages: The (routing key, body) of the messages to deliver.
+        prefetch_count: The maximum number of unacked messages.
+    """
+
+    def __init__(self, messages, prefetch_count: int):
+        self.messages = deque(messages)
+        self.prefetch_count = prefetch_count
+        self.callbacks = SimpleQueue()
+        self.timers = []
+        self.connection_thread = None
+        self.is_open = True
+        self.paused = False
+
+        self.delivery_tag = 0
+        self.unacked = {}
+        self.latencies = []
+        self.acked = 0
+        self.nacked = 0
+
+    # RabbitClient
+    def call_threadsafe(self, callback):
+        if threading.get_ident() == self.connection_thread:
+            callback()
+        else:
+            self.callbacks.put(callback)
+
+    def call_later(self, delay, callback):
+        heapq.heappush(self.timers, (time.monotonic() + delay, id(callback), callback))
+
+    def pause(self):
+        self.call_threadsafe(lambda: setattr(self, "paused", True))
+
+    def resume(self):
+        self.call_threadsafe(lambda: setattr(self, "paused", False))
+
+    def declare_retry_queues(self, queue, retry_policy):
+        pass
+
+    def listen(self, on_message_callback, queue=None):
+        self.connection_thread = threading.get_ident()
+        while self.messages or self.unacked or self.timers:
+            while (
+                not self.paused
+                and self.messages
+                and len(self.unacked) < self.prefetch_count
+            ):
+                self._deliver(on_message_callback)
+            self._run_timers()
+
+            timeout = 0.1
+            if self.timers:
+                timeout = max(0, min(timeout, self.timers[0][0] - time.monotonic()))
+            try:
+                self.callbacks.get(timeout=timeout)()
+            except Empty:
+                pass
+
+    # Channel
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self.acked += self._settle(delivery_tag, multiple)
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        self.nacked += self._settle(delivery_tag, multiple)
+
+    def _deliver(self, on_message_callback):
+        routing_key, body = self.messages.popleft()
+        self.delivery_tag += 1
+        self.unacked[self.delivery_tag] = time.perf_counter()
+        on_message_callback(
+            self,
+            pika.spec.Basic.Deliver(
+                delivery_tag=self.delivery_tag, routing_key=routing_key
+            ),
+            pika.BasicProperties(headers={}, content_type="application/xml"),
+            body,
+        )
+
+    def _settle(self, delivery_tag, multiple) -> int:
+        if multiple:
+            delivery_tags = [tag for tag in self.unacked if tag <= delivery_tag]
+        else:
+            delivery_tags = [delivery_tag]
+        now = time.perf_counter()
+        for tag in delivery_tags:
+            self.latencies.append(now - self.unacked.pop(tag))
+        return len(delivery_tags)
+
+    def _run_timers(self):
+        while self.timers and self.timers[0][0] <= time.monotonic():
+            heapq.heappop(self.timers)[2]()
+
+
+class FakePublisher:
+    """Stand-in for the ConfirmingPublisher, confirms every message at once.
+
+    Retried messages are counted, but not delivered again.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.published = 0
+        self.retried = 0
+
+    def publish_batch(
+        self, exchange: str, routing_key: str, bodies: list, headers: list = None
+    ):
+        with self.lock:
+            self.published += len(bodies)
+
+    def publish(self, exchange: str, routing_key: str, body, properties):
+        with self.lock:
+            self.retried += 1
+
+    def close(self):
+        pass
@@ -19,3 +19,5 @@ def env_setup(monkeypatch):
     monkeypatch.setenv("RABBITMQ_GET_SUBTITLES_ROUTING_KEY", "routingkey")
     monkeypatch.setenv("RABBITMQ_PREFETCH_COUNT", "1")
     monkeypatch.setenv("MTD_TRANSFORMER", "url")
+    monkeypatch.setenv("SHARDING_ROLE", "")
+    monkeypatch.setenv("SHARDING_SHARDS", "")
@@ -0,0 +1,8 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from app.async_app import AsyncEventListener
+
+if __name__ == "__main__":
+    event_listener = AsyncEventListener()
+    event_listener.start()
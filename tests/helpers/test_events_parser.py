@@ -1,5 +1,6 @@
 import pytest
-from app.helpers.events_parser import EventParser
+from concurrent.futures import ThreadPoolExecutor
+from app.helpers.events_parser import EBU_FORMAT, NAMESPACES, EventParser
 from app.models.exceptions import InvalidEventException
 
 
@@ -57,7 +58,7 @@ INVALID_TIMECODES = [
     "Ik heb zin in een zin, maar heeft deze zin wel zin?",
 ]
 
-CALCULATE_RESOLUTION_XPATH_EVENTS = [
+CALCULATE_RESOLUTION_EVENTS = [
     ("getMetadataResponse", "hires"),
     ("getMetadataResponseHiresMissing", "lores"),
 ]
@@ -88,7 +89,9 @@ def test_parse_failed_get_metadata_response(event):
     event_parser = EventParser()
 
     # ACT/ASSERT
-    with pytest.raises(InvalidEventException, match=r"^getMetadataResponse status wasn't 'SUCCES': .*$"):
+    with pytest.raises(
+        InvalidEventException, match=r"^getMetadataResponse status wasn't 'SUCCES': .*$"
+    ):
         event = event_parser.get_event("getMetadataResponse", xml)
 
 
@@ -107,6 +110,20 @@ def test_parse_metadata_updated_event():
     assert event.metadata.raw is not None
 
 
+def test_parsed_event_is_compact():
+    # ARRANGE
+    xml = resources.load_xml_resource("getMetadataResponse")
+    event_parser = EventParser()
+
+    # ACT
+    event = event_parser.get_event("getMetadataResponse", xml)
+
+    # ASSERT
+    assert isinstance(event.metadata.raw, bytes)
+    assert not hasattr(event, "__dict__")
+    assert not hasattr(event.metadata, "__dict__")
+
+
 def test_parse_get_metadata_response_with_subtitles():
     # ARRANGE
     xml = resources.load_xml_resource("getMetadataResponseWithSubtitles")
@@ -183,17 +200,131 @@ def test_invalid_timecode_to_frames(timecode):
         event.metadata._VideoMetadata__timecode_to_frames(timecode[0], timecode[1])
 
 
-@pytest.mark.parametrize("event, res", CALCULATE_RESOLUTION_XPATH_EVENTS)
-def test_parse_calculate_resolution_xpath(event, res):
+@pytest.mark.parametrize("event, res", CALCULATE_RESOLUTION_EVENTS)
+def test_parse_get_resolution_formats(event, res):
     # ARRANGE
     xml = resources.load_xml_resource(event)
     event_parser = EventParser()
 
     # ACT
-    event_parser.event = event_parser._parse_event("getMetadataResponse", xml)
-    resolution = event_parser._calculate_resolution_xpath()
+    root = event_parser._parse_event("getMetadataResponse", xml)
+    elements = event_parser._collect_elements(root)
+    current_formats = event_parser._get_current_formats(elements[EBU_FORMAT])
+    resolution_formats = event_parser._get_resolution_formats(current_formats)
 
     # ASSERT
-    assert resolution == (
-        f"//ebu:format[@formatDefinition='current'][./ebu:videoFormat[@videoFormatDefinition='{res}']]"
-    )
+    assert resolution_formats
+    for resolution_format in resolution_formats:
+        assert resolution_format.get("formatDefinition") == "current"
+        assert resolution_format.xpath(
+            "./ebu:videoFormat/@videoFormatDefinition", namespaces=NAMESPACES
+        ) == [res]
+
+
+def test_get_event_does_not_keep_state():
+    # ARRANGE
+    xml = resources.load_xml_resource("getMetadataResponse")
+    event_parser = EventParser()
+    state = dict(vars(event_parser))
+
+    # ACT
+    event_parser.get_event("getMetadataResponse", xml)
+
+    # ASSERT
+    assert vars(event_parser) == state
+
+
+def test_get_event_from_multiple_threads():
+    # ARRANGE
+    event_parser = EventParser()
+    xmls = [
+        ("getMetadataResponse", resources.load_xml_resource("getMetadataResponse")),
+        ("metadataUpdatedEvent", resources.load_xml_resource("metadataUpdatedEvent")),
+    ] * 100
+
+    # ACT
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        events = list(executor.map(lambda args: event_parser.get_event(*args), xmls))
+
+    # ASSERT
+    for (event_type, _), event in zip(xmls, events):
+        assert event.event_type == event_type
+        if event_type == "getMetadataResponse":
+            assert event.metadata.media_id == "TEST_ID"
+        else:
+            assert event.metadata.media_id == "TESTJEVANRUDOLF"
+
+
+def test_sniff_rejects_failed_status_before_parsing():
+    # ARRANGE
+    xml = resources.load_xml_resource("getMetadataResponseFailedMinimal")
+    # Only a full parse would notice that the rest isn't valid XML
+    xml = xml.replace(b"</viaa:getMetadataResponse>", b"<viaa:metadata><broken>")
+    event_parser = EventParser()
+
+    # ACT/ASSERT
+    with pytest.raises(
+        InvalidEventException,
+        match=r"^getMetadataResponse status wasn't 'SUCCES': FAILED$",
+    ):
+        event_parser.get_event("getMetadataResponse", xml)
+
+
+def test_sniff_rejects_unknown_event_type():
+    # ARRANGE
+    xml = b'<vrt:foo xmlns:vrt="http://www.vrt.be/mig/viaa/api"><broken>'
+    event_parser = EventParser()
+
+    # ACT/ASSERT
+    with pytest.raises(InvalidEventException, match=r"^Can't handle 'foo' events$"):
+        event_parser.get_event("foo", xml)
+
+
+def test_sniff_rejects_oversized_event():
+    # ARRANGE
+    xml = resources.load_xml_resource("getMetadataResponse")
+    event_parser = EventParser(max_size=len(xml) - 1)
+
+    # ACT/ASSERT
+    with pytest.raises(InvalidEventException, match=r"^Event is larger than"):
+        event_parser.get_event("getMetadataResponse", xml)
+
+
+def test_sniff_reads_header():
+    # ARRANGE
+    xml = resources.load_xml_resource("metadataUpdatedEvent")
+    event_parser = EventParser()
+
+    # ACT
+    header = event_parser.sniff("metadataUpdatedEvent", xml)
+
+    # ASSERT
+    assert header.event_type == "metadataUpdatedEvent"
+    assert header.media_id == "TESTJEVANRUDOLF"
+    assert header.status is None
+
+
+@pytest.mark.parametrize(
+    "event_type, event, media_id",
+    [
+        ("getMetadataResponse", "getMetadataResponse", "TEST_ID"),
+        ("metadataUpdatedEvent", "metadataUpdatedEvent", "TESTJEVANRUDOLF"),
+    ],
+)
+def test_get_media_id(event_type, event, media_id):
+    # ARRANGE
+    xml = resources.load_xml_resource(event)
+    event_parser = EventParser()
+
+    # ACT/ASSERT
+    assert event_parser.get_media_id(event_type, xml) == media_id
+
+
+def test_get_media_id_missing():
+    # ARRANGE
+    xml = resources.load_xml_resource("getMetadataResponseMediaIDMissing")
+    event_parser = EventParser()
+
+    # ACT/ASSERT
+    with pytest.raises(InvalidEventException, match=r"MEDIA_ID identifier"):
+        event_parser.get_media_id("getMetadataResponse", xml)
@@ -1,3 +1,5 @@
+from lxml import etree
+
 from app.helpers.xml_helper import (
     generate_make_subtitle_available_request_xml,
 )
@@ -18,3 +20,21 @@ def test_construct_subtitle_request():
 
     # ASSERT
     assert ref_xml == test_xml
+
+
+def test_construct_subtitle_request_escapes_values():
+    # ACT
+    test_xml = generate_make_subtitle_available_request_xml(
+        "closed", "correlation<&>Id", "media&Id"
+    )
+
+    # ASSERT
+    root = etree.fromstring(test_xml)
+    values = {child.tag.split("}")[1]: child.text for child in root}
+    assert values == {
+        "requestor": "meemoo",
+        "correlationId": "correlation<&>Id",
+        "id": "media&Id",
+        "destinationPath": "mam-collaterals/closedOT/media&Id/",
+        "otType": "CLOSED",
+    }
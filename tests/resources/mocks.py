@@ -7,19 +7,45 @@ def mock_rabbit(mocker):
         print(f"Initiating Rabbit connection.")
         pass
 
-    def mock_send_message(self, body, routing_key):
+    def mock_send_message(self, routing_key, body, exchange="", properties=None):
         print(f"Sending Rabbit message.")
         pass
 
+    def mock_declare_retry_queues(self, queue, retry_policy):
+        print(f"Declaring retry queues.")
+        pass
+
+    def mock_declare_shards(self, queue, sharding_policy):
+        print(f"Declaring shards.")
+        return []
+
     def mock_listen(self, on_message_callback, queue=None):
         print(f"Listening for Rabbit messages.")
         pass
 
+    def mock_publisher_init(self):
+        print(f"Initiating Rabbit publisher.")
+        pass
+
+    def mock_publish_batch(self, exchange, routing_key, bodies, headers=None):
+        print(f"Publishing Rabbit messages.")
+        pass
+
+    def mock_publish(self, exchange, routing_key, body, properties):
+        print(f"Publishing Rabbit message.")
+        pass
+
+    from app.services.publisher import ConfirmingPublisher
     from app.services.rabbit import RabbitClient
 
     mocker.patch.object(RabbitClient, "__init__", mock_init)
     mocker.patch.object(RabbitClient, "send_message", mock_send_message)
+    mocker.patch.object(RabbitClient, "declare_retry_queues", mock_declare_retry_queues)
+    mocker.patch.object(RabbitClient, "declare_shards", mock_declare_shards)
     mocker.patch.object(RabbitClient, "listen", mock_listen)
+    mocker.patch.object(ConfirmingPublisher, "__init__", mock_publisher_init)
+    mocker.patch.object(ConfirmingPublisher, "publish_batch", mock_publish_batch)
+    mocker.patch.object(ConfirmingPublisher, "publish", mock_publish)
 
 
 @pytest.fixture
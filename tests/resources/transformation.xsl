@@ -0,0 +1,16 @@
+<?xml version="1.0" encoding="UTF-8"?>
+<xsl:stylesheet version="1.0"
+  xmlns:xsl="http://www.w3.org/1999/XSL/Transform"
+  xmlns:vrt="http://www.vrt.be/mig/viaa/api"
+  xmlns:dc="http://purl.org/dc/elements/1.1/"
+  xmlns:ebu="urn:ebu:metadata-schema:ebuCore_2012"
+  exclude-result-prefixes="vrt dc ebu">
+  <xsl:output method="xml" encoding="UTF-8"/>
+  <xsl:template match="/vrt:metadata">
+    <mh:Sidecar xmlns:mh="https://zeticon.mediahaven.com/metadata/20.3/mh/">
+      <mh:Descriptive>
+        <mh:Title><xsl:value-of select="ebu:title/dc:title"/></mh:Title>
+      </mh:Descriptive>
+    </mh:Sidecar>
+  </xsl:template>
+</xsl:stylesheet>
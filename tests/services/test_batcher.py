@@ -0,0 +1,81 @@
+from app.services.batcher import Batcher
+
+
+class Scheduler:
+    def __init__(self):
+        self.callbacks = []
+
+    def call_later(self, delay, callback):
+        self.callbacks.append(callback)
+
+    def run(self):
+        callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback()
+
+
+def test_full_batch_is_released():
+    # ARRANGE
+    scheduler = Scheduler()
+    released = []
+    batcher = Batcher(2, 1, scheduler.call_later, released.append)
+
+    # ACT
+    batcher.add("first")
+    batcher.add("second")
+    batcher.add("third")
+
+    # ASSERT
+    assert released == [["first", "second"]]
+    assert batcher.items == ["third"]
+
+
+def test_batch_is_released_after_max_wait():
+    # ARRANGE
+    scheduler = Scheduler()
+    released = []
+    batcher = Batcher(10, 1, scheduler.call_later, released.append)
+
+    # ACT
+    batcher.add("first")
+    scheduler.run()
+
+    # ASSERT
+    assert released == [["first"]]
+    assert batcher.items == []
+
+
+def test_timer_of_released_batch_is_ignored():
+    # ARRANGE
+    scheduler = Scheduler()
+    released = []
+    batcher = Batcher(2, 1, scheduler.call_later, released.append)
+
+    # ACT
+    batcher.add("first")
+    batcher.add("second")
+    batcher.add("third")
+    # Only the timer of the first batch has run
+    scheduler.callbacks[0]()
+
+    # ASSERT
+    assert released == [["first", "second"]]
+    assert batcher.items == ["third"]
+
+
+def test_next_batch_waits_for_done():
+    # ARRANGE
+    scheduler = Scheduler()
+    released = []
+    batcher = Batcher(2, 1, scheduler.call_later, released.append, one_at_a_time=True)
+
+    # ACT
+    for item in ["first", "second", "third", "fourth", "fifth"]:
+        batcher.add(item)
+    held_back = list(released)
+    batcher.done()
+
+    # ASSERT
+    assert held_back == [["first", "second"]]
+    assert released == [["first", "second"], ["third", "fourth"]]
+    assert batcher.items == ["fifth"]
@@ -0,0 +1,109 @@
+import pytest
+from requests.exceptions import ConnectionError, HTTPError
+
+from app.services.circuit_breaker import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    CircuitOpenError,
+)
+
+
+def fail(breaker, error=None):
+    with pytest.raises(type(error or ConnectionError())):
+        with breaker.guard():
+            raise error or ConnectionError()
+
+
+def test_opens_after_consecutive_failures():
+    # ARRANGE
+    states = []
+    breaker = CircuitBreaker(
+        "mediahaven", 2, 30, on_state_change=lambda _, state: states.append(state)
+    )
+
+    # ACT
+    fail(breaker)
+    with breaker.guard():
+        pass
+    fail(breaker)
+    fail(breaker)
+
+    # ASSERT
+    assert breaker.state == OPEN
+    assert states == [OPEN]
+    assert 0 < breaker.retry_after() <= 30
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_other_errors_do_not_count():
+    # ARRANGE
+    breaker = CircuitBreaker("transformer", 1, 30)
+    error = HTTPError()
+    error.response = type("Response", (), {"status_code": 400})()
+
+    # ACT
+    fail(breaker, error)
+
+    # ASSERT
+    assert breaker.state == CLOSED
+
+
+def test_half_open_lets_one_probe_through(mocker):
+    # ARRANGE
+    states = []
+    breaker = CircuitBreaker(
+        "mediahaven", 1, 30, on_state_change=lambda _, state: states.append(state)
+    )
+    monotonic = mocker.patch("app.services.circuit_breaker.time.monotonic")
+    monotonic.return_value = 100
+    fail(breaker)
+    monotonic.return_value = 130
+
+    # ACT
+    breaker.before_call()
+
+    # ASSERT
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert states == [OPEN, HALF_OPEN, CLOSED]
+
+
+def test_failed_probe_opens_again(mocker):
+    # ARRANGE
+    breaker = CircuitBreaker("mediahaven", 3, 30)
+    monotonic = mocker.patch("app.services.circuit_breaker.time.monotonic")
+    monotonic.return_value = 100
+    for _ in range(3):
+        fail(breaker)
+    monotonic.return_value = 130
+
+    # ACT
+    fail(breaker)
+
+    # ASSERT
+    assert breaker.state == OPEN
+    assert breaker.retry_after() == 30
+
+
+def test_neutral_error_releases_probe(mocker):
+    # ARRANGE
+    breaker = CircuitBreaker("mediahaven", 1, 30)
+    monotonic = mocker.patch("app.services.circuit_breaker.time.monotonic")
+    monotonic.return_value = 100
+    fail(breaker)
+    monotonic.return_value = 130
+
+    # ACT
+    with pytest.raises(KeyError):
+        with breaker.guard(neutral=(KeyError,)):
+            raise KeyError()
+
+    # ASSERT
+    assert breaker.state == HALF_OPEN
+    breaker.before_call()
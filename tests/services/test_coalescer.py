@@ -0,0 +1,79 @@
+from prometheus_client import REGISTRY
+
+from app.models.event import MetadataUpdatedEvent
+from app.services.coalescer import Coalescer
+
+
+def _event(timestamp):
+    return MetadataUpdatedEvent(
+        "metadataUpdatedEvent", None, timestamp, "media_id", "video"
+    )
+
+
+class Scheduler:
+    def __init__(self):
+        self.callbacks = []
+
+    def call_later(self, delay, callback):
+        self.callbacks.append(callback)
+
+    def run(self):
+        callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback()
+
+
+def test_only_newest_event_is_released():
+    # ARRANGE
+    scheduler = Scheduler()
+    released = []
+    superseded = []
+    coalescer = Coalescer(1, scheduler.call_later, released.append, superseded.append)
+    coalesced = REGISTRY.get_sample_value("vrt_events_metadata_coalesced_total") or 0
+
+    # ACT
+    coalescer.add("media_id", _event("2019-09-24T17:21:28.787+02:00"), "first")
+    coalescer.add("media_id", _event("2019-09-24T17:25:00.000+02:00"), "newest")
+    coalescer.add("media_id", _event("2019-09-24T17:22:00.000+02:00"), "older")
+    scheduler.run()
+
+    # ASSERT
+    assert released == ["newest"]
+    assert superseded == ["first", "older"]
+    assert (
+        REGISTRY.get_sample_value("vrt_events_metadata_coalesced_total")
+        == coalesced + 2
+    )
+    assert coalescer.pending == {}
+
+
+def test_events_for_other_media_ids_are_released():
+    # ARRANGE
+    scheduler = Scheduler()
+    released = []
+    coalescer = Coalescer(1, scheduler.call_later, released.append, None)
+
+    # ACT
+    coalescer.add("a", _event("2019-09-24T17:21:28.787+02:00"), "a")
+    coalescer.add("b", _event("2019-09-24T17:21:28.787+02:00"), "b")
+    scheduler.run()
+
+    # ASSERT
+    assert released == ["a", "b"]
+
+
+def test_later_event_wins_if_timestamps_are_invalid():
+    # ARRANGE
+    scheduler = Scheduler()
+    released = []
+    superseded = []
+    coalescer = Coalescer(1, scheduler.call_later, released.append, superseded.append)
+
+    # ACT
+    coalescer.add("media_id", _event("2019-09-24T17:21:28.787+02:00"), "first")
+    coalescer.add("media_id", _event("invalid"), "second")
+    scheduler.run()
+
+    # ASSERT
+    assert released == ["second"]
+    assert superseded == ["first"]
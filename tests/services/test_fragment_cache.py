@@ -0,0 +1,59 @@
+from app.services.fragment_cache import FragmentCache
+
+
+def test_get_returns_cached_fragment_id():
+    # ARRANGE
+    fragment_cache = FragmentCache(max_size=10, ttl=60)
+    fragment_cache.put("media_id", "fragment_id")
+
+    # ACT
+    hit = fragment_cache.get("media_id")
+    miss = fragment_cache.get("other_media_id")
+
+    # ASSERT
+    assert hit == "fragment_id"
+    assert miss is None
+
+
+def test_entries_expire(mocker):
+    # ARRANGE
+    monotonic = mocker.patch("app.services.fragment_cache.time.monotonic")
+    monotonic.return_value = 100
+    fragment_cache = FragmentCache(max_size=10, ttl=60)
+    fragment_cache.put("media_id", "fragment_id")
+
+    # ACT
+    monotonic.return_value = 161
+
+    # ASSERT
+    assert fragment_cache.get("media_id") is None
+    assert len(fragment_cache) == 0
+
+
+def test_least_recently_used_is_evicted():
+    # ARRANGE
+    fragment_cache = FragmentCache(max_size=2, ttl=60)
+    fragment_cache.put("a", "fragment_a")
+    fragment_cache.put("b", "fragment_b")
+    fragment_cache.get("a")
+
+    # ACT
+    fragment_cache.put("c", "fragment_c")
+
+    # ASSERT
+    assert fragment_cache.get("a") == "fragment_a"
+    assert fragment_cache.get("b") is None
+    assert fragment_cache.get("c") == "fragment_c"
+
+
+def test_invalidate():
+    # ARRANGE
+    fragment_cache = FragmentCache(max_size=10, ttl=60)
+    fragment_cache.put("media_id", "fragment_id")
+
+    # ACT
+    fragment_cache.invalidate("media_id")
+    fragment_cache.invalidate("unknown_media_id")
+
+    # ASSERT
+    assert fragment_cache.get("media_id") is None
@@ -0,0 +1,66 @@
+from app.services.media_id_store import MediaIdStore
+from app.services.idempotency import IdempotencyStore
+
+
+def test_least_recently_used_is_evicted():
+    # ARRANGE
+    store = MediaIdStore(max_size=2)
+    store.put("a", "1")
+    store.put("b", "2")
+    store.get("a")
+
+    # ACT
+    store.put("c", "3")
+
+    # ASSERT
+    assert store.get("a") == "1"
+    assert store.get("b") is None
+    assert store.get("c") == "3"
+
+
+def test_values_are_persisted(tmp_path):
+    # ARRANGE
+    path = str(tmp_path / "store.db")
+    store = MediaIdStore(max_size=10, path=path)
+    store.put("a", "1")
+    store.close()
+
+    # ACT
+    store = MediaIdStore(max_size=10, path=path)
+
+    # ASSERT
+    assert len(store) == 0
+    assert store.get("a") == "1"
+    assert store.get("b") is None
+
+
+def test_persisted_values_are_pruned(tmp_path):
+    # ARRANGE
+    path = str(tmp_path / "store.db")
+    store = MediaIdStore(max_size=10, path=path)
+
+    # ACT
+    for index in range(100):
+        store.put(str(index), "value")
+
+    # ASSERT
+    count = store.connection.execute("SELECT COUNT(*) FROM media_ids").fetchone()
+    assert count == (10,)
+
+
+def test_idempotency_store_skips_unchanged_metadata():
+    # ARRANGE
+    idempotency_store = IdempotencyStore(MediaIdStore(max_size=10))
+    checksum = IdempotencyStore.checksum("<metadata><title>Title</title></metadata>")
+    idempotency_store.record("media_id", checksum)
+
+    # ACT
+    reformatted = IdempotencyStore.checksum(
+        "<metadata>\n  <title>Title</title>\n</metadata>"
+    )
+    changed = IdempotencyStore.checksum("<metadata><title>Other</title></metadata>")
+
+    # ASSERT
+    assert idempotency_store.is_unchanged("media_id", reformatted)
+    assert not idempotency_store.is_unchanged("media_id", changed)
+    assert not idempotency_store.is_unchanged("other_media_id", checksum)
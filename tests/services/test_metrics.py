@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+from prometheus_client import REGISTRY
+
+from app.services import metrics
+
+
+def _sample(stage, suffix):
+    return REGISTRY.get_sample_value(
+        f"vrt_events_metadata_stage_seconds_{suffix}", {"stage": stage}
+    )
+
+
+def test_timed_records_calls():
+    # ARRANGE
+    @metrics.timed("test_sync")
+    def stage(value):
+        return value * 2
+
+    # ACT
+    result = stage(2)
+
+    # ASSERT
+    assert result == 4
+    assert _sample("test_sync", "count") == 1
+
+
+def test_timed_records_calls_that_raise():
+    # ARRANGE
+    @metrics.timed("test_raise")
+    def stage():
+        raise ValueError()
+
+    # ACT
+    with pytest.raises(ValueError):
+        stage()
+
+    # ASSERT
+    assert _sample("test_raise", "count") == 1
+
+
+def test_timed_records_coroutines():
+    # ARRANGE
+    @metrics.timed("test_async")
+    async def stage():
+        await asyncio.sleep(0.01)
+        return "done"
+
+    # ACT
+    result = asyncio.run(stage())
+
+    # ASSERT
+    assert result == "done"
+    assert _sample("test_async", "count") == 1
+    assert _sample("test_async", "sum") >= 0.01
@@ -0,0 +1,94 @@
+from concurrent.futures import Future
+
+import pika
+import pytest
+
+from app.services.publisher import ConfirmingPublisher, PublishError
+
+
+class Frame:
+    def __init__(self, method):
+        self.method = method
+
+
+@pytest.fixture
+def publisher():
+    # Don't connect, only the confirm tracking is tested
+    publisher = ConfirmingPublisher.__new__(ConfirmingPublisher)
+    publisher.pending = {tag: Future() for tag in range(1, 5)}
+    return publisher
+
+
+def test_multiple_ack_confirms_batch(publisher):
+    # ARRANGE
+    futures = dict(publisher.pending)
+
+    # ACT
+    publisher._on_confirm(Frame(pika.spec.Basic.Ack(delivery_tag=3, multiple=True)))
+
+    # ASSERT
+    assert [tag for tag, future in futures.items() if future.done()] == [1, 2, 3]
+    assert list(publisher.pending) == [4]
+
+
+def test_nack_fails_publish(publisher):
+    # ARRANGE
+    future = publisher.pending[2]
+
+    # ACT
+    publisher._on_confirm(Frame(pika.spec.Basic.Nack(delivery_tag=2)))
+
+    # ASSERT
+    with pytest.raises(PublishError):
+        future.result()
+    assert list(publisher.pending) == [1, 3, 4]
+
+
+def test_closed_connection_fails_pending(publisher):
+    # ARRANGE
+    futures = list(publisher.pending.values())
+
+    # ACT
+    publisher._fail_pending("Connection closed")
+
+    # ASSERT
+    assert all(isinstance(future.exception(), PublishError) for future in futures)
+    assert publisher.pending == {}
+
+
+def test_publish_batch_sets_headers_per_message(mocker):
+    # ARRANGE
+    publisher = ConfirmingPublisher.__new__(ConfirmingPublisher)
+    publish_and_wait = mocker.patch.object(publisher, "_publish_and_wait")
+
+    # ACT
+    publisher.publish_batch("exchange", "", [b"a", b"b"], [{"x": "1"}, {"x": "2"}])
+
+    # ASSERT
+    exchange, routing_key, bodies, properties = publish_and_wait.call_args.args
+    assert [message_properties.headers for message_properties in properties] == [
+        {"x": "1"},
+        {"x": "2"},
+    ]
+    assert all(
+        message_properties.delivery_mode == pika.spec.PERSISTENT_DELIVERY_MODE
+        for message_properties in properties
+    )
+
+
+def test_publish_tracks_confirms(mocker):
+    # ARRANGE
+    publisher = ConfirmingPublisher.__new__(ConfirmingPublisher)
+    publisher.channel = mocker.MagicMock(is_open=True)
+    publisher.delivery_tag = 0
+    publisher.pending = {}
+    properties = pika.BasicProperties(expiration="1000")
+
+    # ACT
+    publisher._publish("", "queue", [b"a"], [properties], [Future()])
+
+    # ASSERT
+    publisher.channel.basic_publish.assert_called_once_with(
+        exchange="", routing_key="queue", body=b"a", properties=properties
+    )
+    assert list(publisher.pending) == [1]
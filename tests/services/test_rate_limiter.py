@@ -0,0 +1,121 @@
+import multiprocessing
+
+import pytest
+from requests.exceptions import ConnectionError, HTTPError
+from requests.models import Response
+
+from app.services.rate_limiter import (
+    AdaptiveRateLimiter,
+    SharedRateLimiter,
+    is_overload_error,
+)
+
+
+def _http_error(status_code):
+    response = Response()
+    response.status_code = status_code
+    return HTTPError(response=response)
+
+
+@pytest.fixture
+def rate_limiter():
+    return AdaptiveRateLimiter(
+        rate=10, min_rate=1, max_rate=20, latency_threshold=1.0, increase=1
+    )
+
+
+def test_healthy_call_increases_rate(rate_limiter):
+    # ACT
+    rate_limiter.on_success(0.1)
+
+    # ASSERT
+    assert rate_limiter.rate == 11
+
+
+def test_rate_is_capped(rate_limiter):
+    # ACT
+    for _ in range(50):
+        rate_limiter.on_success(0.1)
+
+    # ASSERT
+    assert rate_limiter.rate == 20
+
+
+def test_slow_call_decreases_rate(rate_limiter):
+    # ACT
+    rate_limiter.on_success(5)
+
+    # ASSERT
+    assert rate_limiter.rate == 5
+
+
+def test_overload_decreases_rate(rate_limiter):
+    # ACT
+    with pytest.raises(HTTPError):
+        with rate_limiter.limit():
+            raise _http_error(429)
+
+    # ASSERT
+    assert rate_limiter.rate == 5
+
+
+def test_rate_does_not_drop_below_minimum(rate_limiter):
+    # ACT
+    for _ in range(10):
+        rate_limiter.on_overload()
+
+    # ASSERT
+    assert rate_limiter.rate == 1
+
+
+def test_other_errors_keep_rate(rate_limiter):
+    # ACT
+    with pytest.raises(HTTPError):
+        with rate_limiter.limit():
+            raise _http_error(400)
+
+    # ASSERT
+    assert rate_limiter.rate == 10
+
+
+@pytest.mark.parametrize(
+    "error, overload",
+    [
+        (_http_error(429), True),
+        (_http_error(503), True),
+        (_http_error(404), False),
+        (ConnectionError(), True),
+        (ValueError(), False),
+    ],
+)
+def test_is_overload_error(error, overload):
+    assert is_overload_error(error) == overload
+
+
+def _acquire(rate_limiter):
+    rate_limiter.acquire()
+    rate_limiter.on_success(0.1)
+
+
+def test_shared_rate_limiter_shares_state_between_processes():
+    # ARRANGE
+    context = multiprocessing.get_context("spawn")
+    rate_limiter = SharedRateLimiter(
+        rate=10,
+        min_rate=1,
+        max_rate=20,
+        latency_threshold=1.0,
+        increase=1,
+        context=context,
+    )
+    last_refill = rate_limiter.last_refill
+
+    # ACT
+    process = context.Process(target=_acquire, args=(rate_limiter,))
+    process.start()
+    process.join(timeout=10)
+
+    # ASSERT
+    assert process.exitcode == 0
+    assert rate_limiter.rate == 11
+    assert rate_limiter.last_refill > last_refill
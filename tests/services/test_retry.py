@@ -0,0 +1,53 @@
+import pika
+import pytest
+
+from app.services.retry import (
+    ORIGINAL_ROUTING_KEY_HEADER,
+    RETRY_ATTEMPTS_HEADER,
+    RetryPolicy,
+    get_attempts,
+    get_routing_key,
+)
+
+
+class Method:
+    routing_key = "queue"
+
+
+@pytest.fixture
+def retry_policy():
+    return RetryPolicy(max_attempts=3, base_delay=10, max_delay=30, jitter=0.2)
+
+
+@pytest.mark.parametrize("attempt, delay", [(1, 10), (2, 20), (3, 30), (10, 30)])
+def test_delay(retry_policy, attempt, delay):
+    # ACT
+    delays = [retry_policy.delay(attempt) for _ in range(100)]
+
+    # ASSERT
+    assert all(delay * 0.8 <= d <= delay for d in delays)
+
+
+def test_should_park(retry_policy):
+    assert not retry_policy.should_park(3)
+    assert retry_policy.should_park(4)
+
+
+def test_get_routing_key_of_retried_message():
+    # ARRANGE
+    properties = pika.BasicProperties(
+        headers={ORIGINAL_ROUTING_KEY_HEADER: "vrt.metadataUpdatedEvent"}
+    )
+
+    # ACT/ASSERT
+    assert get_routing_key(Method(), properties) == "vrt.metadataUpdatedEvent"
+    assert get_routing_key(Method(), pika.BasicProperties()) == "queue"
+
+
+def test_get_attempts():
+    # ARRANGE
+    properties = pika.BasicProperties(headers={RETRY_ATTEMPTS_HEADER: 2})
+
+    # ACT/ASSERT
+    assert get_attempts(properties) == 2
+    assert get_attempts(pika.BasicProperties()) == 0
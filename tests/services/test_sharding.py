@@ -0,0 +1,42 @@
+import pytest
+
+from app.services.sharding import ShardingPolicy
+
+
+def test_from_config():
+    # ARRANGE
+    config = {"role": "shard", "exchange": "shards", "count": "4", "shards": "1, 3"}
+
+    # ACT
+    sharding_policy = ShardingPolicy.from_config(config)
+
+    # ASSERT
+    assert sharding_policy.role == "shard"
+    assert sharding_policy.count == 4
+    assert sharding_policy.assigned_shards() == [1, 3]
+    assert sharding_policy.shard_queue("queue", 1) == "queue.shard.1"
+
+
+def test_all_shards_are_assigned_by_default():
+    # ARRANGE
+    config = {"role": "shard", "exchange": "shards", "count": 3, "shards": ""}
+
+    # ACT
+    sharding_policy = ShardingPolicy.from_config(config)
+
+    # ASSERT
+    assert sharding_policy.assigned_shards() == [0, 1, 2]
+
+
+def test_removed_shards_are_not_assigned():
+    # ARRANGE
+    sharding_policy = ShardingPolicy("shard", "shards", 2, shards=[1, 2, 3])
+
+    # ACT/ASSERT
+    assert sharding_policy.assigned_shards() == [1]
+
+
+def test_unknown_role():
+    # ACT/ASSERT
+    with pytest.raises(ValueError):
+        ShardingPolicy("leader", "shards", 2)
@@ -0,0 +1,104 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.services.token_manager import TokenManager
+
+
+class Grant:
+    def __init__(self, fail=False, token=None):
+        self.fail = fail
+        self.token = token
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def request_token(self, username, password):
+        time.sleep(0.01)
+        with self.lock:
+            self.requests += 1
+        if self.fail:
+            raise ValueError("Invalid grant")
+        return self.token
+
+
+def make_token_manager(grant, lifetime=3600, refresh_margin=300):
+    return TokenManager(grant, "user", "password", lifetime, refresh_margin, 0.01)
+
+
+def test_burst_of_refreshes_requests_one_token():
+    # ARRANGE
+    grant = Grant()
+    token_manager = make_token_manager(grant)
+    token_manager.start()
+    generation = token_manager.generation
+
+    # ACT
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda _: token_manager.refresh(generation), range(8)))
+    token_manager.stop()
+
+    # ASSERT
+    assert grant.requests == 2
+    assert token_manager.generation == generation + 1
+
+
+def test_token_is_refreshed_before_expiry():
+    # ARRANGE
+    grant = Grant()
+    token_manager = make_token_manager(grant, lifetime=0.2, refresh_margin=0.15)
+
+    # ACT
+    token_manager.start()
+    time.sleep(0.3)
+    token_manager.stop()
+
+    # ASSERT
+    assert grant.requests >= 3
+
+
+def test_token_is_refreshed_before_its_own_expiry():
+    # ARRANGE
+    grant = Grant(token={"access_token": "token", "expires_in": 0.2})
+    token_manager = make_token_manager(grant, lifetime=3600, refresh_margin=0.15)
+
+    # ACT
+    token_manager.start()
+    time.sleep(0.3)
+    token_manager.stop()
+
+    # ASSERT
+    assert grant.requests >= 3
+
+
+@pytest.mark.parametrize(
+    "token, lifetime",
+    [
+        ({"expires_in": 60}, 60),
+        ({"expires_in": 60, "expires_at": time.time() + 120}, 120),
+        ({"access_token": "token"}, 3600),
+        (None, 3600),
+    ],
+)
+def test_lifetime_of_token(token, lifetime):
+    # ARRANGE
+    token_manager = make_token_manager(Grant(), lifetime=3600)
+
+    # ACT/ASSERT
+    assert token_manager._lifetime_of(token) == pytest.approx(lifetime, abs=5)
+
+
+def test_failed_refresh_keeps_the_token():
+    # ARRANGE
+    grant = Grant()
+    token_manager = make_token_manager(grant)
+    token_manager.start()
+    generation = token_manager.generation
+    grant.fail = True
+
+    # ACT/ASSERT
+    with pytest.raises(ValueError):
+        token_manager.refresh(generation)
+    token_manager.stop()
+    assert token_manager.generation == generation
@@ -0,0 +1,63 @@
+import pytest
+from requests.exceptions import HTTPError
+from requests.models import Response
+
+from app.services.transformer import TransformerClient
+
+
+def _response(status_code, text=""):
+    response = Response()
+    response.status_code = status_code
+    response._content = text.encode("utf-8")
+    return response
+
+
+@pytest.fixture
+def transformer_client():
+    return TransformerClient(
+        host="http://mtd-transformer",
+        transformation="OR-rf5kf25",
+        pool_size=4,
+        connect_timeout=1,
+        read_timeout=10,
+        retries=2,
+    )
+
+
+def test_transform(transformer_client, mocker):
+    # ARRANGE
+    post = mocker.patch.object(
+        transformer_client.session, "post", return_value=_response(200, "<mh/>")
+    )
+
+    # ACT
+    metadata = transformer_client.transform("<metadata/>")
+
+    # ASSERT
+    assert metadata == "<mh/>"
+    post.assert_called_once_with(
+        "http://mtd-transformer/transform/?transformation=OR-rf5kf25",
+        data="<metadata/>",
+        headers={"Content-Type": "application/xml"},
+        timeout=(1, 10),
+    )
+
+
+def test_transform_error(transformer_client, mocker):
+    # ARRANGE
+    mocker.patch.object(transformer_client.session, "post", return_value=_response(400))
+
+    # ACT/ASSERT
+    with pytest.raises(HTTPError):
+        transformer_client.transform("<metadata/>")
+
+
+def test_connections_are_pooled(transformer_client):
+    # ACT
+    adapter = transformer_client.session.get_adapter("http://mtd-transformer")
+
+    # ASSERT
+    assert adapter._pool_maxsize == 4
+    assert adapter.max_retries.connect == 2
+    assert adapter.max_retries.read == 0
+    assert "POST" in adapter.max_retries.allowed_methods
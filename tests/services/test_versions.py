@@ -0,0 +1,58 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+from app.services.media_id_store import MediaIdStore
+from app.services.versions import VersionStore
+
+
+def make_event(media_id, timestamp):
+    return SimpleNamespace(
+        metadata=SimpleNamespace(media_id=media_id),
+        parsed_timestamp=datetime.fromisoformat(timestamp) if timestamp else None,
+    )
+
+
+def test_older_event_is_stale():
+    # ARRANGE
+    version_store = VersionStore(MediaIdStore(max_size=10))
+    version_store.record(make_event("a", "2019-09-24T17:21:28+02:00"))
+
+    # ACT/ASSERT
+    assert version_store.is_stale(make_event("a", "2019-09-24T17:21:27+02:00"))
+    assert not version_store.is_stale(make_event("a", "2019-09-24T17:21:28+02:00"))
+    assert not version_store.is_stale(make_event("b", "2019-09-24T17:21:27+02:00"))
+
+
+def test_timestamps_are_compared_across_timezones():
+    # ARRANGE
+    version_store = VersionStore(MediaIdStore(max_size=10))
+    version_store.record(make_event("a", "2019-09-24T17:21:28+02:00"))
+
+    # ACT/ASSERT
+    assert version_store.is_stale(make_event("a", "2019-09-24T15:21:27+00:00"))
+    assert not version_store.is_stale(make_event("a", "2019-09-24T15:21:29+00:00"))
+
+
+def test_record_keeps_newest_timestamp():
+    # ARRANGE
+    version_store = VersionStore(MediaIdStore(max_size=10))
+    version_store.record(make_event("a", "2019-09-24T17:21:28+02:00"))
+
+    # ACT
+    version_store.record(make_event("a", "2019-09-24T17:21:27+02:00"))
+
+    # ASSERT
+    assert version_store.is_stale(make_event("a", "2019-09-24T17:21:27+02:00"))
+
+
+def test_event_without_timestamp_is_not_stale():
+    # ARRANGE
+    version_store = VersionStore(MediaIdStore(max_size=10))
+    version_store.record(make_event("a", "2019-09-24T17:21:28+02:00"))
+
+    # ACT
+    version_store.record(make_event("a", None))
+
+    # ASSERT
+    assert not version_store.is_stale(make_event("a", None))
+    assert version_store.store.get("a") == "2019-09-24T17:21:28+02:00"
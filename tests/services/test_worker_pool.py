@@ -0,0 +1,37 @@
+import threading
+
+from app.services.worker_pool import WorkerPool
+
+
+def test_worker_for_is_stable():
+    # ARRANGE
+    worker_pool = WorkerPool(4)
+
+    # ACT
+    workers = {worker_pool.worker_for("TEST_ID") for _ in range(10)}
+
+    # ASSERT
+    assert len(workers) == 1
+    assert workers.pop() in range(4)
+    worker_pool.shutdown()
+
+
+def test_submit_keeps_order_per_key():
+    # ARRANGE
+    worker_pool = WorkerPool(4)
+    handled = {"a": [], "b": [], "c": []}
+    lock = threading.Lock()
+
+    def handle(key, index):
+        with lock:
+            handled[key].append(index)
+
+    # ACT
+    for index in range(100):
+        for key in handled:
+            worker_pool.submit(key, handle, key, index)
+    worker_pool.shutdown()
+
+    # ASSERT
+    for key in handled:
+        assert handled[key] == list(range(100))
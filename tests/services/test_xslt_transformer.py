@@ -0,0 +1,99 @@
+import os
+
+import pytest
+from lxml import etree
+from prometheus_client import REGISTRY
+
+from app.helpers.events_parser import EventParser
+from app.services.transformer import ParityTransformer, XsltTransformer
+from tests.resources import resources
+
+XSLT_PATH = os.path.join(os.path.dirname(resources.__file__), "transformation.xsl")
+EXPECTED = (
+    '<mh:Sidecar xmlns:mh="https://zeticon.mediahaven.com/metadata/20.3/mh/">'
+    "<mh:Descriptive><mh:Title>Winners FIFA BEST Awards</mh:Title></mh:Descriptive>"
+    "</mh:Sidecar>"
+)
+
+
+def _parity(result):
+    return (
+        REGISTRY.get_sample_value(
+            "vrt_events_metadata_transform_parity_total", {"result": result}
+        )
+        or 0.0
+    )
+
+
+class Transformer:
+    def __init__(self, result):
+        self.result = result
+        self.calls = 0
+
+    def transform(self, metadata):
+        self.calls += 1
+        return self.result
+
+
+@pytest.fixture
+def metadata():
+    xml = resources.load_xml_resource("getMetadataResponse")
+    return EventParser().get_event("getMetadataResponse", xml).metadata.raw
+
+
+def test_xslt_transformer(metadata):
+    # ARRANGE
+    fallback = Transformer("fallback")
+    xslt_transformer = XsltTransformer(XSLT_PATH, fallback)
+
+    # ACT
+    result = xslt_transformer.transform(metadata)
+
+    # ASSERT
+    assert EXPECTED in result
+    assert fallback.calls == 0
+
+
+def test_xslt_transformer_uses_fallback():
+    # ARRANGE
+    fallback = Transformer("fallback")
+    xslt_transformer = XsltTransformer(XSLT_PATH, fallback)
+
+    # ACT
+    result = xslt_transformer.transform("<invalid")
+
+    # ASSERT
+    assert result == "fallback"
+    assert fallback.calls == 1
+
+
+def test_xslt_transformer_without_fallback():
+    # ARRANGE
+    xslt_transformer = XsltTransformer(XSLT_PATH)
+
+    # ACT/ASSERT
+    with pytest.raises(etree.XMLSyntaxError):
+        xslt_transformer.transform("<invalid")
+
+
+@pytest.mark.parametrize(
+    "remote_result, matches",
+    [
+        (f'<?xml version="1.0" encoding="UTF-8"?>\n{EXPECTED}\n', 1),
+        ("<mh:Sidecar xmlns:mh='other'/>", 0),
+        ("not xml", 0),
+    ],
+)
+def test_parity_transformer(metadata, remote_result, matches):
+    # ARRANGE
+    remote = Transformer(remote_result)
+    parity_transformer = ParityTransformer(XsltTransformer(XSLT_PATH), remote)
+    before = {result: _parity(result) for result in ("match", "mismatch")}
+
+    # ACT
+    result = parity_transformer.transform(metadata)
+
+    # ASSERT
+    assert result == remote_result
+    assert _parity("match") == before["match"] + matches
+    assert _parity("mismatch") == before["mismatch"] + 1 - matches
@@ -1,10 +1,28 @@
+import copy
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pika
 import pytest
+from prometheus_client import REGISTRY
+from requests.exceptions import ConnectionError
 
+from mediahaven.mediahaven import MediaHavenException
 from mediahaven.mocks.base_resource import MediaHavenPageObjectJSONMock
 
 from tests.resources import resources
 from tests.resources.mocks import mock_rabbit, mock_mediahaven
-from app.app import EventListener
+from viaa.configuration import ConfigParser
+from app.app import EventListener, NackException
+from app.helpers.events_parser import EventParser
+from app.services.publisher import PublishError
+from app.services.rabbit import RabbitClient, ThreadSafeChannel
+from app.services.retry import ORIGINAL_ROUTING_KEY_HEADER, RETRY_ATTEMPTS_HEADER
+from app.services.sharding import MEDIA_ID_HEADER
+
+
+def _sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0.0
 
 
 @pytest.fixture
@@ -29,3 +47,533 @@ def test_get_fragment(event_listener):
         fragment.Internal.FragmentId
         == "4885061ab2e047728558d24411dd44b8d89c983031994cec9d774270fb807f9697c9ac524f1a471da54c731ceac09bb0"
     )
+
+
+def test_parse_event_counts_unknown_event_types_as_other(event_listener, mocker):
+    # ARRANGE
+    method = mocker.MagicMock(routing_key="vrt.someUnknownEvent")
+    properties = pika.BasicProperties(headers={})
+    other = _sample("vrt_events_metadata_received_total", event_type="other")
+
+    # ACT
+    with pytest.raises(NackException):
+        event_listener._parse_event(method, properties, b"<someUnknownEvent/>")
+
+    # ASSERT
+    assert (
+        _sample("vrt_events_metadata_received_total", event_type="other") == other + 1
+    )
+    assert (
+        _sample("vrt_events_metadata_received_total", event_type="someUnknownEvent")
+        == 0
+    )
+
+
+def test_handle_nack_exception_retries_message(event_listener, mocker):
+    # ARRANGE
+    publish = mocker.patch.object(event_listener.publisher, "publish")
+    channel = mocker.MagicMock()
+    method = mocker.MagicMock(delivery_tag=1, routing_key="vrt.metadataUpdatedEvent")
+    properties = pika.BasicProperties(headers={RETRY_ATTEMPTS_HEADER: 1})
+    nack_exception = NackException("Retry", requeue=True)
+
+    # ACT
+    event_listener._handle_nack_exception(
+        nack_exception, channel, method, properties, b"body"
+    )
+
+    # ASSERT
+    channel.basic_ack.assert_called_once_with(delivery_tag=1)
+    channel.basic_nack.assert_not_called()
+    exchange, queue, body, retry_properties = publish.call_args.args
+    assert exchange == ""
+    assert queue == "queue.retry.2"
+    assert body == b"body"
+    assert retry_properties.headers[RETRY_ATTEMPTS_HEADER] == 2
+    assert (
+        retry_properties.headers[ORIGINAL_ROUTING_KEY_HEADER]
+        == "vrt.metadataUpdatedEvent"
+    )
+    assert int(retry_properties.expiration) > 0
+
+
+def test_handle_nack_exception_gives_back_message_if_retry_fails(
+    event_listener, mocker
+):
+    # ARRANGE
+    mocker.patch.object(
+        event_listener.publisher,
+        "publish",
+        side_effect=PublishError("Publish was nacked by RabbitMQ."),
+    )
+    channel = mocker.MagicMock()
+    method = mocker.MagicMock(delivery_tag=1, routing_key="vrt.metadataUpdatedEvent")
+    nack_exception = NackException("Retry", requeue=True)
+
+    # ACT
+    event_listener._handle_nack_exception(
+        nack_exception, channel, method, pika.BasicProperties(), b"body"
+    )
+
+    # ASSERT
+    channel.basic_nack.assert_called_once_with(delivery_tag=1, requeue=True)
+    channel.basic_ack.assert_not_called()
+
+
+def test_handle_nack_exception_parks_message(event_listener, mocker):
+    # ARRANGE
+    publish = mocker.patch.object(event_listener.publisher, "publish")
+    channel = mocker.MagicMock()
+    method = mocker.MagicMock(delivery_tag=1, routing_key="vrt.metadataUpdatedEvent")
+    attempts = event_listener.retry_policy.max_attempts
+    properties = pika.BasicProperties(headers={RETRY_ATTEMPTS_HEADER: attempts})
+    nack_exception = NackException("Retry", requeue=True)
+
+    # ACT
+    event_listener._handle_nack_exception(
+        nack_exception, channel, method, properties, b"body"
+    )
+
+    # ASSERT
+    channel.basic_ack.assert_called_once_with(delivery_tag=1)
+    assert publish.call_args.args[1] == "queue.parking"
+    assert publish.call_args.args[3].expiration is None
+
+
+def test_handle_nack_exception_without_requeue(event_listener, mocker):
+    # ARRANGE
+    publish = mocker.patch.object(event_listener.publisher, "publish")
+    channel = mocker.MagicMock()
+    method = mocker.MagicMock(delivery_tag=1)
+    nack_exception = NackException("Invalid event")
+
+    # ACT
+    event_listener._handle_nack_exception(
+        nack_exception, channel, method, pika.BasicProperties(), b"body"
+    )
+
+    # ASSERT
+    channel.basic_nack.assert_called_once_with(delivery_tag=1, requeue=False)
+    publish.assert_not_called()
+
+
+def test_get_fragment_id_is_cached(event_listener, mocker):
+    # ARRANGE
+    json = resources.load_json_resource("mediahaven_response")
+    get_items = mocker.patch.object(
+        event_listener,
+        "_get_items_for_media_id",
+        return_value=MediaHavenPageObjectJSONMock(json),
+    )
+    event = mocker.MagicMock()
+    event.metadata.media_id = "TESTJEVANRUDOLF2"
+    hits = _sample("vrt_events_metadata_fragment_cache_total", result="hit")
+
+    # ACT
+    fragment_ids = [event_listener._get_fragment_id(event) for _ in range(3)]
+
+    # ASSERT
+    assert get_items.call_count == 1
+    assert len(set(fragment_ids)) == 1
+    assert _sample("vrt_events_metadata_fragment_cache_total", result="hit") == hits + 2
+
+
+def test_process_event_skips_unchanged_metadata(event_listener, mocker):
+    # ARRANGE
+    xml = resources.load_xml_resource("getMetadataResponse")
+    event = EventParser().get_event("getMetadataResponse", xml)
+    mocker.patch.object(event_listener, "_get_fragment_id", return_value="fragment")
+    mocker.patch.object(event_listener, "_transform_metadata", return_value="<mh/>")
+    update_metadata = mocker.patch.object(event_listener, "_update_metadata")
+    mocker.patch.object(event_listener, "_request_subtitles")
+    channel = mocker.MagicMock()
+    method = mocker.MagicMock(delivery_tag=1)
+    unchanged = _sample("vrt_events_metadata_unchanged_total")
+
+    # ACT
+    for _ in range(2):
+        event_listener._process_event(channel, method, None, xml, event)
+
+    # ASSERT
+    update_metadata.assert_called_once()
+    assert channel.basic_ack.call_count == 2
+    assert _sample("vrt_events_metadata_unchanged_total") == unchanged + 1
+
+
+def test_process_event_skips_stale_event(event_listener, mocker):
+    # ARRANGE
+    xml = resources.load_xml_resource("getMetadataResponse")
+    event = EventParser().get_event("getMetadataResponse", xml)
+    older_event = EventParser().get_event(
+        "getMetadataResponse",
+        xml.replace(b"2019-09-24T17:21:28.787", b"2019-09-24T17:21:27.787"),
+    )
+    mocker.patch.object(event_listener, "_get_fragment_id", return_value="fragment")
+    transform_metadata = mocker.patch.object(
+        event_listener, "_transform_metadata", return_value="<mh/>"
+    )
+    update_metadata = mocker.patch.object(event_listener, "_update_metadata")
+    request_subtitles = mocker.patch.object(event_listener, "_request_subtitles")
+    channel = mocker.MagicMock()
+    method = mocker.MagicMock(delivery_tag=1)
+    stale = _sample("vrt_events_metadata_stale_total")
+
+    # ACT
+    event_listener._process_event(channel, method, None, xml, event)
+    event_listener._process_event(channel, method, None, xml, older_event)
+
+    # ASSERT
+    transform_metadata.assert_called_once()
+    update_metadata.assert_called_once()
+    request_subtitles.assert_called_once()
+    assert channel.basic_ack.call_count == 2
+    assert _sample("vrt_events_metadata_stale_total") == stale + 1
+
+
+def test_get_items_for_media_id_only_searches_fragment(event_listener, mocker):
+    # ARRANGE
+    event_listener.mediahaven_client = mocker.MagicMock()
+    search = event_listener.mediahaven_client.records.search
+    search.return_value.total_nr_of_results = 1
+    event = mocker.MagicMock()
+    event.metadata.media_id = "TEST_ID"
+
+    # ACT
+    event_listener._get_items_for_media_id(event)
+
+    # ASSERT
+    search.assert_called_once_with(
+        q="+(dc_identifier_localid:TEST_ID) +(IsFragment:true)", nrOfResults=1
+    )
+
+
+def test_get_fragment_stops_at_first_fragment(event_listener, mocker):
+    # ARRANGE
+    fragment = mocker.MagicMock()
+    fragment.Internal.IsFragment = True
+    collateral = mocker.MagicMock()
+    collateral.Internal.IsFragment = False
+
+    def as_generator():
+        yield collateral
+        yield fragment
+        pytest.fail("Fetched results after the fragment.")
+
+    items = mocker.MagicMock()
+    items.as_generator = as_generator
+
+    # ACT
+    result = event_listener._get_fragment(items, None)
+
+    # ASSERT
+    assert result is fragment
+
+
+def test_search_fragment_ids_uses_one_search(event_listener, mocker):
+    # ARRANGE
+    json = resources.load_json_resource("mediahaven_response")
+    event_listener.mediahaven_client = mocker.MagicMock()
+    search = event_listener.mediahaven_client.records.search
+    search.return_value = MediaHavenPageObjectJSONMock(json)
+
+    # ACT
+    fragment_ids = event_listener._search_fragment_ids(["TESTJEVANRUDOLF2", "OTHER_ID"])
+
+    # ASSERT
+    search.assert_called_once_with(
+        q="+(dc_identifier_localid:(TESTJEVANRUDOLF2 OR OTHER_ID)) +(IsFragment:true)",
+        nrOfResults=2,
+    )
+    assert fragment_ids == {
+        "TESTJEVANRUDOLF2": "4885061ab2e047728558d24411dd44b8d89c983031994cec9d774270fb807f9697c9ac524f1a471da54c731ceac09bb0"
+    }
+
+
+def test_process_batch_acks_successful_prefix_at_once(event_listener, mocker):
+    # ARRANGE
+    event_listener.batch_executor = ThreadPoolExecutor(2)
+    mocker.patch.object(event_listener, "_prefetch_fragment_ids")
+    failure = NackException("Fragment not found")
+
+    def apply_event(event):
+        if event.metadata.media_id == "failing":
+            raise failure
+        return "updated"
+
+    mocker.patch.object(event_listener, "_apply_event", side_effect=apply_event)
+    handle_nack_exception = mocker.patch.object(
+        event_listener, "_handle_nack_exception"
+    )
+    channel = mocker.MagicMock()
+    batch = []
+    for delivery_tag, media_id in enumerate(["a", "b", "failing", "c"], start=1):
+        event = mocker.MagicMock()
+        event.metadata.media_id = media_id
+        method = mocker.MagicMock(delivery_tag=delivery_tag)
+        batch.append((channel, method, None, b"body", event))
+
+    # ACT
+    event_listener._process_batch(batch)
+
+    # ASSERT
+    assert channel.basic_ack.call_args_list == [
+        mocker.call(delivery_tag=2, multiple=True),
+        mocker.call(delivery_tag=4),
+    ]
+    handle_nack_exception.assert_called_once_with(
+        failure, channel, batch[2][1], None, b"body"
+    )
+
+
+def test_lookup_and_transform_run_at_the_same_time(event_listener, mocker):
+    # ARRANGE
+    transform_started = threading.Event()
+
+    def get_fragment_id(event):
+        # Only returns if the transformation runs at the same time
+        assert transform_started.wait(timeout=5)
+        return "fragment"
+
+    def transform_metadata(event):
+        transform_started.set()
+        return "<mh/>"
+
+    mocker.patch.object(event_listener, "_get_fragment_id", get_fragment_id)
+    mocker.patch.object(event_listener, "_transform_metadata", transform_metadata)
+
+    # ACT
+    result = event_listener._get_fragment_id_and_transform(mocker.MagicMock())
+
+    # ASSERT
+    assert result == ("fragment", "<mh/>")
+
+
+def test_failed_lookup_discards_transform(event_listener, mocker):
+    # ARRANGE
+    lookup_error = NackException("Fragment not found in MH for media id")
+    mocker.patch.object(event_listener, "_get_fragment_id", side_effect=lookup_error)
+    mocker.patch.object(
+        event_listener,
+        "_transform_metadata",
+        side_effect=NackException("Failed to transform metadata."),
+    )
+
+    # ACT
+    with pytest.raises(NackException) as exc_info:
+        event_listener._get_fragment_id_and_transform(mocker.MagicMock())
+
+    # ASSERT
+    assert exc_info.value is lookup_error
+
+
+def test_unexpected_lookup_error_cancels_transform(event_listener, mocker):
+    # ARRANGE
+    event_listener.transform_executor = ThreadPoolExecutor(1)
+    # Keeps the transform waiting in the queue
+    release = threading.Event()
+    event_listener.transform_executor.submit(release.wait, 5)
+    mocker.patch.object(event_listener, "_get_fragment_id", side_effect=KeyError("x"))
+    transform_metadata = mocker.patch.object(event_listener, "_transform_metadata")
+
+    # ACT
+    with pytest.raises(KeyError):
+        event_listener._get_fragment_id_and_transform(mocker.MagicMock())
+    release.set()
+    event_listener.transform_executor.shutdown()
+
+    # ASSERT
+    transform_metadata.assert_not_called()
+
+
+def test_route_message_publishes_to_shard_exchange(event_listener, mocker):
+    # ARRANGE
+    publish_batch = mocker.patch.object(event_listener.publisher, "publish_batch")
+    channel = mocker.MagicMock()
+    method = mocker.MagicMock(delivery_tag=1, routing_key="vrt.metadataUpdatedEvent")
+    body = resources.load_xml_resource("metadataUpdatedEvent")
+
+    # ACT
+    event_listener.route_message(channel, method, pika.BasicProperties(), body)
+
+    # ASSERT
+    exchange, _, bodies = publish_batch.call_args.args
+    [headers] = publish_batch.call_args.kwargs["headers"]
+    assert exchange == event_listener.sharding_policy.exchange
+    assert bodies == [body]
+    assert headers[MEDIA_ID_HEADER] == "TESTJEVANRUDOLF"
+    assert headers[ORIGINAL_ROUTING_KEY_HEADER] == "vrt.metadataUpdatedEvent"
+    channel.basic_ack.assert_called_once_with(delivery_tag=1)
+
+
+def test_route_message_retries_when_publish_fails(event_listener, mocker):
+    # ARRANGE
+    mocker.patch.object(
+        event_listener.publisher,
+        "publish_batch",
+        side_effect=PublishError("Publisher channel is closed."),
+    )
+    publish = mocker.patch.object(event_listener.publisher, "publish")
+    channel = mocker.MagicMock()
+    method = mocker.MagicMock(delivery_tag=1, routing_key="vrt.metadataUpdatedEvent")
+    body = resources.load_xml_resource("metadataUpdatedEvent")
+
+    # ACT
+    event_listener.route_message(channel, method, pika.BasicProperties(), body)
+
+    # ASSERT
+    assert publish.call_args.args[1] == "queue.retry.1"
+    channel.basic_ack.assert_called_once_with(delivery_tag=1)
+
+
+def test_open_breaker_pauses_consumption(event_listener, mocker):
+    # ARRANGE
+    event_listener.mediahaven_client = mocker.MagicMock()
+    event_listener.mediahaven_client.records.search.side_effect = ConnectionError()
+    event_listener.rate_limiter = mocker.MagicMock()
+    event_listener.rabbit_client = mocker.MagicMock()
+    event_listener.rabbit_client.call_threadsafe.side_effect = lambda fn: fn()
+    breaker = event_listener.breakers["mediahaven_search"]
+    event = mocker.MagicMock()
+
+    # ACT
+    for _ in range(breaker.failure_threshold + 1):
+        with pytest.raises(NackException) as nack_exception:
+            event_listener._get_items_for_media_id(event)
+
+    # ASSERT
+    assert nack_exception.value.message == "Circuit breaker is open, requeueing...."
+    assert nack_exception.value.redeliver
+    assert (
+        event_listener.mediahaven_client.records.search.call_count
+        == breaker.failure_threshold
+    )
+    assert event_listener.rabbit_client.pause.call_count == 2
+    delay, resume = event_listener.rabbit_client.call_later.call_args_list[0].args
+    assert delay == breaker.reset_timeout
+
+    breaker.opened_at -= breaker.reset_timeout
+    resume()
+    event_listener.rabbit_client.resume.assert_called_once()
+
+
+def test_rejected_token_is_refreshed_once(event_listener, mocker):
+    # ARRANGE
+    rejected = MediaHavenException("Unauthorized", status_code=401)
+    update = mocker.MagicMock(side_effect=[rejected, None])
+    refresh = mocker.patch.object(event_listener.token_manager, "refresh")
+    generation = event_listener.token_manager.generation
+
+    # ACT
+    event_listener._call_mediahaven(update, "fragment", metadata="<mh/>")
+
+    # ASSERT
+    refresh.assert_called_once_with(generation)
+    assert update.call_count == 2
+
+
+def test_handle_nack_exception_redelivers_without_retry(event_listener, mocker):
+    # ARRANGE
+    publish = mocker.patch.object(event_listener.publisher, "publish")
+    channel = mocker.MagicMock()
+    method = mocker.MagicMock(delivery_tag=1)
+    nack_exception = NackException("Circuit breaker is open", redeliver=True)
+
+    # ACT
+    event_listener._handle_nack_exception(
+        nack_exception, channel, method, pika.BasicProperties(), b"body"
+    )
+
+    # ASSERT
+    channel.basic_nack.assert_called_once_with(delivery_tag=1, requeue=True)
+    channel.basic_ack.assert_not_called()
+    publish.assert_not_called()
+
+
+def test_batch_transforms_run_at_the_same_time(mock_rabbit, mock_mediahaven, mocker):
+    # ARRANGE
+    config_parser = ConfigParser()
+    config_parser.app_cfg = copy.deepcopy(config_parser.app_cfg)
+    config_parser.app_cfg["batching"]["size"] = 4
+    config_parser.app_cfg["batching"]["fan_out"] = 4
+    mocker.patch("app.app.ConfigParser", return_value=config_parser)
+    event_listener = EventListener()
+    xml = resources.load_xml_resource("getMetadataResponse")
+    events = [
+        EventParser().get_event(
+            "getMetadataResponse", xml.replace(b">TEST_ID<", f">ID_{i}<".encode())
+        )
+        for i in range(4)
+    ]
+    # Only passes when the four transforms wait for each other at once
+    barrier = threading.Barrier(4, timeout=5)
+
+    def transform_metadata(event):
+        barrier.wait()
+        return "<mh/>"
+
+    mocker.patch.object(event_listener, "_prefetch_fragment_ids")
+    mocker.patch.object(event_listener, "_get_fragment_id", return_value="fragment")
+    mocker.patch.object(
+        event_listener, "_transform_metadata", side_effect=transform_metadata
+    )
+    mocker.patch.object(event_listener, "_update_metadata")
+    mocker.patch.object(event_listener, "_request_subtitles")
+
+    # ACT
+    results = event_listener._apply_batch(events)
+
+    # ASSERT
+    assert results == ["updated"] * 4
+
+
+def test_batch_runs_off_the_connection_thread(mock_rabbit, mock_mediahaven, mocker):
+    # ARRANGE
+    config_parser = ConfigParser()
+    config_parser.app_cfg = copy.deepcopy(config_parser.app_cfg)
+    config_parser.app_cfg["batching"]["size"] = 2
+    mocker.patch("app.app.ConfigParser", return_value=config_parser)
+    mocker.patch.object(RabbitClient, "call_later")
+    call_threadsafe = mocker.patch.object(RabbitClient, "call_threadsafe")
+    event_listener = EventListener()
+    threads = []
+
+    def process_batch(batch):
+        threads.append(threading.current_thread().name)
+        assert all(isinstance(message[0], ThreadSafeChannel) for message in batch)
+
+    mocker.patch.object(event_listener, "_process_batch", side_effect=process_batch)
+    channel = mocker.MagicMock()
+
+    # ACT
+    for delivery_tag in range(1, 4):
+        method = mocker.MagicMock(delivery_tag=delivery_tag)
+        event_listener.batcher.add((channel, method, None, b"body", None))
+    event_listener.batch_runner.shutdown()
+
+    # ASSERT
+    assert len(threads) == 1
+    assert threads[0].startswith("batch-runner")
+    # The next batch is held back until the connection thread hears it's done
+    assert event_listener.batcher.busy
+    assert len(event_listener.batcher.items) == 1
+    call_threadsafe.assert_called_once_with(event_listener.batcher.done)
+
+
+def test_process_event_retries_unexpected_error(event_listener, mocker):
+    # ARRANGE
+    mocker.patch.object(event_listener, "_apply_event", side_effect=KeyError("x"))
+    handle_nack_exception = mocker.patch.object(
+        event_listener, "_handle_nack_exception"
+    )
+    channel = mocker.MagicMock()
+    method = mocker.MagicMock(delivery_tag=1)
+    event = mocker.MagicMock()
+
+    # ACT
+    event_listener._process_event(channel, method, None, b"body", event)
+
+    # ASSERT
+    nack_exception = handle_nack_exception.call_args.args[0]
+    assert nack_exception.requeue
+    assert isinstance(nack_exception.kwargs["error"], KeyError)
+    channel.basic_ack.assert_not_called()
@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+from tests.resources import resources
+from tests.resources.mocks import mock_rabbit, mock_mediahaven
+from app.app import NackException
+from app.async_app import AsyncEventListener
+
+
+class FakeMessage:
+    """Stands in for an aio-pika incoming message."""
+
+    def __init__(self, body, routing_key="vrt.getMetadataResponse"):
+        self.body = body
+        self.routing_key = routing_key
+        self.headers = {}
+        self.content_type = None
+        self.acked = False
+        self.nacked = False
+
+    async def ack(self):
+        self.acked = True
+
+    async def nack(self, requeue=True):
+        self.nacked = True
+
+
+@pytest.fixture
+def async_event_listener(mock_rabbit, mock_mediahaven):
+    event_listener = AsyncEventListener()
+    yield event_listener
+    event_listener.executor.shutdown()
+
+
+def test_handle_message_async_keeps_order_per_media_id(async_event_listener, mocker):
+    # ARRANGE
+    order = []
+
+    async def process(message, event):
+        order.append(("start", message))
+        await asyncio.sleep(0)
+        order.append(("end", message))
+        await message.ack()
+
+    mocker.patch.object(async_event_listener, "_process_event_async", process)
+    body = resources.load_xml_resource("getMetadataResponse")
+    first, second = FakeMessage(body), FakeMessage(body)
+
+    # ACT
+    async def run():
+        async_event_listener.semaphore = asyncio.Semaphore(10)
+        await asyncio.gather(
+            async_event_listener.handle_message_async(first),
+            async_event_listener.handle_message_async(second),
+        )
+
+    asyncio.run(run())
+
+    # ASSERT
+    assert order == [
+        ("start", first),
+        ("end", first),
+        ("start", second),
+        ("end", second),
+    ]
+    assert first.acked and second.acked
+    assert not async_event_listener.media_id_locks
+
+
+def test_process_event_async_nacks_on_error(async_event_listener, mocker):
+    # ARRANGE
+    mocker.patch.object(
+        async_event_listener,
+        "_get_fragment_id",
+        side_effect=NackException("Fragment not found"),
+    )
+    body = resources.load_xml_resource("getMetadataResponse")
+    message = FakeMessage(body)
+    event = async_event_listener._parse_event(message, message, body)
+
+    # ACT
+    asyncio.run(async_event_listener._process_event_async(message, event))
+
+    # ASSERT
+    assert message.nacked
+    assert not message.acked
+
+
+def test_process_event_async_retries_on_unexpected_error(async_event_listener, mocker):
+    # ARRANGE
+    mocker.patch.object(
+        async_event_listener, "_get_fragment_id", side_effect=Exception("Boom")
+    )
+    handle_nack = mocker.patch.object(
+        async_event_listener, "_handle_nack_exception_async"
+    )
+    body = resources.load_xml_resource("getMetadataResponse")
+    message = FakeMessage(body)
+    event = async_event_listener._parse_event(message, message, body)
+
+    # ACT
+    asyncio.run(async_event_listener._process_event_async(message, event))
+
+    # ASSERT
+    nack_exception, nacked_message = handle_nack.call_args.args
+    assert nack_exception.requeue
+    assert nacked_message is message
+    assert not message.acked
@@ -0,0 +1,148 @@
+import io
+import json
+import tarfile
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from tests.resources import resources
+from app import replay
+from app.replay import load_checkpoint, read_source, sniff_event_type
+
+
+def test_sniff_event_type():
+    # ARRANGE
+    body = resources.load_xml_resource("metadataUpdatedEvent")
+
+    # ACT
+    event_type = sniff_event_type(body)
+
+    # ASSERT
+    assert event_type == "metadataUpdatedEvent"
+
+
+def test_read_source_directory(tmp_path):
+    # ARRANGE
+    (tmp_path / "a.xml").write_bytes(b"<a/>")
+    (tmp_path / "notes.txt").write_bytes(b"skip me")
+
+    # ACT
+    records = list(read_source(str(tmp_path)))
+
+    # ASSERT
+    assert records == [("a.xml", None, b"<a/>")]
+
+
+def test_read_source_tarball(tmp_path):
+    # ARRANGE
+    path = tmp_path / "events.tar.gz"
+    with tarfile.open(path, "w:gz") as tar:
+        info = tarfile.TarInfo("events/a.xml")
+        info.size = 4
+        tar.addfile(info, io.BytesIO(b"<a/>"))
+
+    # ACT
+    records = list(read_source(str(path)))
+
+    # ASSERT
+    assert records == [("events/a.xml", None, b"<a/>")]
+
+
+def test_read_source_jsonl(tmp_path):
+    # ARRANGE
+    path = tmp_path / "events.jsonl"
+    path.write_text(
+        json.dumps({"routing_key": "vrt.getMetadataResponse", "body": "<a/>"})
+        + "\n"
+        + json.dumps({"id": "b", "event_type": "metadataUpdatedEvent", "body": "<b/>"})
+        + "\n"
+    )
+
+    # ACT
+    records = list(read_source(str(path)))
+
+    # ASSERT
+    assert records == [
+        ("1", "getMetadataResponse", b"<a/>"),
+        ("b", "metadataUpdatedEvent", b"<b/>"),
+    ]
+
+
+def test_load_checkpoint_only_returns_updated_events(tmp_path):
+    # ARRANGE
+    path = tmp_path / "checkpoint.jsonl"
+    path.write_text(
+        json.dumps({"source": "/events"})
+        + "\n"
+        + json.dumps({"id": "a", "status": "updated", "reason": None})
+        + "\n"
+        + json.dumps({"id": "b", "status": "failed", "reason": "Nope"})
+        + "\n"
+    )
+
+    # ACT
+    done = load_checkpoint(str(path), "/events")
+
+    # ASSERT
+    assert done == {"a"}
+
+
+def _main(mocker, source, checkpoint=None):
+    config_parser = mocker.patch.object(replay, "ConfigParser")
+    config_parser.return_value.app_cfg = {"mediahaven": {"rate_limit": {}}}
+    mocker.patch.object(replay.SharedRateLimiter, "from_config")
+    # Threads instead of processes, so _replay can be replaced
+    mocker.patch.object(
+        replay, "ProcessPoolExecutor", lambda *args, **kwargs: ThreadPoolExecutor(1)
+    )
+    mocker.patch.object(replay, "_replay", lambda record: (record[0], "updated", None))
+    argv = [str(source), "--processes", "1"]
+    if checkpoint:
+        argv += ["--checkpoint", checkpoint]
+    return replay.main(argv)
+
+
+def test_replay_is_resumed_for_the_same_source_only(tmp_path, mocker):
+    # ARRANGE
+    first, second = tmp_path / "first", tmp_path / "second"
+    for source in (first, second):
+        source.mkdir()
+        (source / "a.xml").write_bytes(b"<a/>")
+    (first / "b.xml").write_bytes(b"<b/>")
+    checkpoint = str(tmp_path / "checkpoint.jsonl")
+
+    # ACT
+    replayed = _main(mocker, first, checkpoint)
+    resumed = _main(mocker, first, checkpoint)
+
+    # ASSERT
+    assert (replayed["updated"], replayed["skipped"]) == (2, 0)
+    assert (resumed["updated"], resumed["skipped"]) == (0, 2)
+    with pytest.raises(ValueError, match="is of"):
+        _main(mocker, second, checkpoint)
+
+
+def test_replay_without_checkpoint_skips_nothing(tmp_path, mocker):
+    # ARRANGE
+    (tmp_path / "a.xml").write_bytes(b"<a/>")
+
+    # ACT
+    summaries = [_main(mocker, tmp_path) for _ in range(2)]
+
+    # ASSERT
+    assert [(s["updated"], s["skipped"]) for s in summaries] == [(1, 0), (1, 0)]
+    assert list(tmp_path.iterdir()) == [tmp_path / "a.xml"]
+
+
+def test_replay_fails_on_unexpected_error(mocker):
+    # ARRANGE
+    pipeline = mocker.Mock()
+    pipeline.replay.side_effect = RuntimeError("Boom")
+    mocker.patch.object(replay, "_pipeline", pipeline)
+    body = resources.load_xml_resource("metadataUpdatedEvent")
+
+    # ACT
+    result = replay._replay(("a", None, body))
+
+    # ASSERT
+    assert result == ("a", "failed", "Unexpected error: Boom")